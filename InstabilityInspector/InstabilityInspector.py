@@ -11,7 +11,6 @@ import onnxruntime
 import pandas as pd
 import torch
 import glob
-from onnx import numpy_helper
 from onnx2pytorch import ConvertModel
 from torch.utils.data import Subset, DataLoader
 
@@ -63,16 +62,17 @@ def get_fc_weights_biases(model, verbose: bool = False):
     weights = []
     biases = []
 
-    initializer = model.graph.initializer
+    # Read-only views of the initializers, shared with the conversion of the model
+    parameters = pyn_con.get_onnx_parameters(model)
 
     weights_pattern = re.compile(r'weight$')
     biases_pattern = re.compile(r'bias$')
 
-    for i in initializer:
-        if biases_pattern.search(i.name):
-            biases.append(numpy_helper.to_array(i))
-        elif weights_pattern.search(i.name):
-            weights.append(numpy_helper.to_array(i))
+    for name, value in parameters.items():
+        if biases_pattern.search(name):
+            biases.append(value)
+        elif weights_pattern.search(name):
+            weights.append(value)
 
     return weights, biases
 
@@ -86,8 +86,11 @@ class InstabilityInspector:
         # The neural network model must be in onnx format
         self.model_path = model_path
 
-        # Load onnx model
-        self.model = onnx.load(self.model_path)
+        # Load onnx model, the weights are memory-mapped when they are stored as external data
+        self.model = pyn_con.load_onnx_model(self.model_path)
+
+        # Key of the model for the conversion cache
+        self.model_hash = pyn_con.onnx_file_hash(self.model_path, self.model)
 
         # Path where the folders will be created
         self.folder_path = folder_path
@@ -220,7 +223,7 @@ class InstabilityInspector:
         for property in properties_list:
             net_id = ''.join(str(random.randint(0, 9)) for _ in range(5))
 
-            onnx_network = pyn_con.ONNXNetwork(net_id, self.model)
+            onnx_network = pyn_con.ONNXNetwork(net_id, self.model, model_hash=self.model_hash)
             network = pyn_con.ONNXConverter().to_neural_network(onnx_network)
 
             bounds_manager = bp.BoundsManager(network, None)
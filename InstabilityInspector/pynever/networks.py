@@ -73,6 +73,7 @@ class NeuralNetwork:
 
         self.edges.pop(node.identifier)
         self.nodes.pop(node.identifier)
+        self.invalidate_alt_reps()
 
         return
 
@@ -101,6 +102,18 @@ class NeuralNetwork:
         for parent in parents:
             self.edges[parent.identifier].append(node.identifier)
 
+        self.invalidate_alt_reps()
+
+    def invalidate_alt_reps(self):
+        """
+        Procedure to discard the AlternativeRepresentations built from the internal representation, after it
+        has been modified.
+
+        """
+
+        if self.up_to_date:
+            self.alt_rep_cache.clear()
+
     def is_acyclic(self):
 
         aux_network = copy.deepcopy(self)
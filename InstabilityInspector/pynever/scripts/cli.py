@@ -1,9 +1,9 @@
 import csv
 import logging
 import os
-import re
 import sys
 import time
+from typing import Union
 
 import InstabilityInspector.pynever.networks as nets
 import InstabilityInspector.pynever.strategies.conversion as conv
@@ -17,7 +17,8 @@ logger.setLevel(logging.INFO)
 logger.addHandler(logging.StreamHandler(sys.stdout))
 
 
-def verify_single_model(safety_prop: bool, model_file: str, property_file: str, strategy: str, logfile: str) -> bool:
+def verify_single_model(safety_prop: bool, model_file: str, property_file: Union[str, ver.NeVerProperty], strategy: str,
+                        logfile: str) -> bool:
     """
     This method starts the verification procedure on the network model
     provided in the model_file path and prints the result
@@ -28,8 +29,8 @@ def verify_single_model(safety_prop: bool, model_file: str, property_file: str,
         Specifies if the property is for safe or unsafe zone
     model_file : str
         Path to the .onnx file of the network
-    property_file : str
-        Path to the .vnnlib or .smt2 file of the property
+    property_file : str or NeVerProperty
+        Path to the .vnnlib or .smt2 file of the property, or the property itself
     strategy : str
         Verification strategy (either complete, approximate, mixed)
     logfile : str
@@ -43,13 +44,14 @@ def verify_single_model(safety_prop: bool, model_file: str, property_file: str,
     """
 
     nn_path = os.path.abspath(model_file)
-    prop_path = os.path.abspath(property_file)
+    in_memory_prop = isinstance(property_file, ver.NeVerProperty)
+    prop_path = None if in_memory_prop else os.path.abspath(property_file)
 
     if not os.path.isfile(nn_path):
         print(f'Error: file {nn_path} not found!')
         return False
 
-    elif not os.path.isfile(prop_path):
+    elif not in_memory_prop and not os.path.isfile(prop_path):
         print(f'Error: file {prop_path} not found!')
         return False
 
@@ -63,15 +65,16 @@ def verify_single_model(safety_prop: bool, model_file: str, property_file: str,
 
                 if isinstance(network, nets.SequentialNetwork):
                     # Read the property file
-                    to_verify = ver.NeVerProperty()
-
-                    if safety_prop:
-                        neg_post_condition(prop_path)
-                        to_verify.from_smt_file(os.path.abspath('pynever/scripts/intermediate.vnnlib'))
-                        os.remove('pynever/scripts/intermediate.vnnlib')
+                    if in_memory_prop:
+                        to_verify = property_file
                     else:
+                        to_verify = ver.NeVerProperty()
                         to_verify.from_smt_file(prop_path)
 
+                    # The post-condition is negated in memory
+                    if safety_prop:
+                        to_verify = to_verify.negated_post_condition()
+
                     params = []
                     if strategy == 'overapprox':
                         params = [[0] for _ in range(network.count_relu_layers())]
@@ -79,10 +82,10 @@ def verify_single_model(safety_prop: bool, model_file: str, property_file: str,
                         params = [[1] for _ in range(network.count_relu_layers())]
                     elif strategy == 'complete':
                         params = [[10000] for _ in range(network.count_relu_layers())]
-                    ver_strategy = ver.NeverVerification(strategy, params)
+                    ver_strategy = ver.NeverVerification(strategy, params, optimize=True)
 
                     model_name = os.path.basename(nn_path)
-                    property_name = os.path.basename(property_file)
+                    property_name = 'in-memory property' if in_memory_prop else os.path.basename(property_file)
 
                     ver_start_time = time.perf_counter()
                     safe = ver_strategy.verify(network, to_verify)
@@ -202,67 +205,3 @@ def reformat_counterexample(counterexample: Tensor) -> str:
     response = response[:-1]
     response += ']'
     return response
-
-
-def neg_post_condition(prop_path: str) -> None:
-    """
-    This method negates the property post-condition in order
-    to represent both safety and unsafety properties
-
-    Parameters
-    ----------
-    prop_path : str
-        Path to the property file
-
-    """
-
-    def replace_with_negatives(match):
-        number = match.group()
-        if number not in ("0", "0.0") and match.string[match.start() - 1] != '_':
-            number = float(number)
-            negative_number = -number
-            return str(negative_number)
-        return number
-
-    with open(prop_path, 'r', newline='') as cur_prop:
-        with open('pynever/scripts/intermediate.vnnlib', 'w', newline='') as new_prop:
-            # List of post-condition constraints
-            y_constraints = []
-
-            # Read file
-            for row in cur_prop:
-                # Filter declarations
-                if not (row.find('Y') and row.find('assert')):
-                    new_prop.write(row)
-
-                else:
-                    if row.find('<') > 0 and row.find('Y') > 0:
-                        if row.find('(* -1.0') > 0:
-                            temp_row = row.replace('(assert (<= (* -1.0', '(<=')
-                            temp_row = temp_row[:temp_row.find(')')] + temp_row[temp_row.find(')') + 1:]
-                            pattern = r'(?<!_)-?\d+\.\d+|(?<!_)-?\d+'
-                            temp_row = re.sub(pattern, replace_with_negatives, temp_row)
-                        else:
-                            temp_row = row.replace('(assert (<=', '(>=')
-
-                    elif row.find('>') > 0 and row.find('Y') > 0:
-                        if row.find('(* -1.0') > 0:
-                            temp_row = row.replace('(assert (>= (* -1.0', '(>=')
-                            temp_row = temp_row[:temp_row.find(')')] + temp_row[temp_row.find(')') + 1:]
-                            pattern = r'(?<!_)-?\d+\.\d+|(?<!_)-?\d+'
-                            temp_row = re.sub(pattern, replace_with_negatives, temp_row)
-                        else:
-                            temp_row = row.replace('(assert (>=', '(<=')
-
-                    else:
-                        new_prop.write(row)
-                        continue
-
-                    temp_row = temp_row[:temp_row.rfind(')')] + temp_row[temp_row.rfind(')') + 1:]
-                    y_constraints.extend(temp_row)
-
-            new_prop.write('(assert (or \n')
-
-            for row in y_constraints:
-                new_prop.write(row)
-            new_prop.write('\n))')
@@ -1,12 +1,16 @@
 import abc
+import collections
 import copy
+import io
 import itertools
 import logging
 import math
 import multiprocessing
+import pickle
 import time
+from multiprocessing import shared_memory, resource_tracker
 import uuid
-from typing import Set, List, Union, Tuple, Optional
+from typing import Set, List, Union, Tuple, Optional, Callable, Iterator
 
 import numpy as np
 import numpy.linalg as la
@@ -23,6 +27,9 @@ logger_ub = logging.getLogger("pynever.strategies.abstraction.ub_times")
 
 parallel = True
 
+# Number of constraints above which the predicate of a derived star is simplified (None disables the simplification)
+predicate_simplification_threshold = 200
+
 
 class AbsElement(abc.ABC):
     """
@@ -54,6 +61,11 @@ class Star:
     We refer to <Star-Based Reachability Analysis of Deep Neural Networks>
     (https://link.springer.com/chapter/10.1007/978-3-030-30942-8_39) for details.
 
+    The predicate is stored as a tuple of blocks of constraints which are shared (never copied) between a star and
+    the stars derived from it: a derived star only stores the blocks of its new constraints. A block with fewer
+    columns than the number of predicate variables has zero coefficients for the missing (most recent) variables.
+    The matrices of a star must never be modified in place.
+
     Attributes
     ----------
     center : Tensor
@@ -61,13 +73,15 @@ class Star:
     basis_matrix : Tensor
         Matrix composed by the basis vectors of the Star
     predicate_matrix : Tensor
-        Matrix of the Predicate.
+        Matrix of the Predicate (read-only, built from the predicate blocks).
     predicate_bias : Tensor
-        Bias of the Predicate.
-    ubs : list
-        Upper bounds of the points defined by the Star.
-    lbs : list
-        Lower bounds of the points defined by the Star.
+        Bias of the Predicate (read-only, built from the predicate blocks).
+    predicate_blocks : tuple
+        Blocks (matrix, bias) of the constraints of the Predicate.
+    ubs : Tensor
+        Upper bounds of the points defined by the Star (NaN if not computed yet).
+    lbs : Tensor
+        Lower bounds of the points defined by the Star (NaN if not computed yet).
     is_empty : bool
         Boolean flag: True if the Star defines an empty set of points, False otherwise
 
@@ -77,9 +91,19 @@ class Star:
         Function used to get the upper and lower bounds of the n variables of the star.
     check_if_empty()
         Function used to check if the star corresponds to an empty set.
+    derive(Tensor, Tensor, Tensor, Tensor)
+        Function used to build a new star sharing the predicate of the star.
+    from_predicate_blocks(tuple, Tensor, Tensor)
+        Function used to build a star from the blocks of its predicate.
+    simplify_predicate()
+        Procedure to remove the redundant constraints of the predicate.
 
     """
 
+    __slots__ = ('center', 'basis_matrix', 'predicate_blocks', 'lbs', 'ubs', 'is_empty', 'ref_layer', 'ref_neuron',
+                 '_current_point', '_simplified_size', '_witness', '_alpha_lower', '_alpha_upper',
+                 '_start_point')
+
     def __init__(self, predicate_matrix: Tensor, predicate_bias: Tensor, center: Tensor = None,
                  basis_matrix: Tensor = None, is_empty: bool = None):
 
@@ -87,12 +111,9 @@ class Star:
                                 f"must be equal to the dimension of the predicate_bias ({predicate_bias.shape[0]})."
         assert predicate_matrix.shape[0] == predicate_bias.shape[0], predicate_dim_message
 
-        self.predicate_matrix = predicate_matrix
-        self.predicate_bias = predicate_bias
-
         if center is None and basis_matrix is None:
-            self.center = np.zeros((predicate_matrix.shape[1], 1))
-            self.basis_matrix = np.identity(predicate_matrix.shape[1])
+            center = np.zeros((predicate_matrix.shape[1], 1))
+            basis_matrix = np.identity(predicate_matrix.shape[1])
 
         else:
             center_dim_message = f"Error: the first dimension of the basis_matrix ({basis_matrix.shape[0]}) " \
@@ -104,11 +125,18 @@ class Star:
                                 f"({predicate_matrix.shape[1]})."
             assert basis_matrix.shape[1] == predicate_matrix.shape[1], basis_dim_message
 
-            self.center = center
-            self.basis_matrix = basis_matrix
+        self.__set_attributes(((predicate_matrix, predicate_bias),), center, basis_matrix, is_empty)
+        self._alpha_lower, self._alpha_upper = _single_var_bounds(predicate_matrix, predicate_bias.reshape(-1),
+                                                                  basis_matrix.shape[1])
+
+    def __set_attributes(self, predicate_blocks: tuple, center: Tensor, basis_matrix: Tensor, is_empty: bool):
+
+        self.predicate_blocks = predicate_blocks
+        self.center = center
+        self.basis_matrix = basis_matrix
 
-        self.lbs = [None for _ in range(self.center.shape[0])]
-        self.ubs = [None for _ in range(self.center.shape[0])]
+        self.lbs = np.full(self.center.shape[0], np.nan)
+        self.ubs = np.full(self.center.shape[0], np.nan)
         self.is_empty = is_empty
 
         # Reference layer of the star (where it comes from)
@@ -118,8 +146,337 @@ class Star:
         self.ref_neuron = 0
 
         # Private Attributes used for the sampling of the star.
-        self.__auxiliary_points = None
-        self.__current_point = None
+        self._current_point = None
+
+        # Number of constraints after the last simplification of the predicate.
+        self._simplified_size = 0
+
+        # Point (with respect to the predicate variables) known to satisfy the predicate and box containing the
+        # predicate: they are used to decide the emptiness of the derived stars without solving LPs.
+        self._witness = None
+        self._alpha_lower = None
+        self._alpha_upper = None
+
+        # Interior point of the predicate used to start the hit and run chains.
+        self._start_point = None
+
+    @property
+    def predicate_matrix(self) -> Tensor:
+
+        if len(self.predicate_blocks) == 1 and self.predicate_blocks[0][0].shape[1] == self.n_vars:
+            return self.predicate_blocks[0][0]
+
+        predicate_matrix = np.zeros((self.n_constraints, self.n_vars))
+        row = 0
+        for block_matrix, _ in self.predicate_blocks:
+            predicate_matrix[row:row + block_matrix.shape[0], :block_matrix.shape[1]] = block_matrix
+            row += block_matrix.shape[0]
+
+        return predicate_matrix
+
+    @property
+    def predicate_bias(self) -> Tensor:
+
+        if len(self.predicate_blocks) == 1:
+            return self.predicate_blocks[0][1]
+
+        return np.vstack([block_bias for _, block_bias in self.predicate_blocks])
+
+    @property
+    def n_vars(self) -> int:
+        """
+        The number of variables of the predicate.
+
+        """
+
+        return self.basis_matrix.shape[1]
+
+    @property
+    def n_constraints(self) -> int:
+        """
+        The number of constraints of the predicate.
+
+        """
+
+        return sum(block_matrix.shape[0] for block_matrix, _ in self.predicate_blocks)
+
+    @staticmethod
+    def from_predicate_blocks(predicate_blocks: tuple, center: Tensor, basis_matrix: Tensor,
+                              is_empty: bool = None) -> 'Star':
+        """
+        Function used to build a star whose predicate is given as a tuple of blocks (matrix, bias), which are shared
+        and not copied.
+
+        Parameters
+        ----------
+        predicate_blocks : tuple
+            Blocks (matrix, bias) of the constraints of the Predicate.
+        center : Tensor
+            Center of the new Star.
+        basis_matrix : Tensor
+            Basis matrix of the new Star.
+        is_empty : bool
+            Optional emptiness of the new Star.
+
+        Returns
+        ----------
+        Star
+            The new Star.
+
+        """
+
+        assert all(block_matrix.shape[1] <= basis_matrix.shape[1] for block_matrix, _ in predicate_blocks)
+
+        star = Star.__new__(Star)
+        star.__set_attributes(tuple(predicate_blocks), center, basis_matrix, is_empty)
+        star._alpha_lower, star._alpha_upper = _single_var_bounds(star.predicate_matrix,
+                                                                  star.predicate_bias.reshape(-1), star.n_vars)
+
+        return star
+
+    def derive(self, center: Tensor, basis_matrix: Tensor, coef_mat: Tensor = None, bias_mat: Tensor = None,
+               new_vars_bounds: Tuple[Tensor, Tensor] = None, witness: Tensor = None) -> 'Star':
+        """
+        Function used to build a new star with the given center and basis matrix whose predicate is the predicate of
+        this star, shared and not copied, plus the optional constraints coef_mat * a <= bias_mat. The basis matrix
+        may have more columns than the one of this star: the new predicate variables are unconstrained by the
+        existing constraints.
+
+        The emptiness of the new star is decided without LPs whenever possible: it is not empty if a feasible point
+        of this star (extended to the new variables) satisfies the new constraints, and it is empty if a new
+        constraint cannot be satisfied in the box of the predicate variables.
+
+        Parameters
+        ----------
+        center : Tensor
+            Center of the new Star.
+        basis_matrix : Tensor
+            Basis matrix of the new Star.
+        coef_mat : Tensor
+            Optional coefficient matrix of the constraints to add.
+        bias_mat : Tensor
+            Optional bias of the constraints to add.
+        new_vars_bounds : (Tensor, Tensor)
+            Optional lower and upper bounds of the new predicate variables implied by the predicate.
+        witness : Tensor
+            Optional candidate feasible point of the new star, extending the feasible point of this star.
+
+        Returns
+        ----------
+        Star
+            The new Star.
+
+        """
+
+        center_dim_message = f"Error: the first dimension of the basis_matrix ({basis_matrix.shape[0]}) " \
+                             f"must be equal to the dimension of the center ({center.shape[0]})."
+        assert center.shape[0] == basis_matrix.shape[0], center_dim_message
+        assert basis_matrix.shape[1] >= self.n_vars, "Error: the predicate variables cannot be removed."
+
+        predicate_blocks = self.predicate_blocks
+        if coef_mat is not None:
+            coef_mat = np.atleast_2d(coef_mat)
+            bias_mat = np.reshape(bias_mat, (-1, 1))
+            assert coef_mat.shape[0] == bias_mat.shape[0] and coef_mat.shape[1] <= basis_matrix.shape[1]
+            predicate_blocks = predicate_blocks + ((coef_mat, bias_mat),)
+
+        new_star = Star.__new__(Star)
+        new_star.__set_attributes(predicate_blocks, center, basis_matrix, None)
+        new_star._simplified_size = self._simplified_size
+
+        n_new_vars = basis_matrix.shape[1] - self.n_vars
+        if self._alpha_lower is not None:
+            if new_vars_bounds is not None:
+                new_lower = np.reshape(new_vars_bounds[0], -1)
+                new_upper = np.reshape(new_vars_bounds[1], -1)
+            else:
+                new_lower = np.full(n_new_vars, -np.inf)
+                new_upper = np.full(n_new_vars, np.inf)
+            new_star._alpha_lower = np.concatenate((self._alpha_lower, new_lower))
+            new_star._alpha_upper = np.concatenate((self._alpha_upper, new_upper))
+
+        if self._witness is not None and witness is None:
+            witness = np.vstack((self._witness, np.zeros((n_new_vars, 1))))
+
+        if self._start_point is not None:
+            new_star.set_start_point(np.vstack((self._start_point, np.zeros((n_new_vars, 1)))), coef_mat, bias_mat)
+
+        if self.is_empty:
+            new_star.is_empty = True
+
+        elif coef_mat is None:
+            new_star.is_empty = self.is_empty
+            new_star._witness = witness
+
+        else:
+            new_star.__check_new_constraints(coef_mat, bias_mat, witness)
+
+        # The simplification is repeated only when the predicate has doubled since the last one.
+        if predicate_simplification_threshold is not None and coef_mat is not None and \
+                new_star.n_constraints > max(predicate_simplification_threshold, 2 * new_star._simplified_size):
+            new_star.simplify_predicate()
+
+        return new_star
+
+    def __check_new_constraints(self, coef_mat: Tensor, bias_mat: Tensor, witness: Optional[Tensor]):
+        """
+        Procedure to decide, when possible without LPs, the emptiness of a star obtained by adding the constraints
+        coef_mat * a <= bias_mat to a non-empty predicate: the witness (feasible for the previous constraints)
+        proves the star not empty if it satisfies the new ones, while a new constraint which cannot be satisfied
+        in the box of the predicate variables proves it empty.
+
+        """
+
+        tolerance = 1e-9
+        n_cols = coef_mat.shape[1]
+
+        if witness is not None and np.all(np.matmul(coef_mat, witness[:n_cols]) <= bias_mat + tolerance):
+            self.is_empty = False
+            self._witness = witness
+            return
+
+        if self._alpha_lower is not None:
+
+            # The box is tightened with the new single variable constraints.
+            new_lower, new_upper = _single_var_bounds(coef_mat, bias_mat.reshape(-1), self.n_vars)
+            self._alpha_lower = np.maximum(self._alpha_lower, new_lower)
+            self._alpha_upper = np.minimum(self._alpha_upper, new_upper)
+
+            lower = self._alpha_lower[:n_cols]
+            upper = self._alpha_upper[:n_cols]
+            with np.errstate(invalid='ignore'):
+                row_min = np.sum(np.where(coef_mat > 0, coef_mat * lower,
+                                          np.where(coef_mat < 0, coef_mat * upper, 0)), axis=1)
+
+            if np.any(self._alpha_lower > self._alpha_upper + tolerance) or \
+                    np.any(row_min > bias_mat.reshape(-1) + tolerance):
+                self.is_empty = True
+
+    def set_start_point(self, point: Tensor, coef_mat: Tensor = None, bias_mat: Tensor = None) -> bool:
+        """
+        Procedure to reuse an interior point of a predicate containing the predicate of this star as the starting
+        point of the hit and run algorithm: the point is kept only if it strictly satisfies the constraints
+        coef_mat * a <= bias_mat which are not shared with the containing predicate.
+
+        Parameters
+        ----------
+        point : Tensor
+            Interior point of the containing predicate.
+        coef_mat : Tensor
+            Optional matrix of the constraints to check.
+        bias_mat : Tensor
+            Optional bias of the constraints to check.
+
+        Returns
+        ----------
+        bool
+            True if the point has been kept, False otherwise.
+
+        """
+
+        if coef_mat is not None and \
+                not np.all(np.matmul(coef_mat, point[:coef_mat.shape[1]]) < bias_mat):
+            return False
+
+        self._start_point = point
+        return True
+
+    def __store_witness(self, alphas: list):
+        """
+        Procedure to store the solution of a feasible LP on the predicate as the witness of the star.
+
+        """
+
+        if self._witness is None:
+            self._witness = np.array([[alpha.solution_value()] for alpha in alphas])
+
+    def simplify_predicate(self) -> int:
+        """
+        Procedure to remove the redundant constraints of the predicate by means of cheap checks only (no LP is
+        solved): constraints with all zero coefficients, constraints parallel to a tighter one (including
+        duplicates) and constraints implied by the box defined by the single variable constraints. The resulting
+        predicate is stored in a single block and defines the same set of points. If the checks prove the predicate
+        infeasible the star is marked as empty and the predicate is left unchanged.
+
+        Returns
+        ----------
+        int
+            The number of removed constraints.
+
+        """
+
+        predicate_matrix = self.predicate_matrix
+        predicate_bias = self.predicate_bias.reshape(-1)
+        n_rows = predicate_matrix.shape[0]
+
+        norms = la.norm(predicate_matrix, axis=1)
+        zero_rows = norms == 0
+        if np.any(predicate_bias[zero_rows] < 0):
+            self.is_empty = True
+            return 0
+
+        matrix = predicate_matrix[~zero_rows] / norms[~zero_rows, None]
+        bias = predicate_bias[~zero_rows] / norms[~zero_rows]
+
+        # Among parallel constraints only the tightest one is kept: sorting by bias first makes it the first
+        # occurrence of its direction.
+        order = np.argsort(bias, kind='stable')
+        _, unique_indexes = np.unique(np.round(matrix[order], 12), axis=0, return_index=True)
+        selected = np.sort(order[unique_indexes])
+        matrix = matrix[selected]
+        bias = bias[selected]
+
+        # Box defined by the constraints on a single variable.
+        single_var = np.count_nonzero(matrix, axis=1) == 1
+        lower, upper = _single_var_bounds(matrix, bias, matrix.shape[1])
+
+        if np.any(lower > upper):
+            self.is_empty = True
+            return 0
+
+        # A constraint is implied by the box when its maximum over the box does not exceed its bias.
+        with np.errstate(invalid='ignore'):
+            contributions = np.where(matrix > 0, matrix * upper, np.where(matrix < 0, matrix * lower, 0))
+        implied = np.logical_and(~single_var, np.sum(contributions, axis=1) <= bias)
+
+        matrix = matrix[~implied]
+        bias = bias[~implied]
+
+        self.predicate_blocks = ((matrix, bias.reshape(-1, 1)),)
+        self._simplified_size = matrix.shape[0]
+
+        return n_rows - matrix.shape[0]
+
+    def get_witness(self) -> Optional[Tensor]:
+        """
+        Function which returns a point (with respect to the predicate variables) known to satisfy the predicate,
+        without solving LPs.
+
+        Returns
+        ----------
+        Tensor
+            The feasible point, or None if no such point is known.
+
+        """
+
+        return self._witness
+
+    def get_predicate_box(self) -> Tuple[Tensor, Tensor]:
+        """
+        Function which returns the box of the predicate variables implied by the constraints on single variables,
+        without solving LPs. Unbounded variables have infinite bounds.
+
+        Returns
+        ----------
+        (Tensor, Tensor)
+            The lower and upper bounds of the predicate variables.
+
+        """
+
+        if self._alpha_lower is None:
+            return np.full(self.n_vars, -np.inf), np.full(self.n_vars, np.inf)
+
+        return self._alpha_lower.copy(), self._alpha_upper.copy()
 
     def check_if_empty(self) -> bool:
         """
@@ -137,7 +494,7 @@ class Star:
 
             solver, alphas, constraints = self.__get_predicate_lp_solver()
             objective = solver.Objective()
-            for j in range(self.predicate_matrix.shape[1]):
+            for j in range(self.n_vars):
                 objective.SetCoefficient(alphas[j], 0)
             objective.SetOffset(0)
 
@@ -147,6 +504,7 @@ class Star:
                 self.is_empty = True
             else:
                 self.is_empty = False
+                self.__store_witness(alphas)
 
         end_time = time.perf_counter()
         logger_empty.debug(f"{end_time - start_time},")
@@ -164,7 +522,7 @@ class Star:
 
         """
 
-        if self.lbs[i] is None or self.ubs[i] is None or self.is_empty is None:
+        if np.isnan(self.lbs[i]) or np.isnan(self.ubs[i]) or self.is_empty is None:
 
             # print("Computing bounds")
             start_time = time.perf_counter()
@@ -185,12 +543,13 @@ class Star:
 
             if status == pywraplp.Solver.INFEASIBLE or status == pywraplp.Solver.ABNORMAL:
                 self.is_empty = True
-                self.lbs[i] = None
-                self.ubs[i] = None
+                self.lbs[i] = np.nan
+                self.ubs[i] = np.nan
                 ub_end = 0
                 ub_start = 0
             else:
                 self.is_empty = False
+                self.__store_witness(alphas)
 
                 lb = solver.Objective().Value()
                 objective.SetMaximization()
@@ -208,7 +567,7 @@ class Star:
             logger_lb.debug(f"{ub_end - ub_start},")
             logger_ub.debug(f"{lb_end - lb_start},")
 
-        return self.lbs[i], self.ubs[i]
+        return float(self.lbs[i]), float(self.ubs[i])
 
     def check_alpha_inside(self, alpha_point: Tensor) -> bool:
         """
@@ -227,13 +586,14 @@ class Star:
 
         """
 
-        dim_error_msg = f"Wrong dimensionality for alpha_point: it should be {self.predicate_matrix.shape[1]} by one."
-        assert alpha_point.shape[0] == self.predicate_matrix.shape[1], dim_error_msg
+        dim_error_msg = f"Wrong dimensionality for alpha_point: it should be {self.n_vars} by one."
+        assert alpha_point.shape[0] == self.n_vars, dim_error_msg
 
-        tests = np.matmul(self.predicate_matrix, alpha_point) <= self.predicate_bias
-        test = np.all(tests)
+        for block_matrix, block_bias in self.predicate_blocks:
+            if not np.all(np.matmul(block_matrix, alpha_point[:block_matrix.shape[1]]) <= block_bias):
+                return False
 
-        return test
+        return True
 
     def check_point_inside(self, point: Tensor, epsilon: float) -> bool:
         """
@@ -254,18 +614,7 @@ class Star:
 
         """
 
-        solver = pywraplp.Solver.CreateSolver('GLOP')
-        alphas = []
-        for j in range(self.basis_matrix.shape[1]):
-            new_alpha = solver.NumVar(-solver.infinity(), solver.infinity(), f'alpha_{j}')
-            alphas.append(new_alpha)
-
-        constraints = []
-        for k in range(self.predicate_matrix.shape[0]):
-            new_constraint = solver.Constraint(-solver.infinity(), self.predicate_bias[k, 0])
-            for j in range(self.predicate_matrix.shape[1]):
-                new_constraint.SetCoefficient(alphas[j], self.predicate_matrix[k, j])
-            constraints.append(new_constraint)
+        solver, alphas, constraints = self.__get_predicate_lp_solver()
 
         for i in range(self.basis_matrix.shape[0]):
             lb = point[i][0] - self.center[i][0] - epsilon
@@ -276,7 +625,7 @@ class Star:
             constraints.append(new_constraint)
 
         objective = solver.Objective()
-        for j in range(self.predicate_matrix.shape[1]):
+        for j in range(self.n_vars):
             objective.SetCoefficient(alphas[j], 0)
         objective.SetOffset(0)
 
@@ -285,77 +634,83 @@ class Star:
 
         return status == pywraplp.Solver.FEASIBLE or status == pywraplp.Solver.OPTIMAL
 
-    def get_samples(self, num_samples: int, reset_auxiliary: bool = False, new_start: bool = False) -> List[Tensor]:
+    def get_samples(self, num_samples: int, new_start: bool = False, num_chains: int = 1) -> Tensor:
+        """
+        Function which samples points of the star with the hit and run algorithm. The chains are advanced together:
+        the step limits of every chain are computed with a single product between the predicate matrix and the
+        matrix of the directions.
+
+        Parameters
+        ----------
+        num_samples : int
+            Number of points to sample.
+        new_start : bool
+            Flag which restarts the chains from the Chebyshev center of the predicate.
+        num_chains : int
+            Number of chains advanced in parallel.
+
+        Returns
+        ----------
+        Tensor
+            Array of shape (num_samples, dimension, 1) containing the sampled points.
+
+        """
+
+        samples = np.empty((0, self.center.shape[0], 1))
 
         # As first thing we need to get a valid starting point:
-        if self.check_if_empty():
-            return []
+        if num_samples <= 0 or self.check_if_empty():
+            return samples
 
-        if self.__auxiliary_points is None or reset_auxiliary:
-            auxiliary_points = self.__get_auxiliary_points()
-        else:
-            auxiliary_points = self.__auxiliary_points
+        predicate_matrix = self.predicate_matrix
+        predicate_bias = self.predicate_bias
 
-        if self.__current_point is None or new_start:
-            starting_point = self.__get_starting_point()
-            current_point = np.array(starting_point)
+        if self._current_point is None or new_start:
+            current_points = np.repeat(self.__get_starting_point(), num_chains, axis=1)
+        elif self._current_point.shape[1] != num_chains:
+            current_points = np.repeat(self._current_point[:, :1], num_chains, axis=1)
         else:
-            current_point = self.__current_point
+            current_points = self._current_point
+
+        slacks = predicate_bias - np.matmul(predicate_matrix, current_points)
 
         # We begin the iterative process to generate the samples of interest.
-        samples = []
-        while len(samples) < num_samples:
-
-            direction = np.random.randn(self.predicate_matrix.shape[1], 1)
-            direction = direction / la.norm(direction)
-            lambdas = []
-            for i in range(self.predicate_matrix.shape[0]):
-
-                if not np.isclose(np.matmul(self.predicate_matrix[i, :], direction), 0):
-                    temp = auxiliary_points[i] - current_point
-                    lam = np.matmul(self.predicate_matrix[i, :], temp) / (np.matmul(self.predicate_matrix[i, :],
-                                                                                    direction))
-                    lambdas.append(lam)
-
-            lambdas = np.array(lambdas)
-
-            try:
-                lam_upper = np.min(lambdas[lambdas >= 0])
-                lam_lower = np.max(lambdas[lambdas < 0])
-            except Exception:
+        alpha_samples = []
+        n_sampled = 0
+        while n_sampled < num_samples:
+
+            directions = np.random.randn(self.n_vars, num_chains)
+            directions = directions / la.norm(directions, axis=0)
+            steps = np.matmul(predicate_matrix, directions)
+
+            # Each constraint limits the step along the direction of the chain in one sense.
+            nonzero = ~np.isclose(steps, 0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                lambdas = slacks / steps
+            lam_upper = np.min(np.where(np.logical_and(nonzero, steps > 0), lambdas, np.inf), axis=0)
+            lam_lower = np.max(np.where(np.logical_and(nonzero, steps < 0), lambdas, -np.inf), axis=0)
+
+            if not np.all(np.isfinite(lam_upper)) or not np.all(np.isfinite(lam_lower)):
                 raise RuntimeError("The current direction does not intersect"
                                    "any of the hyperplanes.")
 
-            increment = np.random.uniform(low=lam_lower, high=lam_upper)
-            next_point = current_point + increment * direction
-            if self.check_alpha_inside(next_point):
-                current_point = next_point
-                star_point = self.center + np.matmul(self.basis_matrix, current_point)
-                samples.append(star_point)
-                self.__current_point = current_point
+            increments = np.random.uniform(low=np.minimum(lam_lower, 0), high=np.maximum(lam_upper, 0))
+            next_slacks = slacks - steps * increments
+            accepted = np.all(next_slacks >= 0, axis=0)
 
-        return samples
+            current_points[:, accepted] += directions[:, accepted] * increments[accepted]
+            slacks[:, accepted] = next_slacks[:, accepted]
+            alpha_samples.append(current_points[:, accepted])
+            n_sampled += np.count_nonzero(accepted)
 
-    def __get_auxiliary_points(self) -> List[Tensor]:
-        """
-        Function which returns the auxiliary points for each plane of the predicate.
+        self._current_point = current_points
+        if self._witness is None:
+            self._witness = current_points[:, :1].copy()
 
-        Returns
-        -------
-        List[Tensor]
-            List of the auxiliary points: one for each plane of the predicate.
+        alpha_samples = np.hstack(alpha_samples)[:, :num_samples]
+        samples = self.center + np.matmul(self.basis_matrix, alpha_samples)
 
-        """
-
-        aux_points = []
-        for i in range(self.predicate_matrix.shape[0]):
-            p = np.zeros((self.predicate_matrix.shape[1], 1))
-            plane = self.predicate_matrix[i, :]
-            max_nonzero_index = np.argmax(np.where(plane != 0, plane, -np.inf))
-            p[max_nonzero_index] = self.predicate_bias[i] / plane[max_nonzero_index]
-            aux_points.append(p)
-
-        return aux_points
+        return samples.T[:, :, None]
 
     def __get_starting_point_by_bounds(self) -> Tensor:
         """
@@ -369,11 +724,11 @@ class Star:
         """
 
         starting_point = []
-        for i in range(self.predicate_matrix.shape[1]):
+        for i in range(self.n_vars):
 
             solver, alphas, constraints = self.__get_predicate_lp_solver()
             objective = solver.Objective()
-            for j in range(self.predicate_matrix.shape[1]):
+            for j in range(self.n_vars):
                 if j == i:
                     objective.SetCoefficient(alphas[j], 1)
                 else:
@@ -400,7 +755,8 @@ class Star:
 
     def __get_starting_point(self) -> Tensor:
         """
-        Function used to get the starting point for the hit and run algorithm.
+        Function used to get the starting point for the hit and run algorithm: the Chebyshev center of the
+        predicate, unless an interior point has been inherited from the star this one was derived from.
 
         Return
         ---------
@@ -409,25 +765,22 @@ class Star:
 
         """
 
+        if self._start_point is not None:
+            return self._start_point
+
         starting_point = []
 
-        solver = pywraplp.Solver.CreateSolver('GLOP')
-        alphas = []
-        for j in range(self.basis_matrix.shape[1]):
-            new_alpha = solver.NumVar(-solver.infinity(), solver.infinity(), f'alpha_{j}')
-            alphas.append(new_alpha)
+        solver, alphas, constraints = self.__get_predicate_lp_solver()
         radius = solver.NumVar(0, solver.infinity(), 'radius')
 
-        constraints = []
-        for k in range(self.predicate_matrix.shape[0]):
-            new_constraint = solver.Constraint(-solver.infinity(), self.predicate_bias[k, 0])
-            for j in range(self.predicate_matrix.shape[1]):
-                new_constraint.SetCoefficient(alphas[j], self.predicate_matrix[k, j])
-            new_constraint.SetCoefficient(radius, np.linalg.norm(self.predicate_matrix[k, :], 2))
-            constraints.append(new_constraint)
+        k = 0
+        for block_matrix, _ in self.predicate_blocks:
+            for row in block_matrix:
+                constraints[k].SetCoefficient(radius, np.linalg.norm(row, 2))
+                k += 1
 
         objective = solver.Objective()
-        for j in range(self.predicate_matrix.shape[1]):
+        for j in range(self.n_vars):
             objective.SetCoefficient(alphas[j], 0)
         objective.SetCoefficient(radius, 1)
 
@@ -442,6 +795,7 @@ class Star:
         # print(radius.solution_value())
 
         starting_point = np.array(starting_point)
+        self._start_point = starting_point
 
         return starting_point
 
@@ -463,16 +817,39 @@ class Star:
             new_alpha = solver.NumVar(-solver.infinity(), solver.infinity(), f'alpha_{j}')
             alphas.append(new_alpha)
 
+        # The zero coefficients (including the ones of the variables missing from a block) are left unset.
         constraints = []
-        for k in range(self.predicate_matrix.shape[0]):
-            new_constraint = solver.Constraint(-solver.infinity(), self.predicate_bias[k, 0])
-            for j in range(self.predicate_matrix.shape[1]):
-                new_constraint.SetCoefficient(alphas[j], self.predicate_matrix[k, j])
-            constraints.append(new_constraint)
+        for block_matrix, block_bias in self.predicate_blocks:
+            for k in range(block_matrix.shape[0]):
+                new_constraint = solver.Constraint(-solver.infinity(), block_bias[k, 0])
+                for j in np.flatnonzero(block_matrix[k, :]):
+                    new_constraint.SetCoefficient(alphas[j], block_matrix[k, j])
+                constraints.append(new_constraint)
 
         return solver, alphas, constraints
 
 
+def _single_var_bounds(coef_mat: Tensor, bias: Tensor, n_vars: int) -> Tuple[Tensor, Tensor]:
+    """
+    Function which computes the box of the predicate variables defined by the constraints (rows of coef_mat
+    and bias) involving a single variable. Unbounded variables have infinite bounds.
+
+    """
+
+    nonzero = coef_mat != 0
+    single_var = np.count_nonzero(nonzero, axis=1) == 1
+    rows, cols = np.nonzero(np.logical_and(nonzero, single_var[:, None]))
+    values = bias[rows] / coef_mat[rows, cols]
+    positive = coef_mat[rows, cols] > 0
+
+    lower = np.full(n_vars, -np.inf)
+    upper = np.full(n_vars, np.inf)
+    np.minimum.at(upper, cols[positive], values[positive])
+    np.maximum.at(lower, cols[~positive], values[~positive])
+
+    return lower, upper
+
+
 class StarSet(AbsElement):
     """
     Concrete class for our internal representation of a StarSet abstract element. A StarSet consist in a set
@@ -492,6 +869,289 @@ class StarSet(AbsElement):
         else:
             self.stars = stars
 
+    def get_nbytes(self) -> int:
+        """
+        Function which estimates the memory used by the matrices of the stars. The predicate blocks shared
+        between stars are counted once.
+
+        Returns
+        ----------
+        int
+            The number of bytes of the matrices.
+
+        """
+
+        arrays = {}
+        for star in self.stars:
+            arrays[id(star.center)] = star.center
+            arrays[id(star.basis_matrix)] = star.basis_matrix
+            for block_matrix, block_bias in star.predicate_blocks:
+                arrays[id(block_matrix)] = block_matrix
+                arrays[id(block_bias)] = block_bias
+
+        return sum(array.nbytes for array in arrays.values())
+
+
+class StarPool:
+    """
+    A long-lived pool of worker processes used for the parallel propagation of StarSets. The pool is meant to be
+    owned by a verification strategy and shared by all the abstract layers, so that the worker processes are started
+    once (lazily, at the first parallel map) instead of once per layer. It can be used as a context manager.
+
+    The stars are dispatched in chunks: the matrices of all the stars are copied in a single shared memory block
+    and each worker only receives the positions of its stars in the block, while the other arguments are pickled
+    once per chunk. The predicate blocks shared by the stars are copied once, and the stars of the results share
+    the predicate blocks of the stars they come from. Small lists of stars are processed in the calling process.
+
+    Attributes
+    ----------
+    processes : int
+        Number of worker processes.
+    min_parallel_stars : int
+        Minimum number of stars for which the workers are used.
+
+    Methods
+    ----------
+    starmap(Callable, List[Star], *args)
+        Function which applies a function to every star of a list.
+    imap(Callable, List[Star], *args)
+        Function which lazily applies a function to every star of a list.
+    close()
+        Procedure to shut down the worker processes.
+
+    """
+
+    def __init__(self, processes: int = None, min_parallel_stars: int = None):
+
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+
+        if min_parallel_stars is None:
+            min_parallel_stars = 2 * processes
+
+        self.processes = processes
+        self.min_parallel_stars = min_parallel_stars
+        self.__pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close(terminate=exc_type is not None)
+
+    def starmap(self, func: Callable, stars: List[Star], *args) -> list:
+        """
+        Function which applies func(star, *args) to every star of the list and returns the results in the same
+        order of the stars. func must be defined at module level to be used by the worker processes.
+
+        Parameters
+        ----------
+        func : Callable
+            The function to apply.
+        stars : List[Star]
+            The stars of interest.
+        args
+            The other arguments of func, shared by all the calls.
+
+        Returns
+        ----------
+        list
+            The list of the results.
+
+        """
+
+        return list(self.imap(func, stars, *args))
+
+    def imap(self, func: Callable, stars: List[Star], *args) -> Iterator:
+        """
+        Function which lazily applies func(star, *args) to every star of the list and yields the results in the
+        same order of the stars, as soon as they are available. When the caller stops consuming the results, the
+        stars which have not been processed yet are skipped (in the calling process) or discarded (in the workers).
+
+        Parameters
+        ----------
+        func : Callable
+            The function to apply.
+        stars : List[Star]
+            The stars of interest.
+        args
+            The other arguments of func, shared by all the calls.
+
+        Returns
+        ----------
+        Iterator
+            The iterator over the results.
+
+        """
+
+        stars = list(stars)
+        if not parallel or self.processes <= 1 or len(stars) < self.min_parallel_stars:
+            for star in stars:
+                yield func(star, *args)
+            return
+
+        if self.__pool is None:
+            # The workers must share the resource tracker of this process, which owns the shared memory blocks.
+            resource_tracker.ensure_running()
+            self.__pool = multiprocessing.Pool(self.processes)
+
+        # At most two chunks per worker are submitted at a time, so that little work is wasted when the caller
+        # stops early. The in-flight chunks are awaited before releasing the shared memory block.
+        shm, block_entries, descriptors, blocks = _share_stars(stars)
+        pending = collections.deque()
+        try:
+            chunk_size = math.ceil(len(descriptors) / (4 * self.processes))
+            tasks = iter([(func, shm.name, block_entries, descriptors[i:i + chunk_size], args)
+                          for i in range(0, len(descriptors), chunk_size)])
+            for task in itertools.islice(tasks, 2 * self.processes):
+                pending.append(self.__pool.apply_async(_shared_stars_call, task))
+
+            while len(pending) > 0:
+                chunk = _BlockUnpickler(io.BytesIO(pending.popleft().get()), blocks).load()
+                for task in itertools.islice(tasks, 1):
+                    pending.append(self.__pool.apply_async(_shared_stars_call, task))
+                yield from chunk
+        finally:
+            for result in pending:
+                result.wait()
+            shm.close()
+            shm.unlink()
+
+    def close(self, terminate: bool = False):
+        """
+        Procedure to shut down the worker processes (if they were started).
+
+        Parameters
+        ----------
+        terminate : bool
+            If True the workers are stopped without waiting for pending work.
+
+        """
+
+        if self.__pool is not None:
+            if terminate:
+                self.__pool.terminate()
+            else:
+                self.__pool.close()
+            self.__pool.join()
+            self.__pool = None
+
+
+def _share_stars(stars: List[Star]) -> Tuple[shared_memory.SharedMemory, list, list, list]:
+    """
+    Procedure to copy the matrices of a list of stars in a new shared memory block. The predicate blocks shared by
+    several stars are copied once.
+
+    Returns
+    ----------
+    (SharedMemory, list, list, list)
+        The shared memory block, the positions and shapes of the predicate blocks in the shared memory block, for
+        each star the positions and shapes of its matrices and the indexes of its predicate blocks together with
+        its other attributes, and the predicate blocks themselves.
+
+    """
+
+    blocks = []
+    block_indexes = {}
+    star_block_ids = []
+    for star in stars:
+        block_ids = []
+        for block in star.predicate_blocks:
+            if id(block) not in block_indexes:
+                block_indexes[id(block)] = len(blocks)
+                blocks.append(block)
+            block_ids.append(block_indexes[id(block)])
+        star_block_ids.append(block_ids)
+
+    block_arrays = [[np.ascontiguousarray(a, dtype=np.float64) for a in block] for block in blocks]
+    star_arrays = [[np.ascontiguousarray(a, dtype=np.float64) for a in (star.center, star.basis_matrix)]
+                   for star in stars]
+
+    shm = shared_memory.SharedMemory(create=True, size=max(1, sum(a.nbytes for arrays in block_arrays + star_arrays
+                                                                  for a in arrays)))
+    offset = 0
+
+    def copy_arrays(arrays: list) -> list:
+        nonlocal offset
+        entries = []
+        for a in arrays:
+            np.ndarray(a.shape, dtype=np.float64, buffer=shm.buf, offset=offset)[...] = a
+            entries.append((offset, a.shape))
+            offset += a.nbytes
+        return entries
+
+    block_entries = [copy_arrays(arrays) for arrays in block_arrays]
+    descriptors = []
+    for star, arrays, block_ids in zip(stars, star_arrays, star_block_ids):
+        descriptors.append((copy_arrays(arrays), block_ids, star.is_empty, star.ref_layer, star.ref_neuron,
+                            star._witness))
+
+    return shm, block_entries, descriptors, blocks
+
+
+class _BlockPickler(pickle.Pickler):
+    """
+    Pickler used by the workers of StarPool to send back the results: the predicate blocks received from the
+    calling process are replaced by their indexes, so that the stars rebuilt by _BlockUnpickler share the blocks
+    of the original stars instead of copies.
+
+    """
+
+    def __init__(self, file, block_indexes: dict):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.block_indexes = block_indexes
+
+    def persistent_id(self, obj):
+        return self.block_indexes.get(id(obj))
+
+
+class _BlockUnpickler(pickle.Unpickler):
+    """
+    Unpickler of the results of the workers of StarPool, which replaces the indexes of the predicate blocks with the
+    blocks of the stars of the calling process.
+
+    """
+
+    def __init__(self, file, blocks: list):
+        super().__init__(file)
+        self.blocks = blocks
+
+    def persistent_load(self, pid):
+        return self.blocks[pid]
+
+
+def _shared_stars_call(func: Callable, shm_name: str, block_entries: list, descriptors: list, args: tuple) -> bytes:
+    """
+    Worker side of StarPool.imap: it rebuilds the stars of a chunk from the shared memory block and applies
+    func to each of them. The results are pickled with _BlockPickler.
+
+    """
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        blocks = {}
+        stars = []
+        for entries, block_ids, is_empty, ref_layer, ref_neuron, witness in descriptors:
+            for i in block_ids:
+                if i not in blocks:
+                    blocks[i] = tuple(np.ndarray(shape, dtype=np.float64, buffer=shm.buf, offset=offset).copy()
+                                      for offset, shape in block_entries[i])
+            center, basis_matrix = [np.ndarray(shape, dtype=np.float64, buffer=shm.buf, offset=offset).copy()
+                                    for offset, shape in entries]
+            star = Star.from_predicate_blocks(tuple(blocks[i] for i in block_ids), center, basis_matrix, is_empty)
+            star.ref_layer = ref_layer
+            star.ref_neuron = ref_neuron
+            star._witness = witness
+            stars.append(star)
+    finally:
+        shm.close()
+
+    results = [func(star, *args) for star in stars]
+
+    buffer = io.BytesIO()
+    _BlockPickler(buffer, {id(block): i for i, block in blocks.items()}).dump(results)
+    return buffer.getvalue()
+
 
 def check_stable(var_index: int, bounds: AbstractBounds) -> int:
     """
@@ -532,21 +1192,43 @@ def intersect_with_halfspace(star: Star, coef_mat: Tensor, bias_mat: Tensor) ->
 
     """
 
-    new_center = star.center
-    new_basis_matrix = star.basis_matrix
     hs_pred_matrix = np.matmul(coef_mat, star.basis_matrix)
     hs_pred_bias = bias_mat - np.matmul(coef_mat, star.center)
-    new_pred_matrix = np.vstack((star.predicate_matrix, hs_pred_matrix))
-    new_pred_bias = np.vstack((star.predicate_bias, hs_pred_bias))
 
-    new_star = Star(new_pred_matrix, new_pred_bias, new_center, new_basis_matrix)
+    return star.derive(star.center, star.basis_matrix, hs_pred_matrix, hs_pred_bias)
 
-    return new_star
 
+def star_order_key(star: Star) -> tuple:
+    """
+    Function which returns a key depending only on the content of a Star, used to iterate the stars of a StarSet in
+    the same order in every run.
+
+    """
+
+    return star.center.tobytes(), star.basis_matrix.tobytes(), star.predicate_bias.tobytes()
+
+
+def halfspace_intersection_is_empty(star: Star, coef_mat: Tensor, bias_mat: Tensor) -> bool:
+    """
+    Function which checks if the intersection of a Star with a halfspace is empty. It is defined at module level
+    to be used with StarPool.
+
+    """
+
+    return intersect_with_halfspace(star, coef_mat, bias_mat).check_if_empty()
+
+
+def __mixed_step_relu(abs_input: Set[Star], var_index: int, symb_lb: float = None, symb_ub: float = None) \
+        -> Set[Star]:
+    """
+    Exact propagation of a single neuron of a ReLU layer: unstable neurons are handled by splitting each star
+    in the two stars corresponding to the negative and positive phase of the neuron. When the symbolic bounds do
+    not decide the stability of the neuron, the emptiness of the two stars decides it: one of them is usually
+    known to be non-empty from a feasible point of the star, so a single LP is needed instead of the two of the
+    bounds of the neuron.
+
+    """
 
-def __mixed_step_relu(abs_input: Set[Star], var_index: int, refinement_flag: bool,
-                      symb_lb: float = None, symb_ub: float = None) -> Set[Star]:
-    abs_input = list(abs_input)
     abs_output = set()
 
     guard = 10e-15
@@ -557,103 +1239,130 @@ def __mixed_step_relu(abs_input: Set[Star], var_index: int, refinement_flag: boo
     if symb_ub is None:
         symb_ub = 100
 
-    for i in range(len(abs_input)):
-
-        is_pos_stable = False
-        is_neg_stable = False
-        lb, ub = None, None
+    for star in abs_input:
 
-        star = abs_input[i]
+        if star.is_empty:
+            continue
 
         # Check abstract bounds for stability
         if symb_lb >= guard:
-            is_pos_stable = True
+            abs_output.add(star)
+            continue
+
         elif symb_ub <= -guard:
-            is_neg_stable = True
-        else:
-            lb, ub = star.get_bounds(var_index)
+            abs_output.add(approx_relu_layer(star, np.array([var_index]), np.array([], dtype=int),
+                                             np.array([]), np.array([])))
+            continue
 
-        if not star.is_empty:
+        # Creating lower bound star.
+        lower_star_center = star.center.copy()
+        lower_star_center[var_index] = 0
+        lower_star_basis_mat = star.basis_matrix.copy()
+        lower_star_basis_mat[var_index, :] = 0
+        # Adding x <= 0 constraints to the predicate.
+        lower_star = star.derive(lower_star_center, lower_star_basis_mat,
+                                 star.basis_matrix[var_index:var_index + 1, :], -star.center[var_index])
+
+        # Creating upper bound star.
+        upper_star_center = star.center
+        upper_star_basis_mat = star.basis_matrix
+        # Adding x >= 0 constraints to the predicate.
+        upper_star = star.derive(upper_star_center, upper_star_basis_mat,
+                                 -star.basis_matrix[var_index:var_index + 1, :], star.center[var_index])
+
+        lower_empty = lower_star.check_if_empty()
+        upper_empty = upper_star.check_if_empty()
+
+        if lower_empty and upper_empty:
+            continue
+        elif lower_empty:
+            # The neuron is positive stable.
+            abs_output.add(star)
+        elif upper_empty:
+            # The neuron is negative stable.
+            abs_output.add(approx_relu_layer(star, np.array([var_index]), np.array([], dtype=int),
+                                             np.array([]), np.array([])))
+        else:
+            abs_output.update((lower_star, upper_star))
 
-            mask = np.identity(star.center.shape[0])
-            mask[var_index, var_index] = 0
+    return abs_output
 
-            if is_pos_stable or (lb is not None and lb >= 0):
-                abs_output = abs_output.union({star})
 
-            elif is_neg_stable or (ub is not None and ub <= 0):
-                new_center = np.matmul(mask, star.center)
-                new_basis_mat = np.matmul(mask, star.basis_matrix)
-                new_pred_mat = star.predicate_matrix
-                new_pred_bias = star.predicate_bias
-                new_star = Star(new_pred_mat, new_pred_bias, new_center, new_basis_mat)
-                abs_output = abs_output.union({new_star})
+def __mixed_approx_relu(abs_input: Set[Star], var_indexes: List[int], symb_lbs: Tensor, symb_ubs: Tensor,
+                        deadline: float = None) -> Set[Star]:
+    """
+    Over-approximate propagation of the neurons of a ReLU layer which are not refined: for each star the
+    stability of every neuron is decided once (by the symbolic bounds when they suffice, by the LP bounds otherwise)
+    and all the unstable neurons are then approximated together by approx_relu_layer. The LP bounds are clipped
+    to the symbolic ones, which also hold for the stars since they bound every reachable value.
 
-            else:
+    Once the deadline (as given by time.time()) has passed the symbolic bounds are used without solving LPs, when
+    they are available.
 
-                if refinement_flag:
+    """
 
-                    # Creating lower bound star.
-                    lower_star_center = np.matmul(mask, star.center)
-                    lower_star_basis_mat = np.matmul(mask, star.basis_matrix)
-                    # Adding x <= 0 constraints to the predicate.
-                    lower_predicate_matrix = np.vstack((star.predicate_matrix, star.basis_matrix[var_index, :]))
+    guard = 10e-15
+    var_indexes = np.array(var_indexes, dtype=int)
+    finite = np.logical_and(np.isfinite(symb_lbs[var_indexes]), np.isfinite(symb_ubs[var_indexes]))
 
-                    lower_predicate_bias = np.vstack((star.predicate_bias, -star.center[var_index]))
-                    lower_star = Star(lower_predicate_matrix, lower_predicate_bias, lower_star_center,
-                                      lower_star_basis_mat)
+    abs_output = set()
+    for star in abs_input:
 
-                    # Creating upper bound star.
-                    upper_star_center = star.center
-                    upper_star_basis_mat = star.basis_matrix
-                    # Adding x >= 0 constraints to the predicate.
-                    upper_predicate_matrix = np.vstack((star.predicate_matrix, -star.basis_matrix[var_index, :]))
+        use_lp = deadline is None or time.time() < deadline
 
-                    upper_predicate_bias = np.vstack((star.predicate_bias, star.center[var_index]))
-                    upper_star = Star(upper_predicate_matrix, upper_predicate_bias, upper_star_center,
-                                      upper_star_basis_mat)
+        neg_mask = np.zeros(len(var_indexes), dtype=bool)
+        unstable_mask = np.zeros(len(var_indexes), dtype=bool)
+        lbs = np.zeros(len(var_indexes))
+        ubs = np.zeros(len(var_indexes))
 
-                    abs_output = abs_output.union({lower_star, upper_star})
+        for k, i in enumerate(var_indexes):
 
+            # Check abstract bounds for stability
+            if symb_lbs[i] >= guard:
+                continue
+            elif symb_ubs[i] <= -guard:
+                neg_mask[k] = True
+            elif not use_lp and finite[k]:
+                unstable_mask[k] = True
+                lbs[k] = symb_lbs[i]
+                ubs[k] = symb_ubs[i]
+            else:
+                lb, ub = star.get_bounds(i)
+                if lb >= 0:
+                    continue
+                elif ub <= 0:
+                    neg_mask[k] = True
                 else:
+                    unstable_mask[k] = True
+                    lbs[k] = max(lb, symb_lbs[i])
+                    ubs[k] = min(ub, symb_ubs[i])
 
-                    col_c_mat = star.predicate_matrix.shape[1]
-                    row_c_mat = star.predicate_matrix.shape[0]
-
-                    c_mat_1 = np.zeros((1, col_c_mat + 1))
-                    c_mat_1[0, col_c_mat] = -1
-                    c_mat_2 = np.hstack((np.array([star.basis_matrix[var_index, :]]), -np.ones((1, 1))))
-                    coef_3 = - ub / (ub - lb)
-                    c_mat_3 = np.hstack((np.array([coef_3 * star.basis_matrix[var_index, :]]), np.ones((1, 1))))
-                    c_mat_0 = np.hstack((star.predicate_matrix, np.zeros((row_c_mat, 1))))
-
-                    d_0 = star.predicate_bias
-                    d_1 = np.zeros((1, 1))
-                    d_2 = -star.center[var_index] * np.ones((1, 1))
-                    d_3 = np.array([(ub / (ub - lb)) * (star.center[var_index] - lb)])
-
-                    new_pred_mat = np.vstack((c_mat_0, c_mat_1, c_mat_2, c_mat_3))
-                    new_pred_bias = np.vstack((d_0, d_1, d_2, d_3))
-
-                    new_center = np.matmul(mask, star.center)
-                    temp_basis_mat = np.matmul(mask, star.basis_matrix)
-                    temp_vec = np.zeros((star.basis_matrix.shape[0], 1))
-                    temp_vec[var_index, 0] = 1
-                    new_basis_mat = np.hstack((temp_basis_mat, temp_vec))
-                    new_star = Star(new_pred_mat, new_pred_bias, new_center, new_basis_mat)
-
-                    abs_output = abs_output.union({new_star})
+        if not star.is_empty:
+            abs_output.add(approx_relu_layer(star, var_indexes[neg_mask], var_indexes[unstable_mask],
+                                             lbs[unstable_mask], ubs[unstable_mask]))
 
     return abs_output
 
 
-def mixed_single_relu_forward(star: Star, heuristic: str, params: List, layer_bounds: AbstractBounds) \
-        -> Tuple[Set[Star], Optional[np.ndarray]]:
+def mixed_single_relu_forward(star: Star, heuristic: str, params: List, layer_bounds: AbstractBounds,
+                              lp_budget: int = None, deadline: float = None) \
+        -> Tuple[Set[Star], Optional[np.ndarray], Optional[np.ndarray]]:
     """
     Utility function for the management of the forward for AbsReLUNode. It is outside
     the class scope since multiprocessing does not support parallelization with
     function internal to classes.
 
+    When the symbolic bounds of the layer are available the neurons are ranked by their symbolic areas, and the
+    LP bounds of the star are computed only if they can change the neurons to refine: at most lp_budget
+    candidates (all of them if lp_budget is None), in decreasing order of symbolic area (weighted by the relevances
+    for best_n_neurons_rel). The tightened candidates are ranked among themselves, before the neurons with
+    symbolic areas only, since an LP area is never larger than the symbolic one. The returned areas are the LP
+    areas of the tightened candidates and the symbolic areas of the other neurons, together with the mask of the
+    neurons whose area comes from the LP bounds (all of them when the symbolic bounds are not available).
+
+    Once the deadline (as given by time.time()) has passed the remaining neurons to refine are over-approximated,
+    using the symbolic bounds instead of LPs when they are available.
+
     """
 
     assert heuristic == "given_flags" or heuristic == "best_n_neurons" or heuristic == "best_n_neurons_rel", \
@@ -661,18 +1370,38 @@ def mixed_single_relu_forward(star: Star, heuristic: str, params: List, layer_bo
 
     temp_abs_input = {star}
     if star.check_if_empty():
-        return set(), None
+        return set(), None, None
 
     else:
-        n_areas = []
-        for i in range(star.center.shape[0]):
-            if layer_bounds is not None and (layer_bounds.get_lower()[i] >= 0 or layer_bounds.get_upper()[i] < 0):
-                n_areas.append(0)
-            else:
-                lb, ub = star.get_bounds(i)
-                n_areas.append(-lb * ub / 2.0)
+        relevances = 1.0
+        if heuristic == "best_n_neurons_rel":
+            relevances = np.array(params[1], dtype=float).reshape(-1)
 
-        n_areas = np.array(n_areas)
+        if layer_bounds is None:
+            symb_lbs = np.full(star.center.shape[0], -np.inf)
+            symb_ubs = np.full(star.center.shape[0], np.inf)
+            n_areas = np.array([-lb * ub / 2.0 for lb, ub in map(star.get_bounds, range(star.center.shape[0]))])
+            tightened = np.ones(star.center.shape[0], dtype=bool)
+
+        else:
+            symb_lbs = np.array(layer_bounds.get_lower(), dtype=float).reshape(-1)
+            symb_ubs = np.array(layer_bounds.get_upper(), dtype=float).reshape(-1)
+            tightened = np.zeros(star.center.shape[0], dtype=bool)
+
+            # Same partition of check_stable, computed for the whole layer at once
+            guard = 10e-15
+            unstable = np.logical_and(symb_lbs < guard, symb_ubs > -guard)
+            n_areas = np.where(unstable, -symb_lbs * symb_ubs / 2.0, 0)
+
+            # The LP bounds only matter when some of the unstable neurons are not refined.
+            if heuristic != "given_flags" and 0 < params[0] < np.count_nonzero(unstable):
+                candidates = np.flatnonzero(unstable)
+                scores = (n_areas * relevances)[candidates]
+                candidates = candidates[np.argsort(-scores, kind='stable')][:lp_budget]
+                for i in candidates:
+                    lb, ub = star.get_bounds(i)
+                    n_areas[i] = -lb * ub / 2.0
+                tightened[candidates] = True
 
         if heuristic == "best_n_neurons" or heuristic == "best_n_neurons_rel":
 
@@ -684,10 +1413,15 @@ def mixed_single_relu_forward(star: Star, heuristic: str, params: List, layer_bo
                 # Our idea is that a greater value for the area correspond to greater loss of precision if the
                 # star is not refined for the corresponding neuron.
                 if heuristic == "best_n_neurons_rel":
-                    relevances = params[1]
                     n_areas = n_areas * relevances
 
                 sorted_indexes = np.flip(np.argsort(n_areas))
+
+                # The unstable tightened candidates come first: the symbolic areas are not comparable with them
+                first = np.logical_and(tightened, n_areas > 0)
+                if first.any():
+                    sorted_indexes = sorted_indexes[np.argsort(~first[sorted_indexes], kind='stable')]
+
                 index_to_refine = sorted_indexes[:n_neurons]
             else:
                 index_to_refine = []
@@ -705,15 +1439,19 @@ def mixed_single_relu_forward(star: Star, heuristic: str, params: List, layer_bo
         else:
             raise NotImplementedError
 
-        if layer_bounds is None:
-            for i in range(star.center.shape[0]):
-                temp_abs_input = __mixed_step_relu(temp_abs_input, i, refinement_flags[i])
-        else:
-            for i in range(star.center.shape[0]):
-                temp_abs_input = __mixed_step_relu(temp_abs_input, i, refinement_flags[i],
-                                                   layer_bounds.get_lower()[i], layer_bounds.get_upper()[i])
+        # The refined neurons split the stars one at a time, whereas all the remaining neurons are approximated
+        # together once the splits are done.
+        approx_indexes = []
+        for i in range(star.center.shape[0]):
+            if refinement_flags[i] and (deadline is None or time.time() < deadline):
+                temp_abs_input = __mixed_step_relu(temp_abs_input, i, symb_lbs[i], symb_ubs[i])
+            else:
+                approx_indexes.append(i)
+
+        if len(approx_indexes) > 0:
+            temp_abs_input = __mixed_approx_relu(temp_abs_input, approx_indexes, symb_lbs, symb_ubs, deadline)
 
-        return temp_abs_input, n_areas
+        return temp_abs_input, n_areas, tightened
 
 
 def single_fc_forward(star: Star, weight: Tensor, bias: Tensor) -> Set[Star]:
@@ -728,12 +1466,8 @@ def single_fc_forward(star: Star, weight: Tensor, bias: Tensor) -> Set[Star]:
 
     new_basis_matrix = np.matmul(weight, star.basis_matrix)
     new_center = np.matmul(weight, star.center) + bias
-    new_predicate_matrix = star.predicate_matrix
-    new_predicate_bias = star.predicate_bias
 
-    new_star = Star(new_predicate_matrix, new_predicate_bias, new_center, new_basis_matrix)
-
-    return {new_star}
+    return {star.derive(new_center, new_basis_matrix)}
 
 
 def approx_relu_forward(star: Star, bounds: AbstractBounds, dim: int, start_idx: int = 0) -> Star:
@@ -759,58 +1493,109 @@ def approx_relu_forward(star: Star, bounds: AbstractBounds, dim: int, start_idx:
 
     """
 
-    out_star = star
+    lower = np.array(bounds.get_lower(), dtype=float).reshape(-1)[start_idx:dim]
+    upper = np.array(bounds.get_upper(), dtype=float).reshape(-1)[start_idx:dim]
+    indexes = np.arange(start_idx, dim)
 
-    for i in range(start_idx, dim):
-        # i is the number of neurons to process
-        stable = check_stable(i, bounds)
-        mask = np.identity(out_star.center.shape[0])
-        mask[i, i] = 0
-        lb = bounds.get_lower()[i]
-        ub = bounds.get_upper()[i]
-
-        # Positive stable
-        if stable == 1:
-            continue
-
-        # Negative stable
-        elif stable == -1:
-            new_c = np.matmul(mask, out_star.center)
-            new_b = np.matmul(mask, out_star.basis_matrix)
-            new_pred = out_star.predicate_matrix
-            new_bias = out_star.predicate_bias
+    # Same partition of check_stable, computed for the whole layer at once
+    precision_guard = 10e-15
+    neg_mask = upper <= -precision_guard
+    unstable_mask = np.logical_and(lower < precision_guard, upper > -precision_guard)
 
-            out_star = Star(new_pred, new_bias, new_c, new_b)
+    return approx_relu_layer(star, indexes[neg_mask], indexes[unstable_mask], lower[unstable_mask],
+                             upper[unstable_mask])
 
-        # Unstable
-        else:
-            col_c_mat = out_star.predicate_matrix.shape[1]
-            row_c_mat = out_star.predicate_matrix.shape[0]
 
-            c_mat_1 = np.zeros((1, col_c_mat + 1))
-            c_mat_1[0, col_c_mat] = -1
-            c_mat_2 = np.hstack((np.array([out_star.basis_matrix[i, :]]), -np.ones((1, 1))))
-            coef_3 = - ub / (ub - lb)
-            c_mat_3 = np.hstack((np.array([coef_3 * out_star.basis_matrix[i, :]]), np.ones((1, 1))))
-            c_mat_0 = np.hstack((out_star.predicate_matrix, np.zeros((row_c_mat, 1))))
+def approx_relu_layer(star: Star, neg_indexes: Tensor, unstable_indexes: Tensor, unstable_lbs: Tensor,
+                      unstable_ubs: Tensor) -> Star:
+    """
+    Approximate abstract propagation of a group of neurons of a ReLU layer in a single step. The negative stable
+    neurons are set to zero while each unstable neuron x_i gets a new predicate variable y_i and the three
+    constraints of the triangle relaxation: y_i >= 0, y_i >= x_i and y_i <= ub_i / (ub_i - lb_i) * (x_i - lb_i).
+    The new center, basis and predicate are allocated once for all the unstable neurons.
 
-            d_0 = out_star.predicate_bias
-            d_1 = np.zeros((1, 1))
-            d_2 = -out_star.center[i] * np.ones((1, 1))
-            d_3 = np.array([(ub / (ub - lb)) * (out_star.center[i] - lb)])
+    Parameters
+    ----------
+    star : Star
+        The star to propagate in this layer
+    neg_indexes : Tensor
+        The indexes of the negative stable neurons
+    unstable_indexes : Tensor
+        The indexes of the unstable neurons
+    unstable_lbs : Tensor
+        The lower bounds of the unstable neurons
+    unstable_ubs : Tensor
+        The upper bounds of the unstable neurons
 
-            new_pred_mat = np.vstack((c_mat_0, c_mat_1, c_mat_2, c_mat_3))
-            new_pred_bias = np.vstack((d_0, d_1, d_2, d_3))
+    Returns
+    ----------
+    Star
+        The abstract star result from the propagation
 
-            new_center = np.matmul(mask, out_star.center)
-            temp_basis_mat = np.matmul(mask, out_star.basis_matrix)
-            temp_vec = np.zeros((out_star.basis_matrix.shape[0], 1))
-            temp_vec[i, 0] = 1
-            new_basis_mat = np.hstack((temp_basis_mat, temp_vec))
+    """
 
-            out_star = Star(new_pred_mat, new_pred_bias, new_center, new_basis_mat)
+    neg_indexes = np.asarray(neg_indexes, dtype=int)
+    unstable_indexes = np.asarray(unstable_indexes, dtype=int)
+
+    if neg_indexes.size == 0 and unstable_indexes.size == 0:
+        return star
+
+    n_vars = star.n_vars
+    n_new = unstable_indexes.size
+    new_vars = n_vars + np.arange(n_new)
+
+    new_center = star.center.copy()
+    new_center[neg_indexes] = 0
+    new_center[unstable_indexes] = 0
+
+    new_basis_mat = np.zeros((star.basis_matrix.shape[0], n_vars + n_new))
+    new_basis_mat[:, :n_vars] = star.basis_matrix
+    new_basis_mat[neg_indexes, :] = 0
+    new_basis_mat[unstable_indexes, :] = 0
+    new_basis_mat[unstable_indexes, new_vars] = 1
+
+    if n_new == 0:
+        return star.derive(new_center, new_basis_mat)
+
+    lbs = np.asarray(unstable_lbs, dtype=float).reshape(-1)
+    ubs = np.asarray(unstable_ubs, dtype=float).reshape(-1)
+    slopes = ubs / (ubs - lbs)
+    unstable_rows = star.basis_matrix[unstable_indexes, :]
+    unstable_centers = star.center[unstable_indexes, 0]
+
+    # The new constraints are stacked in three groups of n_new rows each: -y <= 0, x - y <= 0 and
+    # -slope * x + y <= -slope * lb. They form a single new block of the predicate.
+    first_group = np.arange(n_new)
+    second_group = first_group + n_new
+    third_group = second_group + n_new
+
+    new_pred_mat = np.zeros((3 * n_new, n_vars + n_new))
+    new_pred_mat[first_group, new_vars] = -1
+    new_pred_mat[n_new:2 * n_new, :n_vars] = unstable_rows
+    new_pred_mat[second_group, new_vars] = -1
+    new_pred_mat[2 * n_new:, :n_vars] = -slopes[:, None] * unstable_rows
+    new_pred_mat[third_group, new_vars] = 1
+
+    new_pred_bias = np.zeros((3 * n_new, 1))
+    new_pred_bias[second_group, 0] = -unstable_centers
+    new_pred_bias[third_group, 0] = slopes * (unstable_centers - lbs)
+
+    # A feasible point of the star is extended with y = relu(x), which satisfies the relaxation.
+    witness = None
+    if star._witness is not None:
+        unstable_values = unstable_centers + np.matmul(unstable_rows, star._witness).reshape(-1)
+        witness = np.vstack((star._witness, np.maximum(unstable_values, 0).reshape(-1, 1)))
+
+    new_star = star.derive(new_center, new_basis_mat, new_pred_mat, new_pred_bias, (np.zeros(n_new), ubs), witness)
+
+    # An interior point of the star is extended with y halfway between relu(x) and the upper line of the triangle.
+    if star._start_point is not None and new_star._start_point is None:
+        unstable_values = unstable_centers + np.matmul(unstable_rows, star._start_point).reshape(-1)
+        y_values = (np.maximum(unstable_values, 0) + slopes * (unstable_values - lbs)) / 2
+        new_star.set_start_point(np.vstack((star._start_point, y_values.reshape(-1, 1))), new_pred_mat,
+                                 new_pred_bias)
 
-    return out_star
+    return new_star
 
 
 def sig(x: float) -> float:
@@ -899,7 +1684,7 @@ def __recursive_step_sigmoid(star: Star, var_index: int, approx_level: int, lb:
             d_2 = np.array([sig_fod(ub) * (star.center[var_index] - ub) + sig(ub)])
             d_3 = np.array([-coef_3 * (star.center[var_index] - lb) - sig(lb)])
 
-        col_c_mat = star.predicate_matrix.shape[1]
+        col_c_mat = star.n_vars
 
         # Adding lb and ub bounds to enhance stability
         c_mat_lb = np.zeros((1, col_c_mat + 1))
@@ -910,12 +1695,8 @@ def __recursive_step_sigmoid(star: Star, var_index: int, approx_level: int, lb:
         c_mat_ub[0, col_c_mat] = 1
         d_ub = sig(ub) * np.ones((1, 1))
 
-        row_c_mat = star.predicate_matrix.shape[0]
-        c_mat_0 = np.hstack((star.predicate_matrix, np.zeros((row_c_mat, 1))))
-        d_0 = star.predicate_bias
-
-        new_pred_mat = np.vstack((c_mat_0, c_mat_1, c_mat_2, c_mat_3, c_mat_lb, c_mat_ub))
-        new_pred_bias = np.vstack((d_0, d_1, d_2, d_3, d_lb, d_ub))
+        new_pred_mat = np.vstack((c_mat_1, c_mat_2, c_mat_3, c_mat_lb, c_mat_ub))
+        new_pred_bias = np.vstack((d_1, d_2, d_3, d_lb, d_ub))
 
         new_center = np.matmul(mask, star.center)
         temp_basis_mat = np.matmul(mask, star.basis_matrix)
@@ -923,7 +1704,7 @@ def __recursive_step_sigmoid(star: Star, var_index: int, approx_level: int, lb:
         temp_vec[var_index, 0] = 1
         new_basis_mat = np.hstack((temp_basis_mat, temp_vec))
 
-        new_star = Star(new_pred_mat, new_pred_bias, new_center, new_basis_mat)
+        new_star = star.derive(new_center, new_basis_mat, new_pred_mat, new_pred_bias)
 
         return {new_star}
 
@@ -1254,6 +2035,9 @@ class AbsFullyConnectedNode(AbsSingleInputLayerNode):
     ref_node : FullyConnectedNode
         SingleInputLayerNode di riferimento per l'abstract transformer.
 
+    pool : StarPool
+        Optional pool of worker processes used to propagate the stars.
+
     Methods
     ----------
     forward(AbsElement)
@@ -1268,6 +2052,7 @@ class AbsFullyConnectedNode(AbsSingleInputLayerNode):
 
     def __init__(self, identifier: str, ref_node: nodes.FullyConnectedNode):
         super().__init__(identifier, ref_node)
+        self.pool = None
 
     def forward(self, abs_input: AbsElement) -> AbsElement:
         """
@@ -1293,17 +2078,18 @@ class AbsFullyConnectedNode(AbsSingleInputLayerNode):
 
     def __starset_forward(self, abs_input: StarSet) -> StarSet:
 
-        my_pool = multiprocessing.Pool(multiprocessing.cpu_count())
-
         # Need to expand bias since they are memorized like one-dimensional vectors in FC nodes.
         if self.ref_node.bias.shape != (self.ref_node.weight.shape[0], 1):
             bias = np.expand_dims(self.ref_node.bias, 1)
         else:
             bias = self.ref_node.bias
-        parallel_results = my_pool.starmap(single_fc_forward, zip(abs_input.stars,
-                                                                  itertools.repeat(self.ref_node.weight),
-                                                                  itertools.repeat(bias)))
-        my_pool.close()
+
+        # The product is cheap: without a pool owned by the verifier the stars are processed in-process.
+        if self.pool is not None:
+            parallel_results = self.pool.starmap(single_fc_forward, abs_input.stars, self.ref_node.weight, bias)
+        else:
+            parallel_results = [single_fc_forward(star, self.ref_node.weight, bias) for star in abs_input.stars]
+
         abs_output = StarSet()
         for star_set in parallel_results:
             abs_output.stars = abs_output.stars.union(star_set)
@@ -1345,6 +2131,24 @@ class AbsReLUNode(AbsSingleInputLayerNode):
         Parameters for the heuristic of interest.
         It is a List with the number of neurons to process with a precise abstraction in this layer.
 
+    pool : StarPool
+        Optional pool of worker processes used to propagate the stars. If it is not set and the module flag
+        parallel is True a temporary pool is used for each call of forward.
+
+    lp_budget : int
+        Maximum number of neurons per star whose symbolic bounds are tightened with LPs to rank the neurons to
+        refine (default: no limit).
+
+    deadline : float
+        Optional time (as given by time.time()) after which the neurons are no longer refined.
+
+    n_areas : Tensor
+        Areas of the neurons averaged over the stars of the last forward, see mixed_single_relu_forward.
+
+    tightened : Tensor
+        Mask of the neurons whose area comes from the LP bounds for at least one star of the last forward, the
+        areas of the other neurons come from the symbolic bounds of the layer.
+
     Methods
     ----------
     forward(AbsElement)
@@ -1366,6 +2170,10 @@ class AbsReLUNode(AbsSingleInputLayerNode):
         self.params = params
         self.layer_bounds = None
         self.n_areas = None
+        self.tightened = None
+        self.pool = None
+        self.lp_budget = None
+        self.deadline = None
 
     def forward(self, abs_input: AbsElement, bounds: AbstractBounds = None) -> AbsElement:
         """
@@ -1413,24 +2221,29 @@ class AbsReLUNode(AbsSingleInputLayerNode):
 
     def __parallel_starset_forward(self, abs_input: StarSet) -> StarSet:
 
-        my_pool = multiprocessing.Pool(multiprocessing.cpu_count())
-        parallel_results = my_pool.starmap(mixed_single_relu_forward, zip(abs_input.stars,
-                                                                          itertools.repeat(self.heuristic),
-                                                                          itertools.repeat(self.params),
-                                                                          itertools.repeat(self.layer_bounds)))
-        my_pool.close()
+        # The pool of the verifier is used when available, otherwise a pool is kept for the duration of the call.
+        if self.pool is not None:
+            parallel_results = self.pool.starmap(mixed_single_relu_forward, abs_input.stars, self.heuristic,
+                                                 self.params, self.layer_bounds, self.lp_budget, self.deadline)
+        else:
+            with StarPool() as pool:
+                parallel_results = pool.starmap(mixed_single_relu_forward, abs_input.stars, self.heuristic,
+                                                self.params, self.layer_bounds, self.lp_budget, self.deadline)
 
         abs_output = StarSet()
 
         tot_areas = np.zeros(self.ref_node.in_dim)
+        tightened = np.zeros(self.ref_node.in_dim, dtype=bool)
         num_areas = 0
-        for star_set, areas in parallel_results:
+        for star_set, areas, star_tightened in parallel_results:
             if star_set != set():
                 num_areas = num_areas + 1
                 tot_areas = tot_areas + areas
+                tightened = np.logical_or(tightened, star_tightened)
             abs_output.stars = abs_output.stars.union(star_set)
 
         self.n_areas = tot_areas / num_areas
+        self.tightened = tightened
 
         return abs_output
 
@@ -1441,14 +2254,19 @@ class AbsReLUNode(AbsSingleInputLayerNode):
 
         abs_output = StarSet()
         tot_areas = np.zeros(self.ref_node.in_dim)
+        tightened = np.zeros(self.ref_node.in_dim, dtype=bool)
         num_areas = 0
         for star in abs_input.stars:
-            result, areas = mixed_single_relu_forward(star, self.heuristic, self.params, self.layer_bounds)
+            result, areas, star_tightened = mixed_single_relu_forward(star, self.heuristic, self.params,
+                                                                      self.layer_bounds, self.lp_budget,
+                                                                      self.deadline)
             abs_output.stars = abs_output.stars.union(result)
             tot_areas = tot_areas + areas
+            tightened = np.logical_or(tightened, star_tightened)
             num_areas = num_areas + 1
 
         self.n_areas = tot_areas / num_areas
+        self.tightened = tightened
 
         return abs_output
 
@@ -60,12 +60,42 @@ class BoundsManager:
         symbolic_bounds = dict()
         # TODO change the structure of symbolic?bounds
 
+        self.propagate_bounds(layers, 0, input_hyper_rect, input_bounds, symbolic_bounds,
+                              numeric_preactivation_bounds, numeric_postactivation_bounds)
+        self.numeric_bounds = numeric_postactivation_bounds
+
+        return symbolic_bounds, numeric_preactivation_bounds, numeric_postactivation_bounds
+
+    def propagate_bounds(self, layers, start, input_hyper_rect, input_bounds, symbolic_bounds,
+                         numeric_preactivation_bounds, numeric_postactivation_bounds, phases=None):
+        """
+        propagates the bounds from the layer of index start, whose input has the symbolic bounds input_bounds,
+        and stores them in the dictionaries, which must already contain the bounds of the previous layers.
+        phases optionally fixes the phase of ReLU neurons as {layer identifier: {neuron: phase}}, with
+        phase 1 for the active neurons (relu is the identity) and -1 for the inactive ones (relu is zero)
+        """
+
         current_input_bounds = input_bounds
-        for i in range(0, len(layers)):
+        for i in range(start, len(layers)):
 
             if isinstance(layers[i], nodes.ReLUNode) or isinstance(layers[i], nodes.LeakyReLUNode):
+                symbolic_dense_output_bounds = symbolic_bounds[layers[i - 1].identifier][0]
+                preactivation_bounds = numeric_preactivation_bounds[layers[i - 1].identifier]
+
+                layer_phases = None if phases is None else phases.get(layers[i].identifier)
+                if layer_phases:
+                    preactivation_lower = np.array(preactivation_bounds.get_lower(), dtype=float)
+                    preactivation_upper = np.array(preactivation_bounds.get_upper(), dtype=float)
+                    for neuron, phase in layer_phases.items():
+                        if phase > 0:
+                            preactivation_lower[neuron] = max(preactivation_lower[neuron], 0)
+                        else:
+                            preactivation_upper[neuron] = min(preactivation_upper[neuron], 0)
+                    preactivation_bounds = HyperRectangleBounds(preactivation_lower, preactivation_upper)
+                    numeric_preactivation_bounds[layers[i - 1].identifier] = preactivation_bounds
+
                 symbolic_activation_output_bounds = self.compute_relu_output_bounds(symbolic_dense_output_bounds,
-                                                                                    input_hyper_rect)
+                                                                                    input_hyper_rect, layer_phases)
                 postactivation_bounds = HyperRectangleBounds(np.maximum(preactivation_bounds.get_lower(), 0),
                                                              np.maximum(preactivation_bounds.get_upper(), 0))
 
@@ -86,9 +116,6 @@ class BoundsManager:
             numeric_postactivation_bounds[layers[i].identifier] = postactivation_bounds
 
             current_input_bounds = symbolic_activation_output_bounds
-            self.numeric_bounds = numeric_postactivation_bounds
-
-        return symbolic_bounds, numeric_preactivation_bounds, numeric_postactivation_bounds
 
     def return_df_dict(self, converted_input = None):
         _, bounds, _ = self.compute_bounds(converted_input = converted_input)
@@ -126,16 +153,22 @@ class BoundsManager:
         return SymbolicLinearBounds(LinearFunctions(lower_matrix, lower_offset),
                                     LinearFunctions(upper_matrix, upper_offset))
 
-    def compute_relu_output_bounds(self, inputs, input_hyper_rect):
+    def compute_relu_output_bounds(self, inputs, input_hyper_rect, phases=None):
         lower_l, lower_u, upper_l, upper_u = inputs.get_all_bounds(input_hyper_rect)
-        lower, upper = self.compute_symb_lin_bounds_equations(inputs, lower_l, lower_u, upper_l, upper_u)
+        lower, upper = self.compute_symb_lin_bounds_equations(inputs, lower_l, lower_u, upper_l, upper_u, phases)
 
         return SymbolicLinearBounds(lower, upper)
 
-    def compute_symb_lin_bounds_equations(self, inputs, lower_l, lower_u, upper_l, upper_u):
+    def compute_symb_lin_bounds_equations(self, inputs, lower_l, lower_u, upper_l, upper_u, phases=None):
         k_lower, b_lower = get_array_lin_lower_bound_coefficients(lower_l, lower_u)
         k_upper, b_upper = get_array_lin_upper_bound_coefficients(upper_l, upper_u)
 
+        # The neurons with a fixed phase are exactly linear
+        if phases:
+            for neuron, phase in phases.items():
+                k_lower[neuron] = k_upper[neuron] = 1 if phase > 0 else 0
+                b_lower[neuron] = b_upper[neuron] = 0
+
         lower_matrix = get_transformed_matrix(inputs.get_lower().get_matrix(), k_lower)
         upper_matrix = get_transformed_matrix(inputs.get_upper().get_matrix(), k_upper)
         #
@@ -1,13 +1,36 @@
 import numpy as np
 from InstabilityInspector.pynever.strategies.bp.bounds import HyperRectangleBounds
+from InstabilityInspector.pynever.tensors import Tensor
 
 DEBUG = False
 
 
+def box_to_constraints(lower: Tensor, upper: Tensor) -> (Tensor, Tensor):
+    """
+    Procedure to build the matrices C and d of the box lower <= x <= upper as Cx <= d, the two constraints of
+    each variable are consecutive rows: x_i <= upper_i and -x_i <= -lower_i
+    """
+
+    lower = np.array(lower, dtype=float).reshape(-1)
+    upper = np.array(upper, dtype=float).reshape(-1)
+    num_vars = lower.shape[0]
+    indexes = np.arange(num_vars)
+
+    coeff = np.zeros((2 * num_vars, num_vars))
+    coeff[2 * indexes, indexes] = 1
+    coeff[2 * indexes + 1, indexes] = -1
+
+    bias = np.empty((2 * num_vars, 1))
+    bias[0::2, 0] = upper
+    bias[1::2, 0] = -lower
+
+    return coeff, bias
+
+
 class PropertyFormatConverter:
     """
        A class used for converting a NeverProperty in format Cx<=input into two vectors: a lower_bound_vector and an
-       upper_bound_vector.
+       upper_bound_vector. If the property already has its input box (in_bounds) the matrices are not read.
 
        Attributes
        ----------
@@ -18,6 +41,16 @@ class PropertyFormatConverter:
        """
 
     def __init__(self, property=None):
+        in_bounds = getattr(property, 'in_bounds', None)
+
+        if in_bounds is not None:
+            self.coeff = None
+            self.bias = None
+            self.lower_bound_vector = np.array(in_bounds.get_lower(), dtype=float).reshape(-1)
+            self.upper_bound_vector = np.array(in_bounds.get_upper(), dtype=float).reshape(-1)
+            self.num_vars = self.lower_bound_vector.shape[0]
+            return
+
         if property is not None:
             self.coeff = property.in_coef_mat
             self.bias = property.in_bias_mat
@@ -27,13 +60,7 @@ class PropertyFormatConverter:
         self.num_vars = self.coeff.shape[1]
 
         self.check_input_validity()
-
-        self.lower_bound_vector = np.empty(self.num_vars, dtype=object)
-        self.lower_bound_vector.fill(None)
-        self.upper_bound_vector = np.empty(self.num_vars, dtype=object)
-        self.upper_bound_vector.fill(None)
-
-        self.get_vectors()
+        self.compute_vectors()
 
     def check_input_validity(self):
         """
@@ -43,23 +70,27 @@ class PropertyFormatConverter:
         assert self.coeff.shape[0] == self.bias.shape[0], "Wrong property format: not convertible"
 
         # Check that for each row in self.coeff matrix there is only one 1 or one -1
+        check = np.all((self.coeff == 0) | (self.coeff == 1) | (self.coeff == -1)) and \
+            np.all(np.count_nonzero(self.coeff, axis=1) == 1)
+        assert check, "Wrong property format: not convertible"
 
-        for row in self.coeff:
-            check = (all(x == 0 or x == -1 or x == 1 for x in row) and \
-                     (np.count_nonzero(row == 1) + np.count_nonzero(row == -1) == 1))
-            assert check, "Wrong property format: not convertible"
-
-    def get_vectors(self) -> HyperRectangleBounds:
+    def compute_vectors(self):
+        """
+        This code reads the lower and upper value of each input variable from its rows, as float vectors
+        """
+        rows, columns = np.nonzero(self.coeff)
+        signs = self.coeff[rows, columns]
+        values = np.array(self.bias, dtype=float).reshape(-1)[rows]
 
-        for index, row in enumerate(self.coeff):
-            index_of_one = np.where(row == 1)[0]
-            index_of_minus_one = np.where(row == -1)[0]
+        self.lower_bound_vector = np.full(self.num_vars, np.nan)
+        self.upper_bound_vector = np.full(self.num_vars, np.nan)
+        self.upper_bound_vector[columns[signs > 0]] = values[signs > 0]
+        self.lower_bound_vector[columns[signs < 0]] = -values[signs < 0]
 
-            if np.size(index_of_one) == 1:
-                self.upper_bound_vector[index_of_one[0]] = self.bias[index, 0]
+        assert not np.any(np.isnan(self.lower_bound_vector)) and not np.any(np.isnan(self.upper_bound_vector)), \
+            "Wrong property format: not convertible"
 
-            if np.size(index_of_minus_one) == 1:
-                self.lower_bound_vector[index_of_minus_one[0]] = - self.bias[index, 0]
+    def get_vectors(self) -> HyperRectangleBounds:
 
         # check that all elements of self.lower_bound_vector are lower than the related elements
         # of self.upper_bound_vector
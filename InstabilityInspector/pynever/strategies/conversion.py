@@ -1,15 +1,39 @@
 import abc
+import collections
 import copy
+import functools
+import hashlib
+import json
+import logging
+import os
 from typing import Optional
 
 import numpy as np
 import onnx
 import onnx.numpy_helper
 import torch
+from onnx import external_data_helper
 
 import InstabilityInspector.pynever.networks as networks
 import InstabilityInspector.pynever.nodes as nodes
 import InstabilityInspector.pynever.pytorch_layers as pyt_l
+from InstabilityInspector.pynever.strategies.utils import write_file_atomically
+
+# ONNX types stored as plain little-endian numpy arrays, which can be viewed without conversion
+ONNX_PLAIN_TYPES = {onnx.TensorProto.FLOAT, onnx.TensorProto.DOUBLE, onnx.TensorProto.FLOAT16,
+                    onnx.TensorProto.INT8, onnx.TensorProto.INT16, onnx.TensorProto.INT32, onnx.TensorProto.INT64,
+                    onnx.TensorProto.UINT8, onnx.TensorProto.UINT16, onnx.TensorProto.UINT32,
+                    onnx.TensorProto.UINT64, onnx.TensorProto.BOOL}
+
+# Maximum number of converted networks kept in memory by the ONNXConverter
+NETWORK_CACHE_SIZE = 32
+# Number of embedded weights of the largest ONNX model hashed by the ONNXConverter, larger models
+# are cached only if their key is given (e.g., by load_network_path)
+NETWORK_HASH_MAX_SIZE = 2 ** 18
+# Converted networks shared by the ONNXConverter instances, by hash of the ONNX model
+NETWORK_CACHE = collections.OrderedDict()
+
+logger = logging.getLogger("pynever.strategies.conversion")
 
 
 class AlternativeRepresentation(abc.ABC):
@@ -39,12 +63,17 @@ class ONNXNetwork(AlternativeRepresentation):
     ----------
     onnx_network : onnx.ModelProto
         Real ONNX network.
+    model_hash : str, Optional
+        Key of the content of the model for the conversion cache, computed from the model when
+        it is needed if it is not given (e.g., by load_network_path from the file of the model).
 
     """
 
-    def __init__(self, identifier: str, onnx_network: onnx.ModelProto, up_to_date: bool = True):
+    def __init__(self, identifier: str, onnx_network: onnx.ModelProto, up_to_date: bool = True,
+                 model_hash: Optional[str] = None):
         super().__init__(identifier, up_to_date)
         self.onnx_network = copy.deepcopy(onnx_network)
+        self.model_hash = model_hash
 
 
 class PyTorchNetwork(AlternativeRepresentation):
@@ -64,6 +93,24 @@ class PyTorchNetwork(AlternativeRepresentation):
         self.pytorch_network = copy.deepcopy(pytorch_network)
 
 
+class PyTorchInferenceNetwork(AlternativeRepresentation):
+    """
+    A class used to represent the PyTorch module used to evaluate a neural network. The module is in eval mode,
+    has float32 parameters which do not require gradients and it is not copied: it is built by
+    get_inference_module and it should not be modified.
+
+    Attributes
+    ----------
+    pytorch_network : torch.nn.Module
+        PyTorch module used for inference.
+
+    """
+
+    def __init__(self, identifier: str, pytorch_network: torch.nn.Module, up_to_date: bool = True):
+        super().__init__(identifier, up_to_date)
+        self.pytorch_network = pytorch_network
+
+
 class ConversionStrategy(abc.ABC):
     """
     An abstract class used to represent a Conversion Strategy.
@@ -114,7 +161,19 @@ class ConversionStrategy(abc.ABC):
 
 class ONNXConverter(ConversionStrategy):
     """
-    A class used to represent the conversion strategy for ONNX models.
+    A class used to represent the conversion strategy for ONNX models. The networks converted from
+    ONNX are cached by hash of the model (see ONNXNetwork.model_hash): the nodes of the cached networks
+    are shared by all the conversions of the same model and must not be modified.
+
+    Attributes
+    ----------
+    use_cache : bool, Optional
+        Flag to reuse the networks already converted in this process (default: True).
+    cache_dir : str, Optional
+        Folder where the converted networks are also saved, to reuse them across processes
+        (default: None, no on-disk cache). The networks are stored as arrays and a description of
+        their structure (see pack_network), so reading them does not run code, but the networks found
+        in the folder are used as they are: it should be writable only by trusted users.
 
     Methods
     ----------
@@ -125,6 +184,10 @@ class ONNXConverter(ConversionStrategy):
 
     """
 
+    def __init__(self, use_cache: bool = True, cache_dir: Optional[str] = None):
+        self.use_cache = use_cache
+        self.cache_dir = cache_dir
+
     @staticmethod
     def __add_onnx_relu(current_input: str, current_output: str, onnx_nodes: list):
 
@@ -676,7 +739,8 @@ class ONNXConverter(ConversionStrategy):
 
     def to_neural_network(self, alt_rep: ONNXNetwork) -> networks.NeuralNetwork:
         """
-        Convert the ONNX representation of interest to the internal one.
+        Convert the ONNX representation of interest to the internal one. If the model has already
+        been converted the network shares the nodes of the cached one.
 
         Parameters
         ----------
@@ -690,12 +754,85 @@ class ONNXConverter(ConversionStrategy):
 
         """
 
+        if not self.use_cache and self.cache_dir is None:
+            return self.__convert(alt_rep)
+
+        # Hashing the weights embedded in a large model costs more than converting it
+        if alt_rep.model_hash is None:
+            embedded_size = sum(int(np.prod(initializer.dims))
+                                for initializer in alt_rep.onnx_network.graph.initializer
+                                if not external_data_helper.uses_external_data(initializer))
+            if embedded_size > NETWORK_HASH_MAX_SIZE:
+                return self.__convert(alt_rep)
+            alt_rep.model_hash = onnx_model_hash(alt_rep.onnx_network)
+        key = alt_rep.model_hash
+        network = NETWORK_CACHE.get(key) if self.use_cache else None
+
+        if network is None and self.cache_dir is not None:
+            network = self.__load_cached_network(key)
+
+        if network is None:
+            network = self.__convert(alt_rep)
+
+            if self.cache_dir is not None:
+                self.__save_cached_network(key, network)
+
+        if self.use_cache:
+            NETWORK_CACHE[key] = network
+            NETWORK_CACHE.move_to_end(key)
+            while len(NETWORK_CACHE) > NETWORK_CACHE_SIZE:
+                NETWORK_CACHE.popitem(last=False)
+
+        return share_network(network, alt_rep.identifier)
+
+    def __load_cached_network(self, key: str) -> Optional[networks.NeuralNetwork]:
+        """
+        Procedure to read a converted network from the on-disk cache.
+
+        """
+
+        path = os.path.join(self.cache_dir, key + '.npz')
+        if not os.path.isfile(path):
+            return None
+
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                return unpack_network(data)
+
+        except Exception as e:
+            logger.debug(f'Cannot read the converted network {path}: {e}')
+            return None
+
+    def __save_cached_network(self, key: str, network: networks.NeuralNetwork):
+        """
+        Procedure to write a converted network to the on-disk cache. The file is written under a
+        temporary name and then renamed, so that concurrent processes never read a partial file.
+
+        """
+
+        try:
+            arrays = pack_network(network)
+        except TypeError as e:
+            logger.debug(f'Cannot save the converted network of {key}: {e}')
+            return
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            write_file_atomically(os.path.join(self.cache_dir, key + '.npz'), lambda f: np.savez(f, **arrays))
+
+        except OSError as e:
+            logger.debug(f'Cannot write the converted network of {key}: {e}')
+
+    def __convert(self, alt_rep: ONNXNetwork) -> networks.NeuralNetwork:
+        """
+        Procedure to build the internal representation by walking the ONNX graph.
+
+        """
+
         identifier = alt_rep.identifier
         network = networks.SequentialNetwork(identifier, alt_rep.onnx_network.graph.input[0].name)
 
-        parameters = {}
-        for initializer in alt_rep.onnx_network.graph.initializer:
-            parameters[initializer.name] = onnx.numpy_helper.to_array(initializer)
+        parameters = get_onnx_parameters(alt_rep.onnx_network)
 
         shape_info = {}
         for i in alt_rep.onnx_network.graph.input:
@@ -1092,11 +1229,11 @@ class PyTorchConverter(ConversionStrategy):
                                                  in_features=layer.in_features, out_features=layer.out_features,
                                                  bias=has_bias)
 
-                        weight = torch.from_numpy(layer.weight)
+                        weight = parameter_to_torch(layer.weight)
                         new_layer.weight.data = weight
 
                         if has_bias:
-                            bias = torch.from_numpy(layer.bias)
+                            bias = parameter_to_torch(layer.bias)
                             new_layer.bias.data = bias
 
                     elif isinstance(layer, nodes.BatchNormNode):
@@ -1128,10 +1265,10 @@ class PyTorchConverter(ConversionStrategy):
                             raise Exception("Pytorch does not support batchnorm layer for input with more than"
                                             "4 or less than 1 dimension excluding the batch dimension")
 
-                        new_layer.weight.data = torch.from_numpy(layer.weight)
-                        new_layer.bias.data = torch.from_numpy(layer.bias)
-                        new_layer.running_mean.data = torch.from_numpy(layer.running_mean)
-                        new_layer.running_var.data = torch.from_numpy(layer.running_var)
+                        new_layer.weight.data = parameter_to_torch(layer.weight)
+                        new_layer.bias.data = parameter_to_torch(layer.bias)
+                        new_layer.running_mean.data = parameter_to_torch(layer.running_mean)
+                        new_layer.running_var.data = parameter_to_torch(layer.running_var)
 
                     elif isinstance(layer, nodes.ConvNode):
 
@@ -1165,9 +1302,9 @@ class PyTorchConverter(ConversionStrategy):
                             raise Exception("Pytorch does not support Conv layer for input with more than"
                                             "4 or less than 2 dimension excluding the batch dimension")
 
-                        new_layer.weight.data = torch.from_numpy(layer.weight)
+                        new_layer.weight.data = parameter_to_torch(layer.weight)
                         if layer.has_bias:
-                            new_layer.bias.data = torch.from_numpy(layer.bias)
+                            new_layer.bias.data = parameter_to_torch(layer.bias)
 
                     elif isinstance(layer, nodes.AveragePoolNode):
 
@@ -1492,8 +1629,8 @@ def load_network_path(path: str) -> Optional[AlternativeRepresentation]:
         module = torch.load(path)
         return PyTorchNetwork(net_id, module, True)
     elif extension == 'onnx':
-        model_proto = onnx.load(path)
-        return ONNXNetwork(net_id, model_proto, True)
+        model_proto = load_onnx_model(path)
+        return ONNXNetwork(net_id, model_proto, True, onnx_file_hash(path, model_proto))
     else:
         return None
 
@@ -1515,3 +1652,359 @@ def save_network_path(network: AlternativeRepresentation, path: str) -> None:
         torch.save(network.pytorch_network, path)
     elif isinstance(network, ONNXNetwork):
         onnx.save(network.onnx_network, path)
+
+
+def onnx_model_hash(model: onnx.ModelProto) -> str:
+    """
+    Method to compute the hash of the content of an ONNX model. The external data is identified
+    by path, modification time and size of its files, so that it is not read.
+
+    Parameters
+    ----------
+    model : onnx.ModelProto
+        The ONNX model.
+
+    Returns
+    -------
+    str
+        The hexadecimal digest of the model.
+
+    """
+
+    digest = hashlib.blake2b(model.SerializeToString(deterministic=True), digest_size=20)
+    update_external_data_hash(digest, model)
+
+    return digest.hexdigest()
+
+
+def onnx_file_hash(path: str, model: onnx.ModelProto) -> str:
+    """
+    Method to compute the key of an ONNX model loaded from a file, from path, modification time
+    and size of the file and of its external data. It avoids hashing the weights of the model.
+
+    Parameters
+    ----------
+    path : str
+        Path to the ONNX model.
+    model : onnx.ModelProto
+        The ONNX model loaded from the file.
+
+    Returns
+    -------
+    str
+        The hexadecimal digest of the model.
+
+    """
+
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+
+    digest = hashlib.blake2b(f'file\0{path}\0{stat.st_mtime_ns}\0{stat.st_size}'.encode(), digest_size=20)
+    update_external_data_hash(digest, model)
+
+    return digest.hexdigest()
+
+
+def update_external_data_hash(digest, model: onnx.ModelProto):
+    """
+    Procedure to add the files of the external data of a model to a hash, by path, modification time
+    and size, so that the data is not read.
+
+    """
+
+    for initializer in model.graph.initializer:
+        if external_data_helper.uses_external_data(initializer):
+            info = external_data_helper.ExternalDataInfo(initializer)
+            path = os.path.abspath(os.path.join(info.basepath, info.location))
+            stat = os.stat(path)
+            digest.update(f'\0{path}\0{stat.st_mtime_ns}\0{stat.st_size}'.encode())
+
+
+def pack_network(network: networks.NeuralNetwork) -> dict:
+    """
+    Method to store a network as arrays, which are read back by unpack_network. The entry 'structure' is
+    the JSON description of the network and of its nodes: their classes and attributes, where the arrays
+    are replaced by the names of the other entries.
+
+    Parameters
+    ----------
+    network : NeuralNetwork
+        The network to store.
+
+    Returns
+    -------
+    dict
+        The arrays of the network by name, for np.savez.
+
+    """
+
+    arrays = {}
+
+    def encode(value):
+        if isinstance(value, np.ndarray):
+            name = f'array_{len(arrays)}'
+            arrays[name] = value
+            return {'array': name}
+        elif isinstance(value, tuple):
+            return {'tuple': [encode(item) for item in value]}
+        elif isinstance(value, list):
+            return [encode(item) for item in value]
+        elif isinstance(value, np.generic):
+            return value.item()
+        elif value is None or isinstance(value, (bool, int, float, str)):
+            return value
+        else:
+            raise TypeError(f'Cannot store a value of type {type(value)}')
+
+    def encode_object(obj, skip: tuple = ()) -> dict:
+        return {'class': type(obj).__name__,
+                'attributes': {name: encode(value) for name, value in vars(obj).items() if name not in skip}}
+
+    structure = encode_object(network, skip=('nodes', 'edges', 'alt_rep_cache', 'up_to_date'))
+    structure['nodes'] = [encode_object(node) for node in network.nodes.values()]
+    structure['edges'] = network.edges
+    arrays['structure'] = np.array(json.dumps(structure))
+
+    return arrays
+
+
+def unpack_network(data) -> networks.NeuralNetwork:
+    """
+    Method to rebuild a network stored by pack_network. Only the classes of the networks and of the nodes
+    of pynever are built, and no code is run to restore their attributes.
+
+    Parameters
+    ----------
+    data : Mapping
+        The arrays of the network by name, e.g., as loaded by np.load.
+
+    Returns
+    -------
+    NeuralNetwork
+        The network.
+
+    """
+
+    def decode(value):
+        if isinstance(value, dict):
+            if 'array' in value:
+                return data[value['array']]
+            return tuple(decode(item) for item in value['tuple'])
+        elif isinstance(value, list):
+            return [decode(item) for item in value]
+        return value
+
+    def decode_object(description: dict, module, base: type):
+        cls = getattr(module, description['class'], None)
+        if not (isinstance(cls, type) and issubclass(cls, base)):
+            raise Exception(f"{description['class']} is not a {base.__name__}")
+
+        obj = cls.__new__(cls)
+        obj.__dict__.update({name: decode(value) for name, value in description['attributes'].items()})
+        return obj
+
+    structure = json.loads(str(data['structure']))
+
+    network = decode_object(structure, networks, networks.NeuralNetwork)
+    network.nodes = {}
+    for description in structure['nodes']:
+        node = decode_object(description, nodes, nodes.LayerNode)
+        network.nodes[node.identifier] = node
+    network.edges = {node_id: list(children) for node_id, children in structure['edges'].items()}
+    network.alt_rep_cache = []
+    network.up_to_date = True
+
+    return network
+
+
+def share_network(network: networks.NeuralNetwork, identifier: str) -> networks.NeuralNetwork:
+    """
+    Method to build a network with the given identifier on the same nodes of a cached network.
+    The graph structure is copied, the nodes are shared.
+
+    Parameters
+    ----------
+    network : NeuralNetwork
+        The cached network.
+    identifier : str
+        The identifier of the new network.
+
+    Returns
+    -------
+    NeuralNetwork
+        The network sharing the nodes.
+
+    """
+
+    shared = copy.copy(network)
+    shared.identifier = identifier
+    shared.nodes = copy.copy(network.nodes)
+    shared.edges = {node_id: list(children) for node_id, children in network.edges.items()}
+    shared.alt_rep_cache = []
+    shared.up_to_date = True
+
+    return shared
+
+
+def get_inference_module(network: networks.NeuralNetwork) -> torch.nn.Module:
+    """
+    Method to get the eval-mode, float32 PyTorch module computing the function of the network. The module is built
+    once and kept in the alternative representations of the network, which are discarded when a node is added to or
+    removed from the network.
+
+    Parameters
+    ----------
+    network : NeuralNetwork
+        The neural network to evaluate.
+
+    Returns
+    -------
+    torch.nn.Module
+        The PyTorch module of the network, shared between the callers.
+
+    """
+
+    for alt_rep in network.alt_rep_cache:
+        if isinstance(alt_rep, PyTorchInferenceNetwork) and alt_rep.up_to_date:
+            return alt_rep.pytorch_network
+
+    py_net = PyTorchConverter().from_neural_network(network)
+
+    # A PyTorch representation of the network (e.g., after the training) is copied to keep its mode and dtype
+    if any(alt_rep is py_net for alt_rep in network.alt_rep_cache):
+        module = copy.deepcopy(py_net.pytorch_network)
+    else:
+        module = py_net.pytorch_network
+
+    module.eval()
+    module.float()
+    module.requires_grad_(False)
+
+    network.alt_rep_cache.append(PyTorchInferenceNetwork(py_net.identifier, module))
+
+    return module
+
+
+def parameter_to_torch(array: np.ndarray) -> torch.Tensor:
+    """
+    Method to convert a parameter of a node to a torch tensor sharing its memory. The read-only
+    arrays (e.g., memory-mapped ONNX weights) are copied, since training updates the parameters in place.
+
+    """
+
+    if not array.flags.writeable:
+        array = array.copy()
+
+    return torch.from_numpy(array)
+
+
+def load_onnx_model(path: str) -> onnx.ModelProto:
+    """
+    Method to load an ONNX model without reading its external data. The directory of the model
+    is recorded in the external data of the initializers (key 'basepath'), so that the tensors
+    can be memory-mapped by get_onnx_parameters and the model opens without reading the weights.
+
+    Parameters
+    ----------
+    path : str
+        Path to the ONNX model.
+
+    Returns
+    -------
+    onnx.ModelProto
+        The ONNX model, the external data of the initializers is not loaded.
+
+    """
+
+    model_proto = onnx.load(path, load_external_data=False)
+    base_dir = os.path.dirname(os.path.abspath(path))
+
+    for initializer in model_proto.graph.initializer:
+        if external_data_helper.uses_external_data(initializer) and \
+                not external_data_helper.ExternalDataInfo(initializer).basepath:
+            entry = initializer.external_data.add()
+            entry.key = 'basepath'
+            entry.value = base_dir
+
+    return model_proto
+
+
+@functools.lru_cache(maxsize=16)
+def map_onnx_data_file(path: str, mtime_ns: int, size: int) -> np.memmap:
+    """
+    Method to memory-map a file of ONNX external data. The maps are read-only and cached by path,
+    modification time and size, so the tensors of the same file share the same pages, also with
+    the worker processes forked afterwards.
+
+    """
+
+    return np.memmap(path, dtype=np.uint8, mode='r')
+
+
+def onnx_tensor_to_array(tensor: onnx.TensorProto) -> np.ndarray:
+    """
+    Method to convert an ONNX tensor to a read-only numpy array without copying the data: external
+    data is memory-mapped and raw data is viewed in place. The other encodings are converted by
+    onnx.numpy_helper.
+
+    Parameters
+    ----------
+    tensor : onnx.TensorProto
+        The ONNX tensor.
+
+    Returns
+    -------
+    np.ndarray
+        The read-only array of the tensor.
+
+    """
+
+    dims = tuple(tensor.dims)
+    dtype = np.dtype(onnx.helper.tensor_dtype_to_np_dtype(tensor.data_type)).newbyteorder('<')
+    n_bytes = int(np.prod(dims, dtype=np.int64)) * dtype.itemsize
+    plain_dtype = tensor.data_type in ONNX_PLAIN_TYPES
+
+    if external_data_helper.uses_external_data(tensor):
+        info = external_data_helper.ExternalDataInfo(tensor)
+        path = os.path.join(info.basepath, info.location)
+
+        if plain_dtype and (info.length is None or info.length == n_bytes):
+            stat = os.stat(path)
+            data = map_onnx_data_file(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+            array = np.frombuffer(data, dtype=dtype, count=n_bytes // dtype.itemsize,
+                                  offset=info.offset or 0).reshape(dims)
+        else:
+            array = onnx.numpy_helper.to_array(tensor, info.basepath)
+
+    elif tensor.HasField('raw_data') and plain_dtype:
+        # Each access to raw_data returns a new copy of the bytes
+        raw_data = tensor.raw_data
+        if len(raw_data) == n_bytes:
+            array = np.frombuffer(raw_data, dtype=dtype).reshape(dims)
+        else:
+            array = onnx.numpy_helper.to_array(tensor)
+
+    else:
+        array = onnx.numpy_helper.to_array(tensor)
+
+    array.flags.writeable = False
+    return array
+
+
+def get_onnx_parameters(model: onnx.ModelProto) -> dict:
+    """
+    Method to read the initializers of an ONNX model as read-only numpy arrays, see onnx_tensor_to_array.
+
+    Parameters
+    ----------
+    model : onnx.ModelProto
+        The ONNX model.
+
+    Returns
+    -------
+    dict
+        The arrays of the initializers by name.
+
+    """
+
+    return {initializer.name: onnx_tensor_to_array(initializer) for initializer in model.graph.initializer}
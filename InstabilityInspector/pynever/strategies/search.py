@@ -1,4 +1,7 @@
-import copy
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Optional
 
 import numpy as np
 
@@ -6,10 +9,19 @@ import InstabilityInspector.pynever.strategies.abstraction as abst
 from InstabilityInspector.pynever import nodes
 from InstabilityInspector.pynever.networks import SequentialNetwork
 from InstabilityInspector.pynever.strategies.abstraction import Star
-from InstabilityInspector.pynever.strategies.bp.bounds_manager import BoundsManager
+from InstabilityInspector.pynever.strategies.bp.bounds import HyperRectangleBounds, SymbolicLinearBounds
+from InstabilityInspector.pynever.strategies.bp.bounds_manager import BoundsManager, net2list
+from InstabilityInspector.pynever.strategies.bp.linearfunctions import LinearFunctions
+from InstabilityInspector.pynever.strategies.bp.utils.utils import get_positive_part, get_negative_part, \
+    compute_lin_lower_and_upper
+from InstabilityInspector.pynever.strategies.bp.utils.property_converter import PropertyFormatConverter
 from InstabilityInspector.pynever.tensors import Tensor
 
 
+# Margin by which a constraint must be violated by the output bounds to discard a disjunct of the property
+SYMBOLIC_GUARD = 1e-9
+
+
 class RefinementTarget:
     """
 
@@ -21,6 +33,86 @@ class RefinementTarget:
         self.neuron_idx = neuron
 
 
+class PropagationCache:
+    """
+    Bounded cache of the products of the Fully Connected layers computed during a
+    search. The products only depend on the center and the basis of the star, which
+    are shared by the stars of the search tree until they diverge (e.g., the star
+    of a stable neuron repeats the propagation of its parent), so they are stored
+    by content. The least recently used products are evicted when the memory
+    occupied exceeds the limit
+
+    Attributes
+    ----------
+    max_bytes : int
+        The maximum memory occupied by the cached products in bytes
+    nbytes : int
+        The memory currently occupied by the cached products in bytes
+    hits : int
+        The number of products found in the cache
+    misses : int
+        The number of products computed
+
+    """
+
+    def __init__(self, max_bytes: int = 2 ** 28):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+
+    @staticmethod
+    def get_key(star: Star, layer: nodes.FullyConnectedNode) -> tuple:
+        """
+        Procedure to compute the key of the product of a star with a layer
+
+        """
+
+        digest = hashlib.blake2b(digest_size=16)
+        for array in (star.center, star.basis_matrix):
+            array = np.ascontiguousarray(array, dtype=float)
+            digest.update(str(array.shape).encode())
+            digest.update(array.data)
+
+        return layer.identifier, digest.digest()
+
+    def get(self, key: tuple) -> Optional[tuple]:
+        """
+        Procedure to retrieve the center and the basis of a product, None if it is not cached
+
+        """
+
+        products = self.__entries.get(key)
+        if products is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.__entries.move_to_end(key)
+
+        return products
+
+    def put(self, key: tuple, center: Tensor, basis_matrix: Tensor):
+        """
+        Procedure to store the center and the basis of a product. The arrays are shared
+        by all the stars that hit the entry, so they are made read-only
+
+        """
+
+        size = center.nbytes + basis_matrix.nbytes
+        if size > self.max_bytes or key in self.__entries:
+            return
+
+        center.flags.writeable = False
+        basis_matrix.flags.writeable = False
+        self.__entries[key] = (center, basis_matrix)
+        self.nbytes += size
+
+        while self.nbytes > self.max_bytes:
+            _, (old_center, old_basis) = self.__entries.popitem(last=False)
+            self.nbytes -= old_center.nbytes + old_basis.nbytes
+
+
 def get_bounds(nn: SequentialNetwork, prop: 'NeVerProperty', strategy: str) -> dict:
     """
     This function gets the bounds of the neural network for the given property
@@ -39,20 +131,147 @@ def get_bounds(nn: SequentialNetwork, prop: 'NeVerProperty', strategy: str) -> d
     Returns
     ----------
     dict
-        The dictionary of the bounds wrapped in an AbstractBounds object for each layer
+        The dictionary of the bounds: 'symbolic', 'numeric_pre' and 'numeric_post' contain the bounds of the
+        layers as computed by the BoundsManager, 'input' the input box and 'phases' the phases of the ReLU
+        neurons fixed by the splits (see update_bounds)
 
     """
 
     if strategy == 'symbolic':
-        # Return the pre-activation bounds for ReLU layers
-        return BoundsManager(nn, prop).compute_bounds()
+        input_hyper_rect = PropertyFormatConverter(prop).get_vectors()
+        symbolic, numeric_pre, numeric_post = BoundsManager(nn, prop).compute_bounds(input_hyper_rect)
+
+        return {
+            'symbolic': symbolic,
+            'numeric_pre': numeric_pre,
+            'numeric_post': numeric_post,
+            'input': input_hyper_rect,
+            'phases': {}
+        }
     elif strategy == 'lirpa':
         # return something...
         pass
     # TODO add more strategies
 
 
-def abs_propagation(star: Star, bounds: dict, nn_list: list) -> Star:
+def get_preactivation_bounds(bounds: dict, nn_list: list, layer_idx: int) -> HyperRectangleBounds:
+    """
+    This function returns the pre-activation bounds of a ReLU layer, i.e., the
+    output bounds of the previous layer
+
+    Parameters
+    ----------
+    bounds : dict
+        The bounds of the network layers
+    nn_list : list
+        The neural network represented as a list
+    layer_idx : int
+        The index of the ReLU layer
+
+    Returns
+    ----------
+    HyperRectangleBounds
+        The pre-activation bounds of the layer
+
+    """
+
+    return bounds['numeric_pre'][nn_list[layer_idx - 1].identifier]
+
+
+def update_bounds(bounds: dict, nn_list: list, layer_idx: int, neuron_idx: int, phase: int) -> dict:
+    """
+    This function computes the bounds of a branch of the search where the phase of
+    a ReLU neuron is fixed: the symbolic bounds are propagated again from the layer
+    of the neuron, reusing the bounds of the previous layers, with the neuron (and
+    the neurons fixed by the previous splits) relaxed exactly. Since both the new
+    numeric bounds and the ones of the parent hold in the branch, they are intersected
+
+    Parameters
+    ----------
+    bounds : dict
+        The bounds of the parent branch
+    nn_list : list
+        The neural network represented as a list
+    layer_idx : int
+        The index of the ReLU layer of the neuron
+    neuron_idx : int
+        The index of the neuron in the layer
+    phase : int
+        1 if the neuron is active, -1 if it is inactive
+
+    Returns
+    ----------
+    dict
+        The bounds of the branch
+
+    """
+
+    phases = {layer_id: dict(layer_phases) for layer_id, layer_phases in bounds['phases'].items()}
+    phases.setdefault(nn_list[layer_idx].identifier, {})[neuron_idx] = phase
+
+    symbolic = dict(bounds['symbolic'])
+    numeric_pre = dict(bounds['numeric_pre'])
+    numeric_post = OrderedDict(bounds['numeric_post'])
+
+    BoundsManager(None, None).propagate_bounds(nn_list, layer_idx, bounds['input'],
+                                               symbolic[nn_list[layer_idx - 1].identifier][1], symbolic,
+                                               numeric_pre, numeric_post, phases)
+
+    for layer in nn_list[layer_idx - 1:]:
+        if isinstance(layer, nodes.FullyConnectedNode):
+            parent_bounds = bounds['numeric_pre'][layer.identifier]
+            new_bounds = numeric_pre[layer.identifier]
+            numeric_pre[layer.identifier] = HyperRectangleBounds(
+                np.maximum(new_bounds.get_lower(), parent_bounds.get_lower()),
+                np.minimum(new_bounds.get_upper(), parent_bounds.get_upper()))
+
+    return {
+        'symbolic': symbolic,
+        'numeric_pre': numeric_pre,
+        'numeric_post': numeric_post,
+        'input': bounds['input'],
+        'phases': phases
+    }
+
+
+def fc_forward(star: Star, layer: nodes.FullyConnectedNode, cache: Optional[PropagationCache] = None) -> Star:
+    """
+    This function propagates a star through a Fully Connected layer, reusing
+    the product stored in the cache if the same center and basis have already
+    been propagated through the layer
+
+    Parameters
+    ----------
+    star : Star
+        The star to propagate
+    layer : FullyConnectedNode
+        The layer of interest
+    cache : PropagationCache, optional
+        The cache of the products of the search
+
+    Returns
+    ----------
+    Star
+        The propagated star
+
+    """
+
+    if cache is None:
+        # Need to expand bias since they are memorized like one-dimensional vectors in FC nodes.
+        return abst.single_fc_forward(star, layer.weight, np.reshape(layer.bias, (-1, 1))).pop()
+
+    key = cache.get_key(star, layer)
+    products = cache.get(key)
+
+    if products is None:
+        new_star = abst.single_fc_forward(star, layer.weight, np.reshape(layer.bias, (-1, 1))).pop()
+        cache.put(key, new_star.center, new_star.basis_matrix)
+        return new_star
+
+    return star.derive(products[0], products[1])
+
+
+def abs_propagation(star: Star, bounds: dict, nn_list: list, cache: Optional[PropagationCache] = None) -> Star:
     """
     This method performs the abstract propagation of a single star starting
     from a specific layer and neuron. The output is a single star that uses
@@ -66,6 +285,8 @@ def abs_propagation(star: Star, bounds: dict, nn_list: list) -> Star:
         The bounds of the network layers
     nn_list : list
         The neural network represented as a list
+    cache : PropagationCache, optional
+        The cache of the Fully Connected products of the search
 
     Returns
     ----------
@@ -82,16 +303,11 @@ def abs_propagation(star: Star, bounds: dict, nn_list: list) -> Star:
 
         # Propagate fully connected entirely
         if isinstance(layer, nodes.FullyConnectedNode):
-            # Need to expand bias since they are memorized like one-dimensional vectors in FC nodes.
-            if layer.bias.shape != (layer.weight.shape[0], 1):
-                bias = np.expand_dims(layer.bias, 1)
-            else:
-                bias = layer.bias
-            star = abst.single_fc_forward(star, layer.weight, bias).pop()
+            star = fc_forward(star, layer, cache)
 
         # Propagate ReLU starting from target
         elif isinstance(layer, nodes.ReLUNode):
-            l_bounds = bounds[layer.identifier]
+            l_bounds = get_preactivation_bounds(bounds, nn_list, i)
             if i == start_layer:
                 star = abst.approx_relu_forward(star, l_bounds, layer.in_dim[0], start_idx=neuron_idx)
             else:
@@ -103,7 +319,7 @@ def abs_propagation(star: Star, bounds: dict, nn_list: list) -> Star:
     return star
 
 
-def propagate_until_relu(star: Star, nn_list: list, skip: bool) -> Star:
+def propagate_until_relu(star: Star, nn_list: list, skip: bool, cache: Optional[PropagationCache] = None) -> Star:
     """
     This function performs the star propagation throughout Fully Connected layers
     only, until a ReLU layer is encountered. This is used in order to process
@@ -115,6 +331,10 @@ def propagate_until_relu(star: Star, nn_list: list, skip: bool) -> Star:
         The star to process
     nn_list : list
         The neural network represented as a list
+    skip : bool
+        Flag to propagate the star through the ReLU layer it refers to
+    cache : PropagationCache, optional
+        The cache of the Fully Connected products of the search
 
     Returns
     ----------
@@ -130,12 +350,7 @@ def propagate_until_relu(star: Star, nn_list: list, skip: bool) -> Star:
 
         # Propagate fully connected entirely
         if isinstance(layer, nodes.FullyConnectedNode):
-            # Need to expand bias since they are memorized like one-dimensional vectors in FC nodes.
-            if layer.bias.shape != (layer.weight.shape[0], 1):
-                bias = np.expand_dims(layer.bias, 1)
-            else:
-                bias = layer.bias
-            star = abst.single_fc_forward(star, layer.weight, bias).pop()
+            star = fc_forward(star, layer, cache)
             i += 1
 
         elif isinstance(layer, nodes.ReLUNode):
@@ -196,9 +411,9 @@ def check_intersection(star: Star, prop: 'NeVerProperty') -> (bool, list):
     return intersects, unsafe_stars
 
 
-def intersect_star_lp(current_star, net_list, nn_bounds, prop):
+def intersect_star_lp(current_star, net_list, nn_bounds, prop, cache=None):
     # Compute the output abstract star from current_star/bounds
-    out_star = abs_propagation(current_star, nn_bounds, net_list)
+    out_star = abs_propagation(current_star, nn_bounds, net_list, cache)
 
     # Check intersection using a LP
     intersects, unsafe_stars = check_intersection(out_star, prop)
@@ -206,29 +421,278 @@ def intersect_star_lp(current_star, net_list, nn_bounds, prop):
     return intersects, unsafe_stars
 
 
-def intersect_symb_lp(current_star, net_list, nn_bounds, prop, target):
-    output = None
-    # output >= nn_bounds[0]['model_out'][1].lower.matrix * x_input + lower.offset
-    # output <= nn_bounds[0]['model_out'][1].upper.matrix * x_input + upper.offset
-    # y0 >= 0.25 x0
-    # y0 <= 0.25 x0 + 0.25
-    # I can build a star from this!
+def check_symbolic_intersection(bounds: dict, nn_list: list, prop: 'NeVerProperty') -> bool:
+    """
+    This function checks whether the output bounds of the network may intersect
+    the output property. The constraints C y <= d of each disjunct of the property
+    are composed with the last Fully Connected layer and bounded with the symbolic
+    bounds of its input, as they were an additional layer of the network: if the
+    minimum of some constraint on the input box exceeds d the disjunct is unreachable.
+    The check does not need any LP, but it is inconclusive when the bounds are too loose
 
-    # TODO is it possible to check whether it is fully inside?
-    intersects, unsafe_stars = check_intersection(output, prop)
-    return intersects, unsafe_stars
+    Parameters
+    ----------
+    bounds : dict
+        The bounds of the network layers
+    nn_list : list
+        The neural network represented as a list
+    prop : NeVerProperty
+        The property of interest
+
+    Returns
+    ----------
+    bool
+        False if the output bounds do not intersect the property, True if the check is inconclusive
+
+    """
+
+    out_layer = nn_list[-1]
+    out_numeric = bounds['numeric_pre'].get(out_layer.identifier, bounds['numeric_post'][out_layer.identifier])
+    out_lower = np.array(out_numeric.get_lower(), dtype=float).reshape(-1)
+    out_upper = np.array(out_numeric.get_upper(), dtype=float).reshape(-1)
+
+    if isinstance(out_layer, nodes.FullyConnectedNode):
+        # The constraints are expressed on the input of the last layer
+        if len(nn_list) > 1:
+            in_symbolic = bounds['symbolic'][nn_list[-2].identifier][1]
+        else:
+            in_size = bounds['input'].get_size()
+            identity = LinearFunctions(np.identity(in_size), np.zeros(in_size))
+            in_symbolic = SymbolicLinearBounds(identity, identity)
+        weight = out_layer.weight
+        bias = np.zeros(weight.shape[0]) if out_layer.bias is None else np.reshape(out_layer.bias, -1)
+    else:
+        in_symbolic = bounds['symbolic'][out_layer.identifier][1]
+        weight = np.identity(out_lower.shape[0])
+        bias = np.zeros(out_lower.shape[0])
+
+    for i in range(len(prop.out_coef_mat)):
+        coef_mat = np.array(prop.out_coef_mat[i], dtype=float)
+        bias_mat = np.array(prop.out_bias_mat[i], dtype=float).reshape(-1)
+
+        # Minimum of C y on the output box
+        numeric_min = np.matmul(np.maximum(coef_mat, 0), out_lower) + np.matmul(np.minimum(coef_mat, 0), out_upper)
+
+        # Symbolic lower bound of C y = C W x + C b, minimized on the input box
+        composed = np.matmul(coef_mat, weight)
+        lower_matrix, lower_offset, _, _ = compute_lin_lower_and_upper(get_negative_part(composed),
+                                                                       get_positive_part(composed),
+                                                                       np.matmul(coef_mat, bias),
+                                                                       in_symbolic.get_lower().get_matrix(),
+                                                                       in_symbolic.get_upper().get_matrix(),
+                                                                       in_symbolic.get_lower().get_offset(),
+                                                                       in_symbolic.get_upper().get_offset())
+        symbolic_min = LinearFunctions(lower_matrix, lower_offset).compute_min_values(bounds['input'])
+
+        if not np.any(np.maximum(numeric_min, symbolic_min) > bias_mat + SYMBOLIC_GUARD):
+            return True
+
+    return False
+
+
+def intersect_symb_lp(current_star, net_list, nn_bounds, prop, cache=None):
+    # The output bounds are checked first, the LP is only needed if they may intersect the property
+    if not check_symbolic_intersection(nn_bounds, net_list, prop):
+        return False, []
+
+    return intersect_star_lp(current_star, net_list, nn_bounds, prop, cache)
+
+
+def get_output_margin(point: Tensor, nn_list: list, prop: 'NeVerProperty') -> float:
+    """
+    This function computes the concrete output of the network for an input point
+    and measures how much it violates the property: the margin is the largest,
+    among the disjuncts of the output property, of the smallest slack of the
+    constraints of the disjunct. A non-negative margin means that the point is
+    a counterexample
+
+    Parameters
+    ----------
+    point : Tensor
+        The input point
+    nn_list : list
+        The neural network represented as a list
+    prop : NeVerProperty
+        The property of interest
+
+    Returns
+    ----------
+    float
+        The violation margin of the point
+
+    """
+
+    output = point
+    for layer in nn_list:
+        if isinstance(layer, nodes.FullyConnectedNode):
+            output = np.matmul(layer.weight, output) + np.reshape(layer.bias, (-1, 1))
+        elif isinstance(layer, nodes.ReLUNode):
+            output = np.maximum(output, 0)
+        else:
+            raise NotImplementedError('Unsupported layer')
+
+    return max(np.min(prop.out_bias_mat[i] - np.matmul(prop.out_coef_mat[i], output))
+               for i in range(len(prop.out_coef_mat)))
+
+
+def get_frontier_score(strategy: str, star: Star, depth: int, margin: float, in_dim: int) -> float:
+    """
+    This function computes the priority of a star in the search frontier,
+    the stars with lower scores are processed first. The strategies are
+
+    - dfs: depth-first order, i.e., the last star added is processed first
+    - depth: the deepest stars in the search tree are processed first
+    - violation: the stars whose parent output is closest to a violation of the property are processed first
+    - volume: the stars with the largest input box are processed first
+
+    Parameters
+    ----------
+    strategy : str
+        The scoring strategy
+    star : Star
+        The star to score
+    depth : int
+        The depth of the star in the search tree
+    margin : float
+        The violation margin of the parent star
+    in_dim : int
+        The number of input variables
+
+    Returns
+    ----------
+    float
+        The score of the star
+
+    """
+
+    if strategy == 'dfs':
+        return 0.0
+    elif strategy == 'depth':
+        return -depth
+    elif strategy == 'violation':
+        return -margin
+    elif strategy == 'volume':
+        lower, upper = star.get_predicate_box()
+        widths = np.maximum(upper[:in_dim] - lower[:in_dim], 1e-12)
+        return -float(np.sum(np.log(widths)))
+    else:
+        raise NotImplementedError(f'Frontier strategy {strategy} not supported')
+
+
+def process_star(star: Star, bounds: dict, depth: int, nn_list: list, prop: 'NeVerProperty', ref_heur: str,
+                 frontier_strategy: str, cache: Optional[PropagationCache] = None) -> (str, object):
+    """
+    This function processes a star of the search frontier: the output bounds of the
+    star are checked against the property and, if they may intersect it, the star is
+    propagated and intersected with the output property. If the intersection is not
+    empty, the star is either split on the next target or used to extract a counterexample
+
+    Parameters
+    ----------
+    star : Star
+        The star to process
+    bounds : dict
+        The bounds of the network layers for the star
+    depth : int
+        The depth of the star in the search tree
+    nn_list : list
+        The neural network represented as a list
+    prop : NeVerProperty
+        The property of interest
+    ref_heur : str
+        The heuristic used to choose the next target
+    frontier_strategy : str
+        The strategy used to score the new stars (see get_frontier_score)
+    cache : PropagationCache, optional
+        The cache of the Fully Connected products of the search
+
+    Returns
+    ----------
+    (str, object)
+        ('safe', None) if the star does not intersect the unsafe region, ('counterexample', Tensor) if a
+        counterexample has been found and ('split', list) otherwise, with the list of tuples
+        (score, depth, Star, bounds) of the new stars
+
+    """
+
+    intersects, unsafe_stars = intersect_symb_lp(star, nn_list, bounds, prop, cache)
+
+    if not intersects:
+        return 'safe', None
+
+    in_dim = prop.in_coef_mat.shape[1]
+    margin = 0.0
+    if frontier_strategy == 'violation':
+        # The input of a feasible point of the intersection is checked on the concrete network
+        point = unsafe_stars[0].get_witness()
+        if point is not None:
+            margin = get_output_margin(point[:in_dim], nn_list, prop)
+            if margin >= 0:
+                return 'counterexample', point[:in_dim]
+
+    # If new target is None there is no more refinement to do
+    target, star = get_next_target(ref_heur, star, nn_list, cache)
+
+    if target is None:
+        # Nothing else to split: found a counterexample
+        return 'counterexample', get_counterexample(unsafe_stars, prop)
+
+    # Split the current branch according to the target
+    children = []
+    for new_star, new_bounds in split_star(star, target, nn_list, bounds):
+        score = get_frontier_score(frontier_strategy, new_star, depth + 1, margin, in_dim)
+        children.append((score, depth + 1, new_star, new_bounds))
+
+    return 'split', children
+
+
+# State of the search worker processes, set by init_search_worker
+_worker_state = {}
+
+
+def init_search_worker(nn_list: list, prop: 'NeVerProperty', ref_heur: str, frontier_strategy: str,
+                       cache_size: int = 0):
+    """
+    Initializer of the worker processes of the parallel search: the data shared by
+    all the stars are sent once to each worker, and each worker keeps its own cache
+    of the Fully Connected products
+
+    """
+
+    _worker_state['nn_list'] = nn_list
+    _worker_state['prop'] = prop
+    _worker_state['ref_heur'] = ref_heur
+    _worker_state['frontier_strategy'] = frontier_strategy
+    _worker_state['cache'] = PropagationCache(cache_size) if cache_size > 0 else None
+
+
+def process_star_worker(star: Star, bounds: dict, depth: int) -> (str, object, float):
+    """
+    Worker side of the parallel search: it processes a star with process_star and
+    also returns the processing time
+
+    """
+
+    start = time.perf_counter()
+    status, payload = process_star(star, bounds, depth, _worker_state['nn_list'], _worker_state['prop'],
+                                   _worker_state['ref_heur'], _worker_state['frontier_strategy'],
+                                   _worker_state['cache'])
+
+    return status, payload, time.perf_counter() - start
 
 
 def get_next_target(ref_heur: str,
                     star: Star,
-                    nn_list: list) -> (RefinementTarget, Star):
+                    nn_list: list,
+                    cache: Optional[PropagationCache] = None) -> (RefinementTarget, Star):
     if ref_heur == 'sequential':
-        return get_target_sequential(star, nn_list)
+        return get_target_sequential(star, nn_list, cache)
     else:
         raise NotImplementedError('Only sequential refinement supported')
 
 
-def get_target_sequential(star: Star, nn_list: list) -> (RefinementTarget, Star):
+def get_target_sequential(star: Star, nn_list: list,
+                          cache: Optional[PropagationCache] = None) -> (RefinementTarget, Star):
     """
     This function updates the target for the refinement of the star using
     a sequential approach. For each ReLU layer all neurons are refined
@@ -240,6 +704,8 @@ def get_target_sequential(star: Star, nn_list: list) -> (RefinementTarget, Star)
         The star to refine
     nn_list : list
         The list of the network layers
+    cache : PropagationCache, optional
+        The cache of the Fully Connected products of the search
 
     Returns
     ----------
@@ -258,7 +724,7 @@ def get_target_sequential(star: Star, nn_list: list) -> (RefinementTarget, Star)
 
         return last_relu_idx
 
-    star = propagate_until_relu(star, nn_list, False)
+    star = propagate_until_relu(star, nn_list, False, cache)
     current_neuron = star.ref_neuron
 
     if current_neuron < star.center.shape[0]:
@@ -272,7 +738,7 @@ def get_target_sequential(star: Star, nn_list: list) -> (RefinementTarget, Star)
 
         else:
             # There is another ReLU layer: propagate the star to that layer and reset the neuron
-            star = propagate_until_relu(star, nn_list, True)
+            star = propagate_until_relu(star, nn_list, True, cache)
             star.ref_neuron = 0
             next_layer = star.ref_layer
             new_target = RefinementTarget(next_layer, 0)
@@ -352,7 +818,8 @@ def split_star(star: Star, target: RefinementTarget, nn_list: list, bounds_dict:
     The index relative to this neuron is determined by the heuristic that
     also takes into account what layer the star comes from.
 
-    When splitting I also need to update the bounds and return them
+    The bounds of the two stars of an unstable neuron are updated with the
+    phase of the neuron in each of them
 
     Parameters
     ----------
@@ -375,10 +842,7 @@ def split_star(star: Star, target: RefinementTarget, nn_list: list, bounds_dict:
 
     index = target.neuron_idx
 
-    mask = np.identity(star.center.shape[0])
-    mask[index, index] = 0
-
-    cur_bounds = bounds_dict[nn_list[star.ref_layer].identifier]
+    cur_bounds = get_preactivation_bounds(bounds_dict, nn_list, star.ref_layer)
     stable = abst.check_stable(index, cur_bounds)
 
     # Positive stable
@@ -389,11 +853,11 @@ def split_star(star: Star, target: RefinementTarget, nn_list: list, bounds_dict:
 
     # Negative stable
     elif stable == -1:
-        new_c = np.matmul(mask, star.center)
-        new_b = np.matmul(mask, star.basis_matrix)
-        new_pred = star.predicate_matrix
-        new_bias = star.predicate_bias
-        new_star = Star(new_pred, new_bias, new_c, new_b)
+        new_c = star.center.copy()
+        new_c[index] = 0
+        new_b = star.basis_matrix.copy()
+        new_b[index, :] = 0
+        new_star = star.derive(new_c, new_b)
 
         new_star.ref_layer = target.layer_idx
         new_star.ref_neuron = star.ref_neuron + 1
@@ -403,11 +867,11 @@ def split_star(star: Star, target: RefinementTarget, nn_list: list, bounds_dict:
     # Unstable
     else:
         # Lower star
-        lower_c = np.matmul(mask, star.center)
-        lower_b = np.matmul(mask, star.basis_matrix)
-        lower_pred = np.vstack((star.predicate_matrix, star.basis_matrix[index, :]))
-        lower_bias = np.vstack((star.predicate_bias, -star.center[index]))
-        lower_star = Star(lower_pred, lower_bias, lower_c, lower_b)
+        lower_c = star.center.copy()
+        lower_c[index] = 0
+        lower_b = star.basis_matrix.copy()
+        lower_b[index, :] = 0
+        lower_star = star.derive(lower_c, lower_b, star.basis_matrix[index:index + 1, :], -star.center[index])
 
         lower_star.ref_layer = target.layer_idx
         lower_star.ref_neuron = star.ref_neuron + 1
@@ -415,17 +879,14 @@ def split_star(star: Star, target: RefinementTarget, nn_list: list, bounds_dict:
         # Upper star
         upper_c = star.center
         upper_b = star.basis_matrix
-        upper_pred = np.vstack((star.predicate_matrix, -star.basis_matrix[index, :]))
-        upper_bias = np.vstack((star.predicate_bias, star.center[index]))
-        upper_star = Star(upper_pred, upper_bias, upper_c, upper_b)
+        upper_star = star.derive(upper_c, upper_b, -star.basis_matrix[index:index + 1, :], star.center[index])
 
         upper_star.ref_layer = target.layer_idx
         upper_star.ref_neuron = star.ref_neuron + 1
 
-        # TODO update bounds
         return [
-            (lower_star, bounds_dict),
-            (upper_star, bounds_dict)
+            (lower_star, update_bounds(bounds_dict, nn_list, star.ref_layer, index, -1)),
+            (upper_star, update_bounds(bounds_dict, nn_list, star.ref_layer, index, 1))
         ]
 
 
@@ -449,13 +910,14 @@ def get_counterexample(unsafe_stars: list, prop: 'NeverProperty') -> Tensor:
 
     """
 
-    # Extract counterexample stars
+    # Extract counterexample stars: the first predicate variables of every star are the input variables
     counterexample_stars = []
+    in_dim = prop.in_coef_mat.shape[1]
 
     for unsafe_star in unsafe_stars:
-        temp_star = abst.Star(prop.in_coef_mat, prop.in_bias_mat)
-        temp_star.predicate_matrix = copy.deepcopy(unsafe_star.predicate_matrix)
-        temp_star.predicate_bias = copy.deepcopy(unsafe_star.predicate_bias)
+        input_basis = np.zeros((in_dim, unsafe_star.n_vars))
+        input_basis[:, :in_dim] = np.identity(in_dim)
+        temp_star = unsafe_star.derive(np.zeros((in_dim, 1)), input_basis)
         counterexample_stars.append(temp_star)
 
     return counterexample_stars[0].get_samples(num_samples=1)[0]
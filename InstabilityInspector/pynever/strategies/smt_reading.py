@@ -1,9 +1,40 @@
+import functools
+import gzip
+import hashlib
+import logging
+import os
+import re
+from typing import Optional
+
 import numpy as np
 from pysmt.smtlib.parser import SmtLibParser
 
+from InstabilityInspector.pynever.strategies.bp.bounds import HyperRectangleBounds
+from InstabilityInspector.pynever.strategies.utils import write_file_atomically
 from InstabilityInspector.pynever.tensors import Tensor
 
 
+# Version of the compiled format, part of the key of the cached properties
+PROPERTY_CACHE_VERSION = b'1'
+
+logger = logging.getLogger("pynever.strategies.smt_reading")
+
+# Tokens of a SMTLIB file: parentheses and symbols, comments are removed before tokenizing
+SMT_TOKEN = re.compile(r'\(|\)|[^\s()]+')
+SMT_COMMENT = re.compile(r';[^\n]*')
+
+
+class UnsupportedSmtSyntax(Exception):
+    """
+    Exception raised by the VNNLIB reader when the file contains a construct that
+    is not a linear constraint on the input and output vectors. The parser then
+    falls back to pysmt
+
+    """
+
+    pass
+
+
 class ExprNode:
     """
     Class representing a binary Expression Tree in form of a recursive node.
@@ -223,16 +254,25 @@ class SmtPropertyParser:
     y_name: str
         Name of the output vector.
     in_coef_mat: Tensor
-        Matrix of the coefficients for the input constraints.
+        Matrix of the coefficients for the input constraints, built on first access.
     in_bias_mat: Tensor
-        Matrix of the biases for the input constraints.
+        Matrix of the biases for the input constraints, built on first access.
+    in_bounds: HyperRectangleBounds
+        The input box if the input constraints are bounds of single variables, None otherwise.
     out_coef_mat: list
         List of matrices of the coefficients for the output constraints.
     out_bias_mat: list
         List of matrices of the biases for the output constraints.
+    cache_dir: str, Optional
+        Folder where the compiled property is read and written, identified by the hash of the
+        content of the file (default: None, no cache).
 
     Methods
     -------
+    __get_commands()
+        Procedure to read the SMTLIB file as a list of commands in a single pass.
+    __parse_commands()
+        Procedure to fill the matrices from the commands of the file.
     __as_script()
         Procedure to serialize the SMTLIB file as a list of commands via pysmt.
     __get_assert_commands_for(x)
@@ -246,25 +286,213 @@ class SmtPropertyParser:
     get_components_of(str)
         Procedure to build a list containing the components of the 'str' vector,
         i.e., the declared variables beginning with 'str' in the SMTLIB file.
+    parse()
+        Procedure to parse the SMTLIB file, filling the attributes.
+    get_cache_path()
+        Procedure to compute the path of the compiled property.
     parse_property()
         Exposed procedure to parse the SMTLIB file and build the NeVerProperty.
 
     """
 
-    def __init__(self, smtlib_path: str, x_name: str, y_name: str):
+    def __init__(self, smtlib_path: str, x_name: str, y_name: str, cache_dir: Optional[str] = None):
         self.smtlib_path = smtlib_path
         self.x_name = x_name
         self.y_name = y_name
-        self.x = self.get_components_of(self.x_name)
-        self.y = self.get_components_of(self.y_name)
+        self.cache_dir = cache_dir
+        self.__commands = None
+        self.__script = None
+        self.__in_sparse = None
+        self.__cache_path = None
+        self.__parsed = False
         self.in_coef_mat = []
         self.in_bias_mat = []
+        self.in_bounds = None
         self.out_coef_mat = []
         self.out_bias_mat = []
 
+        if not (self.cache_dir is not None and self.__load_cache()):
+            self.x = self.get_components_of(self.x_name)
+            self.y = self.get_components_of(self.y_name)
+
+    @property
+    def in_coef_mat(self) -> Tensor:
+        if self.__in_sparse is not None:
+            self.__build_input_matrices()
+        return self.__in_coef_mat
+
+    @in_coef_mat.setter
+    def in_coef_mat(self, value: Tensor):
+        self.__in_coef_mat = value
+
+    @property
+    def in_bias_mat(self) -> Tensor:
+        if self.__in_sparse is not None:
+            self.__build_input_matrices()
+        return self.__in_bias_mat
+
+    @in_bias_mat.setter
+    def in_bias_mat(self, value: Tensor):
+        self.__in_bias_mat = value
+
+    def __build_input_matrices(self):
+        """
+        This method builds the input matrices from the sparse constraints read by
+        __parse_commands or loaded from the cache.
+
+        """
+
+        rows, columns, values, bias = self.__in_sparse
+        self.__in_coef_mat = np.zeros((bias.shape[0], len(self.x)))
+        np.add.at(self.__in_coef_mat, (rows, columns), values)
+        self.__in_bias_mat = bias.reshape(-1, 1).copy()
+        self.__in_sparse = None
+
+    def get_cache_path(self) -> str:
+        """
+        This method computes the path of the compiled property, from the hash of the
+        content of the file and of the names of the vectors.
+
+        Returns
+        ----------
+        str
+            The path of the compiled property.
+
+        """
+
+        if self.__cache_path is None:
+            digest = hashlib.blake2b(PROPERTY_CACHE_VERSION, digest_size=20)
+            digest.update(f'{self.x_name}\0{self.y_name}\0'.encode())
+            with open(self.smtlib_path, 'rb') as f:
+                digest.update(f.read())
+
+            self.__cache_path = os.path.join(self.cache_dir, digest.hexdigest() + '.npy')
+
+        return self.__cache_path
+
+    def __load_cache(self) -> bool:
+        """
+        This method fills the attributes from the compiled property, if it exists.
+
+        Returns
+        ----------
+        bool
+            True if the compiled property has been loaded, False otherwise.
+
+        """
+
+        try:
+            path = self.get_cache_path()
+            if not os.path.isfile(path):
+                return False
+
+            data = np.load(path, allow_pickle=False)
+            x, y, in_sparse, in_bounds, out_coef_mat, out_bias_mat = unpack_property(data)
+
+        except (OSError, ValueError, IndexError, UnicodeDecodeError) as e:
+            logger.debug(f'Cannot read the compiled property of {self.smtlib_path}: {e}')
+            return False
+
+        self.x, self.y = x, y
+        self.__in_sparse = in_sparse
+        self.in_bounds = in_bounds
+        self.out_coef_mat, self.out_bias_mat = out_coef_mat, out_bias_mat
+        self.__parsed = True
+
+        return True
+
+    def __save_cache(self):
+        """
+        This method writes the compiled property, the cache folder may be read-only.
+
+        """
+
+        if self.__in_sparse is not None:
+            in_sparse = self.__in_sparse
+        else:
+            coef_mat = np.array(self.in_coef_mat, dtype=float).reshape(-1, len(self.x))
+            rows, columns = np.nonzero(coef_mat)
+            in_sparse = (rows, columns, coef_mat[rows, columns], np.array(self.in_bias_mat, dtype=float).reshape(-1))
+
+        data = pack_property(self.x, self.y, in_sparse, self.in_bounds, self.out_coef_mat, self.out_bias_mat)
+
+        try:
+            path = self.get_cache_path()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            write_file_atomically(path, lambda f: np.save(f, data))
+
+        except OSError as e:
+            logger.debug(f'Cannot write the compiled property of {self.smtlib_path}: {e}')
+
+    def __get_commands(self) -> list:
+        """
+        This method reads the commands of the file in a single pass over its tokens,
+        the file is read only once.
+
+        Returns
+        ----------
+        list
+            The list of SMTLIB commands contained in the file, as nested lists of tokens.
+
+        """
+
+        if self.__commands is None:
+            with open_smt_file(self.smtlib_path) as f:
+                self.__commands = read_smt_commands(f.read())
+
+        return self.__commands
+
+    def __parse_commands(self):
+        """
+        This method fills the attributes directly from the commands of the file. The assertions
+        on the input vector must be conjunctions of linear constraints, while the assertions on
+        the output vector may contain disjunctions. The input matrices are only built when they
+        are accessed, since the box of local robustness properties is enough for most uses.
+
+        """
+
+        variables = {}
+        for name in self.x:
+            variables[name] = (0, smt_variable_index(name, self.x_name))
+        for name in self.y:
+            variables[name] = (1, smt_variable_index(name, self.y_name))
+
+        in_rows = []
+        out_disjuncts = [[]]
+
+        for command in self.__get_commands():
+            if len(command) == 0 or command[0] != 'assert':
+                continue
+            if len(command) != 2:
+                raise UnsupportedSmtSyntax('Malformed assertion')
+
+            disjuncts = smt_formula_to_dnf(command[1], variables)
+            vectors = set(variables[name][0] for conj in disjuncts for coefs, _ in conj for name in coefs)
+
+            # Assertions without variables are either trivially true or make the property empty
+            if vectors <= {0} and len(disjuncts) == 1:
+                in_rows.extend(disjuncts[0])
+            elif vectors == {1}:
+                out_disjuncts = [conj + new_conj for conj in out_disjuncts for new_conj in disjuncts]
+            else:
+                raise UnsupportedSmtSyntax('Assertion mixing input and output or disjunctive on the input')
+
+        out_coef_mat = []
+        out_bias_mat = []
+        for conj in out_disjuncts:
+            coef_mat, bias_mat = smt_rows_to_matrices(conj, variables, len(self.y))
+            out_coef_mat.append(coef_mat)
+            out_bias_mat.append(bias_mat)
+
+        self.in_bounds = smt_rows_to_box(in_rows, variables, len(self.x))
+        self.__in_sparse = smt_rows_to_sparse(in_rows, variables)
+        self.out_coef_mat = out_coef_mat
+        self.out_bias_mat = out_bias_mat
+
     def __as_script(self):
         """
-        This method makes use of pysmt for extracting the commands.
+        This method makes use of pysmt for extracting the commands, the file is parsed only once.
 
         Returns
         ----------
@@ -273,8 +501,12 @@ class SmtPropertyParser:
 
         """
 
-        parser = SmtLibParser()
-        return parser.get_script_fname(self.smtlib_path)
+        if self.__script is None:
+            parser = SmtLibParser()
+            with open_smt_file(self.smtlib_path) as f:
+                self.__script = parser.get_script(f)
+
+        return self.__script
 
     def __get_assert_commands_for(self, x: str) -> list:
         """
@@ -450,13 +682,18 @@ class SmtPropertyParser:
 
         """
 
-        script = self.__as_script()
-        declarations = script.filter_by_command_name(['declare-fun', 'declare-const'])
         vec_list = []
 
+        try:
+            declarations = [d[1] for d in self.__get_commands()
+                            if len(d) > 1 and d[0] in ('declare-fun', 'declare-const') and isinstance(d[1], str)]
+        except UnsupportedSmtSyntax:
+            script = self.__as_script()
+            declarations = [str(d.args[0]).replace('\'', '')  # args[0] contains the variable name, e.g., 'X_0'
+                            for d in script.filter_by_command_name(['declare-fun', 'declare-const'])]
+
         # Loop declarations and match with name
-        for d in declarations:
-            v = str(d.args[0]).replace('\'', '')  # args[0] contains the variable name, e.g., 'X_0'
+        for v in declarations:
             if vec_name in v:  # If vec_name == 'X' the variable is part of it
                 vec_list.append(v)
 
@@ -465,12 +702,43 @@ class SmtPropertyParser:
     def parse_property(self) -> (Tensor, Tensor, list, list):
         """
         This method exposes the propriety parsing, performing all the steps and
-        filling the Tensors.
+        filling the Tensors. The file is read in a single pass and pysmt is only
+        used for the constructs that the reader does not support.
 
         Returns
         ----------
-        NeVerProperty
-            The parsed property wrapped in the corresponding class
+        (Tensor, Tensor, list, list)
+            The input coefficient and bias matrices and the lists of the output ones, one for each disjunct
+
+        """
+
+        self.parse()
+
+        return self.in_coef_mat, self.in_bias_mat, self.out_coef_mat, self.out_bias_mat
+
+    def parse(self):
+        """
+        This method parses the SMTLIB file, filling the attributes. The file is read in a
+        single pass and pysmt is only used for the constructs that the reader does not support.
+        The compiled property is loaded from the cache if present, and written otherwise.
+
+        """
+
+        if self.__parsed:
+            return
+
+        try:
+            self.__parse_commands()
+        except UnsupportedSmtSyntax:
+            self.__parse_script()
+
+        self.__parsed = True
+        if self.cache_dir is not None:
+            self.__save_cache()
+
+    def __parse_script(self):
+        """
+        This method parses the property with pysmt, filling the Tensors.
 
         """
 
@@ -541,7 +809,644 @@ class SmtPropertyParser:
                     self.out_coef_mat.append(self.__get_coef_mat(self.y, self.y_name, [d]))
                     self.out_bias_mat.append(self.__get_bias_mat([d]))
 
-        return self.in_coef_mat, self.in_bias_mat, self.out_coef_mat, self.out_bias_mat
+
+def read_smt_commands(text: str) -> list:
+    """
+    Procedure to read the commands of a SMTLIB file in a single pass over its tokens.
+
+    Parameters
+    ----------
+    text: str
+        The content of the SMTLIB file.
+
+    Returns
+    ----------
+    list
+        The list of commands, each one as a list of tokens and nested lists for the sub-expressions.
+
+    """
+
+    stack = [[]]
+
+    for token in SMT_TOKEN.findall(SMT_COMMENT.sub('', text)):
+        if token == '(':
+            stack.append([])
+        elif token == ')':
+            if len(stack) == 1:
+                raise UnsupportedSmtSyntax('Unbalanced parentheses')
+            expr = stack.pop()
+            stack[-1].append(expr)
+        else:
+            stack[-1].append(token)
+
+    if len(stack) != 1:
+        raise UnsupportedSmtSyntax('Unbalanced parentheses')
+
+    return stack[0]
+
+
+def smt_linear_term(expr, variables: dict) -> (dict, float):
+    """
+    Procedure to read a linear term of the variables.
+
+    Parameters
+    ----------
+    expr: Any
+        The term as a token or a nested list of tokens.
+    variables: dict
+        The variables of interest.
+
+    Returns
+    ----------
+    (dict, float)
+        The coefficients of the variables and the constant of the term.
+
+    """
+
+    if isinstance(expr, str):
+        if expr in variables:
+            return {expr: 1.0}, 0.0
+        try:
+            return {}, float(expr)
+        except ValueError:
+            raise UnsupportedSmtSyntax(f'Unknown symbol {expr}')
+
+    if len(expr) < 2:
+        raise UnsupportedSmtSyntax('Malformed term')
+
+    op = expr[0]
+    terms = [smt_linear_term(arg, variables) for arg in expr[1:]]
+
+    if op == '+' or (op == '-' and len(terms) > 1):
+        coefs = dict(terms[0][0])
+        const = terms[0][1]
+        sign = 1.0 if op == '+' else -1.0
+        for term_coefs, term_const in terms[1:]:
+            for name, coef in term_coefs.items():
+                coefs[name] = coefs.get(name, 0.0) + sign * coef
+            const += sign * term_const
+        return coefs, const
+
+    elif op == '-':
+        return {name: -coef for name, coef in terms[0][0].items()}, -terms[0][1]
+
+    elif op == '*':
+        factor = 1.0
+        linear = None
+        for term in terms:
+            if len(term[0]) == 0:
+                factor *= term[1]
+            elif linear is None:
+                linear = term
+            else:
+                raise UnsupportedSmtSyntax('Non linear term')
+
+        if linear is None:
+            return {}, factor
+        return {name: factor * coef for name, coef in linear[0].items()}, factor * linear[1]
+
+    elif op == '/':
+        if len(terms) != 2 or len(terms[1][0]) > 0:
+            raise UnsupportedSmtSyntax('Non linear term')
+        return {name: coef / terms[1][1] for name, coef in terms[0][0].items()}, terms[0][1] / terms[1][1]
+
+    else:
+        raise UnsupportedSmtSyntax(f'Unsupported operator {op}')
+
+
+def smt_formula_to_dnf(expr, variables: dict) -> list:
+    """
+    Procedure to convert a formula of linear constraints in disjunctive normal form.
+
+    Parameters
+    ----------
+    expr: Any
+        The formula as a nested list of tokens.
+    variables: dict
+        The variables of interest.
+
+    Returns
+    ----------
+    list
+        The list of the disjuncts, each one as a list of constraints (coefficients, bias)
+        representing coefficients * variables <= bias.
+
+    """
+
+    if isinstance(expr, str) or len(expr) < 2:
+        raise UnsupportedSmtSyntax('Malformed formula')
+
+    op = expr[0]
+
+    if op == 'and':
+        disjuncts = [[]]
+        for arg in expr[1:]:
+            disjuncts = [conj + new_conj for conj in disjuncts for new_conj in smt_formula_to_dnf(arg, variables)]
+        return disjuncts
+
+    elif op == 'or':
+        return [conj for arg in expr[1:] for conj in smt_formula_to_dnf(arg, variables)]
+
+    elif op in ('<=', '<', '>=', '>', '='):
+        terms = [smt_linear_term(arg, variables) for arg in expr[1:]]
+        rows = []
+
+        # Chained comparisons hold pairwise, a <= b is written as a - b <= 0
+        for (lhs_coefs, lhs_const), (rhs_coefs, rhs_const) in zip(terms[:-1], terms[1:]):
+            coefs = dict(lhs_coefs)
+            for name, coef in rhs_coefs.items():
+                coefs[name] = coefs.get(name, 0.0) - coef
+            bias = rhs_const - lhs_const
+
+            # Constant constraints are dropped when they hold and kept as rows without coefficients otherwise
+            if len(coefs) == 0:
+                if not smt_constant_holds(op, bias):
+                    rows.append(({}, -1.0))
+                continue
+
+            if op in ('<=', '<', '='):
+                rows.append((coefs, bias))
+            if op in ('>=', '>', '='):
+                rows.append(({name: -coef for name, coef in coefs.items()}, -bias))
+
+        return [rows]
+
+    else:
+        raise UnsupportedSmtSyntax(f'Unsupported operator {op}')
+
+
+def smt_variable_index(name: str, vec_name: str) -> int:
+    """
+    Procedure to read the index of a component of a vector from its name, e.g., 3 for X_3.
+
+    Parameters
+    ----------
+    name: str
+        The name of the variable.
+    vec_name: str
+        The name of the vector.
+
+    Returns
+    ----------
+    int
+        The index of the component.
+
+    """
+
+    match = re.fullmatch(re.escape(vec_name) + r'_(\d+)', name)
+    if match is None:
+        raise UnsupportedSmtSyntax(f'Unsupported variable name {name}')
+
+    return int(match.group(1))
+
+
+def smt_constant_holds(op: str, bias: float) -> bool:
+    """
+    Procedure to evaluate a comparison without variables, written as 0 op bias.
+
+    Parameters
+    ----------
+    op: str
+        The comparison operator.
+    bias: float
+        The difference between the right and the left hand side.
+
+    Returns
+    ----------
+    bool
+        True if the comparison holds, False otherwise.
+
+    """
+
+    if op == '<=':
+        return bias >= 0
+    elif op == '<':
+        return bias > 0
+    elif op == '>=':
+        return bias <= 0
+    elif op == '>':
+        return bias < 0
+    else:
+        return bias == 0
+
+
+def smt_rows_to_matrices(rows: list, variables: dict, n_var: int) -> (Tensor, Tensor):
+    """
+    Procedure to build the coefficient and bias matrices of a conjunction of constraints.
+
+    Parameters
+    ----------
+    rows: list
+        The list of constraints (coefficients, bias).
+    variables: dict
+        The variables of interest, with the vector and the index of each one.
+    n_var: int
+        The number of components of the vector.
+
+    Returns
+    ----------
+    (Tensor, Tensor)
+        The coefficient and bias matrices.
+
+    """
+
+    coef_mat = np.zeros((len(rows), n_var))
+    bias_mat = np.zeros((len(rows), 1))
+
+    for i, (coefs, bias) in enumerate(rows):
+        for name, coef in coefs.items():
+            coef_mat[i, variables[name][1]] += coef
+        bias_mat[i, 0] = bias
+
+    return coef_mat, bias_mat
+
+
+def pack_property(x: list, y: list, in_sparse: tuple, in_bounds: Optional[HyperRectangleBounds],
+                  out_coef_mat: list, out_bias_mat: list) -> Tensor:
+    """
+    Procedure to pack a parsed property in a single array, which is read back by
+    unpack_property. The array starts with the sizes of the sections that follow:
+    the names of the variables, the sparse input constraints, the input box and
+    the output constraints of each disjunct.
+
+    Parameters
+    ----------
+    x: list
+        The names of the input variables.
+    y: list
+        The names of the output variables.
+    in_sparse: tuple
+        The sparse input constraints (rows, columns, values, bias).
+    in_bounds: Optional[HyperRectangleBounds]
+        The input box, if any.
+    out_coef_mat: list
+        The coefficient matrices of the output disjuncts.
+    out_bias_mat: list
+        The bias matrices of the output disjuncts.
+
+    Returns
+    ----------
+    Tensor
+        The packed property.
+
+    """
+
+    rows, columns, values, bias = in_sparse
+    names = np.frombuffer('\n'.join(x + y).encode('utf-32-le'), dtype=np.uint32)
+    out_rows = [np.shape(coef_mat)[0] for coef_mat in out_coef_mat]
+
+    header = [len(x), len(y), names.shape[0], values.shape[0], bias.shape[0], in_bounds is not None, len(out_rows)]
+    sections = [np.array(header + out_rows, dtype=float), names, rows, columns, values, bias]
+    if in_bounds is not None:
+        sections.extend([in_bounds.get_lower(), in_bounds.get_upper()])
+    sections.extend(np.reshape(coef_mat, -1) for coef_mat in out_coef_mat)
+    sections.extend(np.reshape(bias_mat, -1) for bias_mat in out_bias_mat)
+
+    return np.concatenate([np.asarray(section, dtype=float).reshape(-1) for section in sections])
+
+
+def unpack_property(data: Tensor) -> (list, list, tuple, Optional[HyperRectangleBounds], list, list):
+    """
+    Procedure to read a property packed by pack_property.
+
+    Parameters
+    ----------
+    data: Tensor
+        The packed property.
+
+    Returns
+    ----------
+    (list, list, tuple, Optional[HyperRectangleBounds], list, list)
+        The names of the input and output variables, the sparse input constraints,
+        the input box and the output coefficient and bias matrices.
+
+    """
+
+    n_x, n_y, n_chars, n_values, n_rows, has_box, n_disjuncts = (int(v) for v in data[:7])
+    out_rows = [int(v) for v in data[7:7 + n_disjuncts]]
+    cursor = 7 + n_disjuncts
+
+    def take(size: int) -> Tensor:
+        nonlocal cursor
+        if cursor + size > data.shape[0]:
+            raise ValueError('Truncated property')
+        section = data[cursor:cursor + size]
+        cursor += size
+        return section
+
+    names = take(n_chars).astype(np.uint32).tobytes().decode('utf-32-le').split('\n') if n_chars > 0 else []
+    in_sparse = (take(n_values).astype(int), take(n_values).astype(int), take(n_values), take(n_rows))
+    in_bounds = HyperRectangleBounds(take(n_x), take(n_x)) if has_box else None
+    out_coef_mat = [take(rows * n_y).reshape(rows, n_y) for rows in out_rows]
+    out_bias_mat = [take(rows).reshape(rows, 1) for rows in out_rows]
+
+    if cursor != data.shape[0] or len(names) != n_x + n_y:
+        raise ValueError('Malformed property')
+
+    return names[:n_x], names[n_x:], in_sparse, in_bounds, out_coef_mat, out_bias_mat
+
+
+def smt_rows_to_sparse(rows: list, variables: dict) -> (Tensor, Tensor, Tensor, Tensor):
+    """
+    Procedure to build the sparse representation of a conjunction of constraints.
+
+    Parameters
+    ----------
+    rows: list
+        The list of constraints (coefficients, bias).
+    variables: dict
+        The variables of interest, with the vector and the index of each one.
+
+    Returns
+    ----------
+    (Tensor, Tensor, Tensor, Tensor)
+        The row and column indexes and the values of the coefficients, and the bias vector.
+
+    """
+
+    row_indexes = []
+    column_indexes = []
+    values = []
+
+    for i, (coefs, _) in enumerate(rows):
+        for name, coef in coefs.items():
+            row_indexes.append(i)
+            column_indexes.append(variables[name][1])
+            values.append(coef)
+
+    return (np.array(row_indexes, dtype=int), np.array(column_indexes, dtype=int), np.array(values, dtype=float),
+            np.array([bias for _, bias in rows], dtype=float))
+
+
+def smt_rows_to_box(rows: list, variables: dict, n_var: int) -> Optional[HyperRectangleBounds]:
+    """
+    Procedure to recognise a conjunction of bounds of single variables.
+
+    Parameters
+    ----------
+    rows: list
+        The list of constraints (coefficients, bias).
+    variables: dict
+        The variables of interest, with the vector and the index of each one.
+    n_var: int
+        The number of components of the vector.
+
+    Returns
+    ----------
+    Optional[HyperRectangleBounds]
+        The box defined by the constraints, None if some constraint involves more than one
+        variable or if some variable is not bounded from both sides.
+
+    """
+
+    lower = np.full(n_var, -np.inf)
+    upper = np.full(n_var, np.inf)
+
+    for coefs, bias in rows:
+        if len(coefs) != 1:
+            return None
+
+        name, coef = next(iter(coefs.items()))
+        idx = variables[name][1]
+        if coef > 0:
+            upper[idx] = min(upper[idx], bias / coef)
+        elif coef < 0:
+            lower[idx] = max(lower[idx], bias / coef)
+        else:
+            return None
+
+    if not np.all(np.isfinite(lower)) or not np.all(np.isfinite(upper)):
+        return None
+
+    return HyperRectangleBounds(lower, upper)
+
+
+def open_smt_file(path: str, mode: str = 'r'):
+    """
+    Procedure to open a SMTLIB file as text, the files ending with '.gz' are compressed with gzip.
+
+    Parameters
+    ----------
+    path: str
+        The path of the file.
+    mode: str, Optional
+        The mode of the file, 'r' or 'w' (default: 'r').
+
+    Returns
+    ----------
+    IO
+        The text stream of the file.
+
+    """
+
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', compresslevel=6)
+
+    return open(path, mode)
+
+
+def format_smt_numbers(values: Tensor) -> list:
+    """
+    Procedure to format a vector of numbers as SMTLIB constants. The numbers are written
+    with the shortest representation that reads back to the same float, the exponential
+    notation is replaced by the positional one.
+
+    Parameters
+    ----------
+    values: Tensor
+        The numbers to format.
+
+    Returns
+    ----------
+    list
+        The list of strings of the numbers.
+
+    """
+
+    values = np.asarray(values, dtype=float).reshape(-1)
+    if not np.all(np.isfinite(values)):
+        raise Exception('Only finite numbers can be written in a SMTLIB file')
+
+    strings = list(map(repr, values.tolist()))
+
+    # repr uses the exponential notation for small and large magnitudes only
+    magnitudes = np.abs(values)
+    for i in np.flatnonzero((magnitudes != 0) & ((magnitudes < 1e-4) | (magnitudes >= 1e16))):
+        strings[i] = np.format_float_positional(values[i], trim='0')
+
+    return strings
+
+
+@functools.lru_cache(maxsize=32)
+def smt_declarations(name: str, n_var: int) -> str:
+    """
+    Procedure to write the declarations of the components of a vector.
+
+    Parameters
+    ----------
+    name: str
+        The name of the vector.
+    n_var: int
+        The number of components of the vector.
+
+    Returns
+    ----------
+    str
+        The declarations, one for each line.
+
+    """
+
+    return ''.join([f'(declare-const {name}_{i} Real)\n' for i in range(n_var)])
+
+
+@functools.lru_cache(maxsize=32)
+def smt_box_template(name: str, n_var: int) -> str:
+    """
+    Procedure to build the template of the assertions on the bounds of a vector, with
+    a field for the lower and for the upper bound of each component in turn.
+
+    Parameters
+    ----------
+    name: str
+        The name of the vector.
+    n_var: int
+        The number of components of the vector.
+
+    Returns
+    ----------
+    str
+        The template of the assertions.
+
+    """
+
+    return ''.join([f'(assert (>= {name}_{i} {{}}))\n(assert (<= {name}_{i} {{}}))\n' for i in range(n_var)])
+
+
+def smt_box_assertions(name: str, lower: Tensor, upper: Tensor) -> str:
+    """
+    Procedure to write the assertions on the bounds of the components of a vector.
+
+    Parameters
+    ----------
+    name: str
+        The name of the vector.
+    lower: Tensor
+        The lower bounds of the components.
+    upper: Tensor
+        The upper bounds of the components.
+
+    Returns
+    ----------
+    str
+        The assertions, one for each line.
+
+    """
+
+    lower = format_smt_numbers(lower)
+    upper = format_smt_numbers(upper)
+    if len(lower) != len(upper):
+        raise Exception('The lower and upper bounds must have the same size')
+
+    bounds = [None] * (2 * len(lower))
+    bounds[0::2] = lower
+    bounds[1::2] = upper
+
+    return smt_box_template(name, len(lower)).format(*bounds)
+
+
+def smt_linear_constraints(name: str, coef_mat: Tensor, bias_mat: Tensor) -> list:
+    """
+    Procedure to write the rows of the linear constraints coef_mat * x <= bias_mat as SMTLIB
+    constraints. The rows with a single unit coefficient are written as bounds of the component.
+
+    Parameters
+    ----------
+    name: str
+        The name of the vector.
+    coef_mat: Tensor
+        The matrix of the coefficients.
+    bias_mat: Tensor
+        The column vector of the biases.
+
+    Returns
+    ----------
+    list
+        The constraints, one for each row.
+
+    """
+
+    coef_mat = np.asarray(coef_mat, dtype=float)
+    bias = np.asarray(bias_mat, dtype=float).reshape(-1)
+    bias_strings = format_smt_numbers(bias)
+    neg_bias_strings = format_smt_numbers(-bias)
+
+    rows, columns = np.nonzero(coef_mat)
+    coef_strings = format_smt_numbers(coef_mat[rows, columns])
+    row_starts = np.searchsorted(rows, np.arange(coef_mat.shape[0] + 1))
+
+    constraints = []
+    for i in range(coef_mat.shape[0]):
+        start, end = row_starts[i], row_starts[i + 1]
+
+        if end - start == 0:
+            constraints.append(f'(<= 0.0 {bias_strings[i]})')
+        elif end - start == 1 and abs(coef_mat[i, columns[start]]) == 1:
+            if coef_mat[i, columns[start]] > 0:
+                constraints.append(f'(<= {name}_{columns[start]} {bias_strings[i]})')
+            else:
+                constraints.append(f'(>= {name}_{columns[start]} {neg_bias_strings[i]})')
+        else:
+            terms = ' '.join([f'(* {coef_strings[k]} {name}_{columns[k]})' for k in range(start, end)])
+            if end - start > 1:
+                terms = f'(+ {terms})'
+            constraints.append(f'(<= {terms} {bias_strings[i]})')
+
+    return constraints
+
+
+def smt_assertions(constraints: list) -> str:
+    """
+    Procedure to write the assertions of a conjunction of constraints.
+
+    Parameters
+    ----------
+    constraints: list
+        The constraints to assert.
+
+    Returns
+    ----------
+    str
+        The assertions, one for each line.
+
+    """
+
+    return ''.join([f'(assert {c})\n' for c in constraints])
+
+
+def smt_disjunction(disjuncts: list) -> str:
+    """
+    Procedure to write the assertion of a disjunction of conjunctions of constraints.
+
+    Parameters
+    ----------
+    disjuncts: list
+        The list of the conjunctions, each one a list of constraints.
+
+    Returns
+    ----------
+    str
+        The assertion of the disjunction.
+
+    """
+
+    terms = []
+    for conj in disjuncts:
+        if len(conj) == 1:
+            terms.append(f'    {conj[0]}')
+        else:
+            terms.append('    (and ' + ' '.join(conj) + ')')
+
+    return '(assert (or\n' + '\n'.join(terms) + '\n))\n'
 
 
 def is_operator(c: str):
@@ -1,27 +1,41 @@
+import os
+import time
+import uuid
+from typing import Callable
+
+import numpy as np
 import pandas as pd
 
 
-def return_df_dict(stars_dict: dict):
+def return_df_dict(stars_dict: dict, bounds_dict: dict = None, deadline: float = None):
     data_dict = dict()
     keys = list(stars_dict.keys())
 
+    if bounds_dict is None:
+        bounds_dict = dict()
+
     for key, layer in stars_dict.items():
         if keys[-1] != key:
             lower_label = f"{key}_lower"
             upper_label = f"{key}_upper"
 
-            lower, upper = get_lower_upper(layer.stars)
+            lower, upper = get_lower_upper(layer.stars, bounds_dict.get(key), deadline)
             data_dict[lower_label] = pd.Series(lower)
             data_dict[upper_label] = pd.Series(upper)
 
     df = pd.DataFrame(data_dict)
     return df
 
-def get_lower_upper(stars):
+def get_lower_upper(stars, bounds=None, deadline: float = None):
     lower_list_of_lists = list()
     upper_list_of_lists = list()
 
     for star in stars:
+        # Once the deadline has passed the symbolic bounds of the layer, which hold for every star, are used
+        if deadline is not None and bounds is not None and time.time() >= deadline:
+            return list(np.asarray(bounds.get_lower(), dtype=float).reshape(-1)), \
+                list(np.asarray(bounds.get_upper(), dtype=float).reshape(-1))
+
         lower = list()
         upper = list()
         for i in range(star.center.shape[0]):
@@ -35,3 +49,36 @@ def get_lower_upper(stars):
     absolute_upper_bounds = [max(x) for x in zip(*upper_list_of_lists)]
 
     return absolute_lower_bounds, absolute_upper_bounds
+
+
+def write_file_atomically(path: str, write: Callable, mode: int = 0o644):
+    """
+    Procedure to write a file that is moved in place once complete, so that concurrent readers never see
+    a partial file. The temporary file is created in the same folder with the given mode, to which the
+    kernel applies the current umask of the process.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file to write.
+    write : Callable
+        Function writing the content to the binary file object it receives.
+    mode : int, Optional
+        Permissions of the new file before the umask (default: 0o644).
+
+    """
+
+    tmp_path = os.path.join(os.path.dirname(path), f'.{os.path.basename(path)}.{uuid.uuid4().hex}.tmp')
+    fd = os.open(tmp_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, 'O_BINARY', 0), mode)
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
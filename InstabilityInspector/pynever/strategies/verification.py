@@ -1,9 +1,12 @@
 import abc
-import copy
+import heapq
+import itertools
 import logging
+import math
+import multiprocessing
 import operator
+import queue
 import time
-from fractions import Fraction
 from typing import List, Optional, Callable
 
 import numpy as np
@@ -18,7 +21,8 @@ import InstabilityInspector.pynever.strategies.conversion as conv
 import InstabilityInspector.pynever.strategies.search as sf
 import InstabilityInspector.pynever.strategies.smt_reading as reading
 import InstabilityInspector.pynever.utilities as utils
-from InstabilityInspector.pynever.strategies.bp.bounds import AbstractBounds
+from InstabilityInspector.pynever.strategies.bp.bounds import AbstractBounds, HyperRectangleBounds
+from InstabilityInspector.pynever.strategies.bp.utils.property_converter import box_to_constraints
 from InstabilityInspector.pynever.tensors import Tensor
 from InstabilityInspector.pynever.strategies.utils import return_df_dict
 
@@ -71,7 +75,7 @@ class NeVerProperty(Property):
     """
     A concrete class used to represent a NeVer property for a NeuralNetwork. We assume that the hyperplane
     out_coef_mat * y <= out_bias_mat represent the unsafe region (i.e., the negation of the desired property).
-    At present the input set must be defined as in_coef_mat * x <= in_bias_mat
+    At present the input set must be defined as in_coef_mat * x <= in_bias_mat, or as a box
 
     Attributes
     ----------
@@ -83,17 +87,52 @@ class NeVerProperty(Property):
         Matrixes of the coefficients for the output constraints.
     out_bias_mat: List[Tensor]
         Matrixes of the biases for the output constraints.
+    in_bounds: HyperRectangleBounds, Optional
+        The input box, if the input set is a box. When it is given the input matrices
+        may be omitted and are only built if they are accessed.
 
     """
 
     def __init__(self, in_coef_mat: Tensor = None, in_bias_mat: Tensor = None,
-                 out_coef_mat: List[Tensor] = None, out_bias_mat: List[Tensor] = None):
+                 out_coef_mat: List[Tensor] = None, out_bias_mat: List[Tensor] = None,
+                 in_bounds: HyperRectangleBounds = None):
         self.in_coef_mat = in_coef_mat
         self.in_bias_mat = in_bias_mat
         self.out_coef_mat = out_coef_mat
         self.out_bias_mat = out_bias_mat
+        self.in_bounds = in_bounds
 
-    def from_smt_file(self, filepath: str = '', input_name: str = 'X', output_name: str = 'Y'):
+    @property
+    def in_coef_mat(self) -> Tensor:
+        if self.__in_coef_mat is None and self.in_bounds is not None:
+            self.__build_input_matrices()
+        return self.__in_coef_mat
+
+    @in_coef_mat.setter
+    def in_coef_mat(self, value: Tensor):
+        self.__in_coef_mat = value
+
+    @property
+    def in_bias_mat(self) -> Tensor:
+        if self.__in_bias_mat is None and self.in_bounds is not None:
+            self.__build_input_matrices()
+        return self.__in_bias_mat
+
+    @in_bias_mat.setter
+    def in_bias_mat(self, value: Tensor):
+        self.__in_bias_mat = value
+
+    def __build_input_matrices(self):
+        """
+        This method builds the input matrices from the input box
+
+        """
+
+        self.__in_coef_mat, self.__in_bias_mat = box_to_constraints(self.in_bounds.get_lower(),
+                                                                    self.in_bounds.get_upper())
+
+    def from_smt_file(self, filepath: str = '', input_name: str = 'X', output_name: str = 'Y',
+                      cache_dir: Optional[str] = None):
         """
         This method builds the property by reading the corresponding SMT-LIB file
 
@@ -105,11 +144,21 @@ class NeVerProperty(Property):
             The name of the input vector
         output_name : str, Optional
             The name of the output vector
+        cache_dir : str, Optional
+            Folder of the compiled properties, see SmtPropertyParser (default: None, no cache)
 
         """
 
-        smt_parser = reading.SmtPropertyParser(filepath, input_name, output_name)
-        self.in_coef_mat, self.in_bias_mat, self.out_coef_mat, self.out_bias_mat = smt_parser.parse_property()
+        smt_parser = reading.SmtPropertyParser(filepath, input_name, output_name, cache_dir)
+        smt_parser.parse()
+
+        # The matrices of a box are built only if they are needed
+        self.in_bounds = smt_parser.in_bounds
+        if self.in_bounds is None:
+            self.in_coef_mat, self.in_bias_mat = smt_parser.in_coef_mat, smt_parser.in_bias_mat
+        else:
+            self.in_coef_mat, self.in_bias_mat = None, None
+        self.out_coef_mat, self.out_bias_mat = smt_parser.out_coef_mat, smt_parser.out_bias_mat
 
     def to_smt_file(self, input_id: str = 'X', output_id: str = 'Y', filepath: str = ''):
         """
@@ -127,56 +176,67 @@ class NeVerProperty(Property):
 
         """
 
-        with open(filepath, 'w+') as f:
-            # Variables definition
-            input_vars = [f"{input_id}_{i}" for i in range(self.in_coef_mat.shape[1])]
-            if self.out_coef_mat:
-                output_vars = [f"{output_id}_{i}" for i in range(self.out_coef_mat[0].shape[1])]
-            else:
-                output_vars = []
+        # The file is formatted in a single buffer and written at once
+        if self.in_bounds is not None:
+            n_inputs = self.in_bounds.get_size()
+            in_assertions = reading.smt_box_assertions(input_id, self.in_bounds.get_lower(),
+                                                       self.in_bounds.get_upper())
+        else:
+            n_inputs = self.in_coef_mat.shape[1]
+            in_assertions = reading.smt_assertions(reading.smt_linear_constraints(input_id, self.in_coef_mat,
+                                                                                  self.in_bias_mat))
 
-            f.write(';; --- INPUT VARIABLES ---\n')
-            for v_name in input_vars:
-                f.write(f"(declare-const {v_name} Real)\n")
+        n_outputs = self.out_coef_mat[0].shape[1] if self.out_coef_mat else 0
+        out_constraints = [reading.smt_linear_constraints(output_id, out_mat, out_bias)
+                           for out_mat, out_bias in zip(self.out_coef_mat, self.out_bias_mat)]
 
-            f.write('\n;; --- OUTPUT VARIABLES ---\n')
-            for v_name in output_vars:
-                f.write(f"(declare-const {v_name} Real)\n")
+        text = [';; --- INPUT VARIABLES ---\n', reading.smt_declarations(input_id, n_inputs),
+                '\n;; --- OUTPUT VARIABLES ---\n', reading.smt_declarations(output_id, n_outputs),
+                '\n;; --- INPUT CONSTRAINTS ---\n', in_assertions,
+                '\n;; --- OUTPUT CONSTRAINTS ---\n']
 
-            # Constraints definition
-            f.write('\n;; --- INPUT CONSTRAINTS ---\n')
+        # Allow multiple output properties
+        if len(out_constraints) == 1:
+            text.append(reading.smt_assertions(out_constraints[0]))
+        elif len(out_constraints) > 1:
+            text.append(reading.smt_disjunction(out_constraints))
 
-            infix_in_constraints = self.__create_infix_constraints(input_vars, self.in_coef_mat, self.in_bias_mat)
-            for c in infix_in_constraints:
-                prefix_smt_row = reading.ExpressionTreeConverter().build_from_infix(c).as_prefix()
-                f.write(f"(assert {prefix_smt_row})\n")
+        with reading.open_smt_file(filepath, 'w') as f:
+            f.write(''.join(text))
 
-            f.write('\n;; --- OUTPUT CONSTRAINTS ---\n')
+    def negated_post_condition(self) -> 'NeVerProperty':
+        """
+        This method builds the property with the same input set and the negation of the output
+        constraints, in order to represent both safety and unsafety properties. The negation
+        of the disjunction of the conjunctions is built in disjunctive normal form, the
+        boundaries of the regions are kept since the constraints are not strict
 
-            # Allow multiple output properties
-            infix_output_properties = []
-            for out_mat, out_bias in zip(self.out_coef_mat, self.out_bias_mat):
-                infix_constraints = self.__create_infix_constraints(output_vars, out_mat, out_bias)
-                infix_output_properties.append(infix_constraints)
+        Returns
+        ----------
+        NeVerProperty
+            The property with the negated post-condition
 
-            if len(infix_output_properties) == 1:
-                for c in infix_output_properties[0]:
-                    prefix_smt_row = reading.ExpressionTreeConverter().build_from_infix(c).as_prefix()
-                    f.write(f"(assert {prefix_smt_row})\n")
-            else:
-                s = '(assert (or '
-                for p in infix_output_properties:
-                    if len(p) == 1:
-                        prefix_smt_row = reading.ExpressionTreeConverter().build_from_infix(p[0]).as_prefix()
-                        s = s + '\n' + prefix_smt_row
-                    else:
-                        s = s + '(and '
-                        for c in p:
-                            prefix_smt_row = reading.ExpressionTreeConverter().build_from_infix(c).as_prefix()
-                            s = s + '\n' + prefix_smt_row
-                        s = s + ')\n'
-                s = s + '))'
-                f.write(s)
+        """
+
+        if not self.out_coef_mat:
+            raise Exception("The property has no output constraints to negate")
+
+        # Each conjunction is negated as the disjunction of its negated rows
+        negated_rows = []
+        for out_mat, out_bias in zip(self.out_coef_mat, self.out_bias_mat):
+            out_mat = np.asarray(out_mat, dtype=float)
+            out_bias = np.asarray(out_bias, dtype=float).reshape(-1, 1)
+            negated_rows.append([(0.0 - out_mat[i:i + 1], 0.0 - out_bias[i:i + 1])
+                                 for i in range(out_mat.shape[0])])
+
+        # The conjunction of the negations is distributed over the disjunctions
+        out_coef_mat = []
+        out_bias_mat = []
+        for rows in itertools.product(*negated_rows):
+            out_coef_mat.append(np.vstack([row[0] for row in rows]))
+            out_bias_mat.append(np.vstack([row[1] for row in rows]))
+
+        return NeVerProperty(self.__in_coef_mat, self.__in_bias_mat, out_coef_mat, out_bias_mat, self.in_bounds)
 
     def to_input_star(self) -> abst.Star:
         """
@@ -191,32 +251,6 @@ class NeVerProperty(Property):
 
         return abst.Star(self.in_coef_mat, self.in_bias_mat)
 
-    @staticmethod
-    def __create_infix_constraints(variables: list, coef_mat: Tensor, bias_mat: Tensor) -> list:
-        c_list = []
-
-        for row in range(coef_mat.shape[0]):
-            coef = coef_mat[row, :]
-            bias = bias_mat[row][0]
-            s = '('
-
-            # Assign coefficients
-            for k in range(len(coef)):
-                c = coef[k]
-                if c != 0:
-                    s = s + f"({float(c)} * {variables[k]})"
-                    if k < len(coef) - 1 and any(coef[k + 1:]):
-                        s = s + ' + '
-
-            # Add bias preventing exponential representation
-            bias_repr = float(bias)
-            if 'e' in str(bias_repr):
-                bias_repr = Fraction(bias)
-            s = s + f") <= ({bias_repr})"
-            c_list.append(s)
-
-        return c_list
-
 
 class VerificationStrategy(abc.ABC):
     """
@@ -262,7 +296,22 @@ class SearchVerification(VerificationStrategy):
     Attributes
     ----------
     search_params : dict
-        The parameters to guide the search algorithm
+        The parameters to guide the search algorithm:
+        - heuristic: the choice of the neuron to split (sequential)
+        - bounds: the bound propagation algorithm (symbolic)
+        - timeout: the time limit of the search in seconds
+        - frontier: the order in which the stars of the frontier are processed (dfs, depth, violation, volume),
+          see search.get_frontier_score
+        - max_nodes: the optional maximum number of stars to process
+        - processes: the number of worker processes; with more than one process the master keeps the frontier and
+          the workers process the stars it hands out, and the search stops globally as soon as a counterexample is
+          found, the frontier drains or the timeout expires
+        - cache_size: the memory in bytes of the cache of the Fully Connected products shared by the stars of the
+          search (per worker process), 0 to disable it, see search.PropagationCache
+
+    stats : dict
+        Statistics of the last search: the number of processed stars, the time spent on each of them and, in the
+        single process search, the hits and misses of the cache.
 
     Methods
     ----------
@@ -272,15 +321,20 @@ class SearchVerification(VerificationStrategy):
     """
 
     def __init__(self, search_params: dict = None):
+        self.search_params = {
+            'heuristic': 'sequential',
+            'bounds': 'symbolic',
+            'timeout': 300,
+            'frontier': 'dfs',
+            'max_nodes': None,
+            'processes': 1,
+            'cache_size': 2 ** 28
+        }
+
         if search_params is not None:
-            self.search_params = search_params
-        else:
-            self.search_params = {
-                'heuristic': 'sequential',
-                'bounds': 'symbolic',
-                'timeout': 300
-            }
+            self.search_params.update(search_params)
 
+        self.stats = {}
         self.logger = logging.getLogger(logger_name)
 
     def init_search(self, network: networks.SequentialNetwork, prop: NeVerProperty):
@@ -325,52 +379,99 @@ class SearchVerification(VerificationStrategy):
         """
 
         if isinstance(network, networks.SequentialNetwork) and isinstance(prop, NeVerProperty):
+            network = utils.optimize_network(network)
             in_star, nn_bounds, net_list = self.init_search(network, prop)
-            nn_bounds = nn_bounds[1]  # TODO use symbolic
         else:
             raise NotImplementedError('Only SequentialNetwork and NeVerProperty objects are supported at present')
 
-        # Frontier is a stack of tuples (Star, AbstractBounds)
-        frontier = [(in_star, nn_bounds)]
-        stop_flag = False
+        # The frontier is a priority queue of tuples (score, tie, depth, Star, AbstractBounds): ties are broken
+        # in favour of the last star added, so that equal scores give a depth-first search
+        heuristic = self.search_params['heuristic']
+        strategy = self.search_params['frontier']
+        max_nodes = self.search_params['max_nodes']
+        processes = self.search_params['processes']
+        cache_size = self.search_params['cache_size']
+        counter = itertools.count()
+
+        frontier = [(0.0, -next(counter), 0, in_star, nn_bounds)]
+        node_times = []
+        self.stats = {'nodes': 0, 'node_times': node_times}
+
+        # The results are taken in order of completion, so that a slow star does not keep the other workers idle
+        done = queue.Queue()
+        n_pending = 0
+
+        pool = None
+        cache = None
+        if processes > 1:
+            pool = multiprocessing.Pool(processes, initializer=sf.init_search_worker,
+                                        initargs=(net_list, prop, heuristic, strategy, cache_size))
+        elif cache_size > 0:
+            cache = sf.PropagationCache(cache_size)
 
-        # Start timer
-        timer = 0
         start_time = time.perf_counter()
+        stop_flag = False
 
-        while len(frontier) > 0 and not stop_flag:
-            current_star, nn_bounds = frontier.pop()
-
-            # TODO use stars or symb bounds
-            intersects, unsafe_stars = sf.intersect_star_lp(current_star, net_list, nn_bounds, prop)
-
-            if intersects:
-                # If new target is None there is no more refinement to do
-                target, current_star = sf.get_next_target(self.search_params['heuristic'], current_star, net_list)
-
-                if target is None:
-                    # Nothing else to split, or
-                    # Found a counterexample
-                    cex = sf.get_counterexample(unsafe_stars, prop)
-                    return False, cex
-
-                else:
-                    # We cannot conclude anything at this point.
-                    # Split the current branch according to the target
-                    frontier.extend(
-                        sf.split_star(current_star, target, net_list, nn_bounds)
-                    )
-
-            else:
-                """This branch is safe, no refinement needed"""
-
-            timer += (time.perf_counter() - start_time)
-            if timer > self.search_params['timeout']:
-                stop_flag = True
-            else:
-                start_time = time.perf_counter()
-
-        if stop_flag:
+        try:
+            while (len(frontier) > 0 or n_pending > 0) and not stop_flag:
+
+                # The stars with the best scores are handed out to the idle workers
+                while len(frontier) > 0 and n_pending < max(processes, 1) and \
+                        (max_nodes is None or len(node_times) + n_pending < max_nodes):
+                    _, _, depth, current_star, nn_bounds = heapq.heappop(frontier)
+                    if pool is None:
+                        node_start = time.perf_counter()
+                        status, payload = sf.process_star(current_star, nn_bounds, depth, net_list, prop, heuristic,
+                                                          strategy, cache)
+                        done.put((status, payload, time.perf_counter() - node_start))
+                    else:
+                        pool.apply_async(sf.process_star_worker, (current_star, nn_bounds, depth),
+                                         callback=done.put, error_callback=done.put)
+                    n_pending += 1
+
+                if n_pending == 0:
+                    # The node budget is exhausted
+                    stop_flag = True
+                    break
+
+                # The workers are waited for until the timeout, then the pool is terminated
+                remaining = self.search_params['timeout'] - (time.perf_counter() - start_time)
+                try:
+                    result = done.get(timeout=max(remaining, 0))
+                except queue.Empty:
+                    stop_flag = True
+                    break
+                n_pending -= 1
+
+                if isinstance(result, BaseException):
+                    raise result
+                status, payload, node_time = result
+                node_times.append(node_time)
+                self.stats['nodes'] = len(node_times)
+                if cache is not None:
+                    self.stats['cache_hits'] = cache.hits
+                    self.stats['cache_misses'] = cache.misses
+
+                if status == 'counterexample':
+                    self.logger.info(f"Processed {len(node_times)} stars in {sum(node_times)}s.")
+                    return False, payload
+
+                elif status == 'split':
+                    # We cannot conclude anything at this point: the new stars are added to the frontier
+                    for score, depth, new_star, new_bounds in payload:
+                        heapq.heappush(frontier, (score, -next(counter), depth, new_star, new_bounds))
+
+                if time.perf_counter() - start_time > self.search_params['timeout']:
+                    stop_flag = True
+
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+        self.logger.info(f"Processed {len(node_times)} stars in {sum(node_times)}s.")
+
+        if stop_flag or len(frontier) > 0:
             return False,
         else:
             return True,
@@ -401,24 +502,78 @@ class NeverVerification(VerificationStrategy):
     refinement_level : int
         Refinement level for the sigmoid abstraction.
 
+    processes : int
+        Number of worker processes used to propagate the stars (default: the number of CPUs).
+
+    lp_budget : int
+        Maximum number of neurons per star whose symbolic bounds are tightened with LPs to choose the neurons to
+        refine (default: no limit). No LP is solved when all the unstable neurons are refined.
+
+    time_limit : float
+        Optional wall-clock budget (in seconds) of a verification. Once it is exceeded no more neurons are refined,
+        and the symbolic bounds are used instead of the LP ones (also by return_df_dict).
+
+    max_stars : int
+        Optional maximum number of stars of a layer: the number of neurons refined in each ReLU layer is capped so
+        that the stars cannot exceed it, and the layers reached with more stars are over-approximated.
+
+    max_memory : int
+        Optional maximum memory (in bytes) of the stars of a layer, enforced as max_stars using the memory
+        of the current stars to estimate the one of the next ones.
+
+    optimize : bool
+        If True the network is simplified with utilities.optimize_network before the propagation of the stars
+        (default: False). The layers of stars_dict are then the ones of the simplified network, so it should be
+        enabled only when the verdict is needed.
+
+    partial : bool
+        True if a budget reduced the refinement requested by the heuristic during the last verification, in which
+        case a non-verified property may be a false alarm.
+
     Methods
     ----------
     verify(NeuralNetwork, Property)
         Verify that the neural network of interest satisfy the property given as argument.
 
+    The worker processes are started once and shared by all the layers of a verification. Using the strategy as a
+    context manager keeps them alive across several calls of verify:
+
+        with NeverVerification("best_n_neurons", params) as verifier:
+            for prop in properties:
+                verifier.verify(network, prop)
+
     """
 
     def __init__(self, heuristic: str = "best_n_neurons", params: List = None,
-                 refinement_level: int = None):
+                 refinement_level: int = None, processes: int = None, lp_budget: int = None,
+                 time_limit: float = None, max_stars: int = None, max_memory: int = None, optimize: bool = False):
 
         self.heuristic = heuristic
         self.params = params
         self.refinement_level = refinement_level
+        self.processes = processes
+        self.lp_budget = lp_budget
+        self.time_limit = time_limit
+        self.max_stars = max_stars
+        self.max_memory = max_memory
+        self.optimize = optimize
+        self.partial = False
+        self.__deadline = None
+        self.pool = None
         self.logger = logging.getLogger(logger_name)
         self.counterexample_stars = None
         self.layers_bounds = {}
         # dict whose keys are the layers identifier and the values.
         self.stars_dict = dict()
+        self.__stars_bounds = dict()
+
+    def __enter__(self):
+        self.pool = abst.StarPool(self.processes)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.pool.close(terminate=exc_type is not None)
+        self.pool = None
 
     def verify(self, network: networks.NeuralNetwork, prop: Property) -> bool:
         """
@@ -438,19 +593,19 @@ class NeverVerification(VerificationStrategy):
 
         """
 
+        if self.pool is None:
+            with self:
+                return self.verify(network, prop)
+
         self.counterexample_stars = None
+        self.__start_budgets()
+        if self.optimize:
+            network = utils.optimize_network(network)
         abst_network = self.__build_abst_network(network, self.heuristic, self.params)
 
         ver_start_time = time.perf_counter()
 
-        # Compute symbolic bounds first. If the network architecture or the property
-        # does not have a corresponding bound propagation method we skip the computation
-        try:
-            bound_manager = bm.BoundsManager(network, prop)
-            _, _, self.layers_bounds = bound_manager.compute_bounds()
-        except AssertionError:
-            self.logger.warning(f"Warning: Bound propagation unsupported")
-            self.layers_bounds = {}
+        self.__compute_layers_bounds(network, prop)
 
         if isinstance(prop, NeVerProperty):
 
@@ -465,24 +620,34 @@ class NeverVerification(VerificationStrategy):
         # Now we check the intersection of the output starset with the output halfspaces defined by the output
         # constraints of our property of interest. We recall that the property is satisfiable if there exist at least
         # one non-void intersection between the output starset and the halfspaces and SAFE = NOT SAT.
+        # The stars are checked in parallel; unless the counterexamples are needed (complete heuristic) the check
+        # stops at the first non-void intersection. The stars are sorted so that the counterexamples do not depend on
+        # the order of the set.
 
+        need_counterexamples = self.heuristic == 'complete'
+        output_stars = sorted(output_starset.stars, key=abst.star_order_key)
         unsafe_stars = []
-        all_empty = []
+        is_satisfied = False
         for i in range(len(out_coef_mat)):
 
-            empty = True
-            for star in output_starset.stars:
-                out_coef = out_coef_mat[i]
-                out_bias = out_bias_mat[i]
-                temp_star = abst.intersect_with_halfspace(star, out_coef, out_bias)
-                if not temp_star.check_if_empty():
-                    empty = False
-                    if self.heuristic == 'complete':
-                        unsafe_stars.append(temp_star)
+            out_coef = out_coef_mat[i]
+            out_bias = out_bias_mat[i]
+            results = self.pool.imap(abst.halfspace_intersection_is_empty, output_stars, out_coef, out_bias)
+            for star, empty in zip(output_stars, results):
+                if not empty:
+                    is_satisfied = True
+                    if not need_counterexamples:
+                        break
 
-            all_empty.append(empty)
+                    temp_star = abst.intersect_with_halfspace(star, out_coef, out_bias)
+                    temp_star.is_empty = False
+                    unsafe_stars.append(temp_star)
 
-        is_satisfied = not all(all_empty)
+            # Closes the pending parallel checks.
+            results.close()
+
+            if is_satisfied and not need_counterexamples:
+                break
 
         if len(unsafe_stars) > 0:
             self.counterexample_stars = self.__get_counterexample_stars(prop, unsafe_stars)
@@ -492,6 +657,17 @@ class NeverVerification(VerificationStrategy):
 
         return not is_satisfied
 
+    def __compute_layers_bounds(self, network: networks.NeuralNetwork, prop: Property):
+
+        # Compute symbolic bounds first. If the network architecture or the property
+        # does not have a corresponding bound propagation method we skip the computation
+        try:
+            bound_manager = bm.BoundsManager(network, prop)
+            _, _, self.layers_bounds = bound_manager.compute_bounds()
+        except AssertionError:
+            self.logger.warning(f"Warning: Bound propagation unsupported")
+            self.layers_bounds = {}
+
     @staticmethod
     def __build_abst_network(network: networks.NeuralNetwork, heuristic: str, params: List) -> abst.AbsSeqNetwork:
 
@@ -622,20 +798,31 @@ class NeverVerification(VerificationStrategy):
         while current_node is not None:
             time_start = time.perf_counter()
 
+            if isinstance(current_node, (abst.AbsReLUNode, abst.AbsFullyConnectedNode)):
+                current_node.pool = self.pool
+
             if isinstance(current_node, abst.AbsReLUNode):
+                current_node.lp_budget = self.lp_budget
+                cur_layer_bounds = None
                 if bounds_dictionary:
                     cur_layer_bounds = prev_key(bounds_dictionary, current_node.ref_node.identifier)
-                    output_starset = current_node.forward(output_starset, cur_layer_bounds)
 
-                else:
-                    output_starset = current_node.forward(output_starset)
+                self.__apply_budgets(current_node, output_starset, cur_layer_bounds)
+                output_starset = current_node.forward(output_starset, cur_layer_bounds)
                 n_areas.append(current_node.n_areas)
+
+                if self.__deadline is not None and time.time() >= self.__deadline and \
+                        self.__refined_neurons(current_node, cur_layer_bounds) > 0:
+                    # The deadline may have stopped the refinement within the layer.
+                    self.partial = True
             else:
                 output_starset = current_node.forward(output_starset)
 
             if isinstance(current_node, abst.AbsFullyConnectedNode):
                 # dict whose keys are the layers identifier and the values. 
                 self.stars_dict[current_node.identifier] = output_starset
+                self.__stars_bounds[current_node.identifier] = bounds_dictionary.get(current_node.ref_node.identifier) \
+                    if bounds_dictionary else None
 
             time_end = time.perf_counter()
 
@@ -646,15 +833,88 @@ class NeverVerification(VerificationStrategy):
 
         return output_starset, n_areas
 
+    def __start_budgets(self):
+        """
+        Procedure to reset the budgets at the beginning of a verification.
+
+        """
+
+        self.partial = False
+        self.__deadline = None if self.time_limit is None else time.time() + self.time_limit
+
+    @staticmethod
+    def __refined_neurons(relu_node: abst.AbsReLUNode, layer_bounds: AbstractBounds = None) -> int:
+        """
+        Function which returns the maximum number of neurons the heuristic of a ReLU node may refine, considering
+        only the neurons which the layer bounds (if available) do not prove stable.
+
+        """
+
+        if layer_bounds is not None:
+            lower = np.array(layer_bounds.get_lower(), dtype=float).reshape(-1)
+            upper = np.array(layer_bounds.get_upper(), dtype=float).reshape(-1)
+            n_unstable = int(np.count_nonzero(np.logical_and(lower < 10e-15, upper > -10e-15)))
+        else:
+            n_unstable = relu_node.ref_node.in_dim[0]
+
+        if relu_node.heuristic == "given_flags":
+            return min(sum(bool(flag) for flag in relu_node.params), n_unstable)
+        else:
+            return min(relu_node.params[0], n_unstable)
+
+    def __apply_budgets(self, relu_node: abst.AbsReLUNode, abs_input: abst.StarSet,
+                        layer_bounds: AbstractBounds = None):
+        """
+        Procedure which adapts the refinement of a ReLU node to the budgets of the verification: the node is
+        over-approximated if a budget is already exceeded, otherwise the number of neurons it refines is capped
+        so that the stars produced do not exceed the maximum number of stars (each refined neuron can at most
+        double them).
+
+        """
+
+        relu_node.deadline = self.__deadline
+        requested = self.__refined_neurons(relu_node, layer_bounds)
+        if requested == 0:
+            return
+
+        n_stars = len(abs_input.stars)
+        allowed_stars = math.inf
+        if self.max_stars is not None:
+            allowed_stars = self.max_stars
+        if self.max_memory is not None and n_stars > 0:
+            allowed_stars = min(allowed_stars, self.max_memory * n_stars / max(abs_input.get_nbytes(), 1))
+
+        if (self.__deadline is not None and time.time() >= self.__deadline) or n_stars >= allowed_stars:
+            self.logger.warning(f"Budget exceeded: {relu_node.identifier} is over-approximated.")
+            relu_node.heuristic = "best_n_neurons"
+            relu_node.params = [0]
+            self.partial = True
+
+        elif relu_node.heuristic != "given_flags" and allowed_stars < math.inf:
+            cap = int(math.floor(math.log2(allowed_stars / max(n_stars, 1))))
+            if cap < requested:
+                self.logger.info(f"Refinement of {relu_node.identifier} capped to {cap} neurons.")
+                relu_node.params = [cap] + list(relu_node.params[1:])
+                self.partial = True
+
     def get_output_starset(self, network: networks.NeuralNetwork, prop: Property):
 
+        if self.pool is None:
+            with self:
+                return self.get_output_starset(network, prop)
+
         self.counterexample_stars = None
+        self.__start_budgets()
+        if self.optimize:
+            network = utils.optimize_network(network)
         abst_network = self.__build_abst_network(network, self.heuristic, self.params)
 
         computing_start_time = time.perf_counter()
 
+        self.__compute_layers_bounds(network, prop)
+
         if isinstance(prop, NeVerProperty):
-            output_starset, n_areas = self.__compute_output_starset(abst_network, prop)
+            output_starset, n_areas = self.__compute_output_starset(abst_network, prop, self.layers_bounds)
         else:
             raise NotImplementedError
 
@@ -667,7 +927,7 @@ class NeverVerification(VerificationStrategy):
         return self.stars_dict
     
     def return_df_dict(self):
-        df = return_df_dict(self.stars_dict)
+        df = return_df_dict(self.stars_dict, self.__stars_bounds, self.__deadline)
         return df
 
     def __get_counterexample_stars(self, prop: Property, unsafe_stars: List[abst.Star]):
@@ -675,11 +935,13 @@ class NeverVerification(VerificationStrategy):
         if not isinstance(prop, NeVerProperty):
             raise NotImplementedError
 
+        # The first predicate variables of every star are the input variables
         counterexample_stars = []
+        in_dim = prop.in_coef_mat.shape[1]
         for unsafe_star in unsafe_stars:
-            temp_star = abst.Star(prop.in_coef_mat, prop.in_bias_mat)
-            temp_star.predicate_matrix = copy.deepcopy(unsafe_star.predicate_matrix)
-            temp_star.predicate_bias = copy.deepcopy(unsafe_star.predicate_bias)
+            input_basis = np.zeros((in_dim, unsafe_star.n_vars))
+            input_basis[:, :in_dim] = np.identity(in_dim)
+            temp_star = unsafe_star.derive(np.zeros((in_dim, 1)), input_basis)
             counterexample_stars.append(temp_star)
 
         return counterexample_stars
@@ -1,10 +1,18 @@
 
+import os
+import time
+
 import numpy as np
 import networkx
 import matplotlib.pyplot as plt
 
+import InstabilityInspector.pynever.networks as pyn_networks
 import InstabilityInspector.pynever.nodes as pyn_nodes
 import InstabilityInspector.pynever.strategies.abstraction as pyn_abst
+import InstabilityInspector.pynever.strategies.bp.bounds_manager as pyn_bm
+from InstabilityInspector.pynever.strategies.bp.bounds import HyperRectangleBounds
+import InstabilityInspector.pynever.strategies.search as pyn_search
+import InstabilityInspector.pynever.strategies.verification as pyn_ver
 
 
 def print_star_data(p_star: pyn_abst.Star):
@@ -154,6 +162,411 @@ def test_relu():
         print_star_data(star)
 
 
+def test_approx_relu_layer():
+
+    predicate_matrix = np.vstack((np.identity(2), -np.identity(2)))
+    predicate_bias = np.ones((4, 1))
+
+    first_star = pyn_abst.Star(predicate_matrix, predicate_bias)
+    star = list(pyn_abst.single_fc_forward(first_star, np.array([[1.0, 1.0], [1.0, -1.0], [1.0, 0.0]]),
+                                           np.array([[3.0], [0.0], [-2.0]])))[0]
+
+    # The first neuron is positive stable, the second is unstable and the third is negative stable.
+    out_star = pyn_abst.approx_relu_layer(star, np.array([2]), np.array([1]), np.array([-2.0]), np.array([2.0]))
+    print_star_data(out_star)
+
+    assert out_star.predicate_matrix.shape == (7, 3)
+    assert out_star.basis_matrix.shape == (3, 3)
+    assert np.allclose(out_star.basis_matrix[0, :2], star.basis_matrix[0, :])
+    assert np.allclose(out_star.basis_matrix[2, :], 0)
+    assert np.allclose(out_star.get_bounds(1), (0.0, 2.0))
+
+
+def test_relevance_lp_budget():
+
+    predicate_matrix = np.vstack((np.identity(2), -np.identity(2)))
+    predicate_bias = np.ones((4, 1))
+
+    first_star = pyn_abst.Star(predicate_matrix, predicate_bias)
+    star = list(pyn_abst.single_fc_forward(first_star, np.array([[1.0, 0.0], [0.0, 1.0], [0.9, 0.0]]),
+                                           np.zeros((3, 1))))[0]
+
+    # The symbolic bounds of the last two neurons are loose: the LP bounds are [-1, 1] and [-0.9, 0.9].
+    layer_bounds = HyperRectangleBounds(np.array([-1.0, -3.0, -2.0]), np.array([1.0, 3.0, 2.0]))
+    relevances = np.array([1.0, 1.0, 3.0])
+
+    # The LP candidate is chosen with the relevances, and it is ranked before the symbolic area of the second neuron
+    out_stars, areas, tightened = pyn_abst.mixed_single_relu_forward(star, "best_n_neurons_rel", [1, relevances],
+                                                                     layer_bounds, lp_budget=1)
+
+    assert np.allclose(areas, [0.5, 4.5, 0.405 * 3])
+    assert np.array_equal(tightened, [False, False, True])
+    assert len(out_stars) == 2
+    for out_star in out_stars:
+        assert np.allclose(out_star.basis_matrix[2, 2:], 0)
+        assert not np.allclose(out_star.basis_matrix[1, 2:], 0)
+
+
+def test_star_pool():
+
+    predicate_matrix = np.vstack((np.identity(2), -np.identity(2)))
+    predicate_bias = np.ones((4, 1))
+
+    stars = [pyn_abst.Star(predicate_matrix, predicate_bias + k) for k in range(6)]
+    weight = np.array([[1.0, 1.0], [1.0, -1.0]])
+    bias = np.array([[0.5], [0.0]])
+
+    with pyn_abst.StarPool(processes=2, min_parallel_stars=1) as pool:
+        results = pool.starmap(pyn_abst.mixed_single_relu_forward, stars, "best_n_neurons", [1], None)
+
+    for star, (star_set, areas, tightened) in zip(stars, results):
+        expected_set, expected_areas, _ = pyn_abst.mixed_single_relu_forward(star, "best_n_neurons", [1], None)
+        assert len(star_set) == len(expected_set)
+        assert np.allclose(areas, expected_areas)
+        assert tightened.all()
+
+        # The stars computed by the workers share the predicate of the star they come from
+        for out_star in star_set:
+            assert out_star.predicate_blocks[0] is star.predicate_blocks[0]
+
+
+def test_star_pool_shared_predicate():
+
+    predicate_matrix = np.vstack((np.identity(2), -np.identity(2)))
+    first_star = pyn_abst.Star(predicate_matrix, np.ones((4, 1)))
+    weight = np.array([[1.0, 1.0], [1.0, -1.0]])
+
+    # The stars derived from the same star share its predicate blocks, which are copied once for the workers
+    stars = [first_star.derive(first_star.center + k, first_star.basis_matrix, np.array([[1.0, 0.0]]), [0.5 + k])
+             for k in range(6)]
+    with pyn_abst.StarPool(processes=2, min_parallel_stars=1) as pool:
+        results = pool.starmap(pyn_abst.single_fc_forward, stars, weight, np.zeros((2, 1)))
+
+    for star, star_set in zip(stars, results):
+        out_star = list(star_set)[0]
+        assert len(out_star.predicate_blocks) == 2
+        for out_block, block in zip(out_star.predicate_blocks, star.predicate_blocks):
+            assert np.shares_memory(out_block[0], block[0]) and np.shares_memory(out_block[1], block[1])
+        assert np.shares_memory(out_star.predicate_blocks[0][0], first_star.predicate_matrix)
+
+    # The attributes of the stars are fixed
+    rejected = False
+    try:
+        first_star.new_attribute = None
+    except AttributeError:
+        rejected = True
+    assert rejected
+
+
+def test_simplify_predicate():
+
+    # Box -1 <= x_i <= 1 with a duplicate, a looser parallel constraint and a constraint implied by the box.
+    predicate_matrix = np.array([[1.0, 0.0], [2.0, 0.0], [0.0, 1.0], [-1.0, 0.0], [0.0, -1.0], [1.0, 0.0],
+                                 [1.0, 1.0], [1.0, 1.0], [0.0, 0.0]])
+    predicate_bias = np.array([[1.0], [3.0], [1.0], [1.0], [1.0], [1.0], [5.0], [1.5], [0.0]])
+
+    star = pyn_abst.Star(predicate_matrix, predicate_bias)
+    bounds = [star.get_bounds(i) for i in range(2)]
+
+    assert star.simplify_predicate() == 4
+    print_star_data(star)
+
+    simplified_star = pyn_abst.Star(star.predicate_matrix, star.predicate_bias)
+    assert np.allclose([simplified_star.get_bounds(i) for i in range(2)], bounds)
+
+
+def test_emptiness_pre_checks():
+
+    # Box 0 <= x_i <= 1.
+    predicate_matrix = np.vstack((np.eye(2), -np.eye(2)))
+    predicate_bias = np.array([[1.0], [1.0], [0.0], [0.0]])
+
+    star = pyn_abst.Star(predicate_matrix, predicate_bias)
+    assert not star.check_if_empty()
+
+    # The witness of the LP satisfies x_0 + x_1 <= 2, hence no LP is needed.
+    feasible_star = star.derive(star.center, star.basis_matrix, np.array([[1.0, 1.0]]), np.array([[2.0]]))
+    assert feasible_star.is_empty is False
+
+    # x_0 + x_1 >= 3 cannot be satisfied in the box.
+    empty_star = star.derive(star.center, star.basis_matrix, np.array([[-1.0, -1.0]]), np.array([[-3.0]]))
+    assert empty_star.is_empty is True
+
+    # The pre-checks are not conclusive: the LP decides.
+    unknown_star = pyn_abst.Star(predicate_matrix, predicate_bias)
+    unknown_star = unknown_star.derive(star.center, star.basis_matrix, np.array([[-1.0, -1.0]]), np.array([[-1.5]]))
+    assert unknown_star.is_empty is None
+    assert not unknown_star.check_if_empty()
+
+
+def test_get_samples():
+
+    # Triangle x_0 >= 0, x_1 >= 0, x_0 + x_1 <= 1 mapped to a three dimensional space.
+    predicate_matrix = np.array([[-1.0, 0.0], [0.0, -1.0], [1.0, 1.0]])
+    predicate_bias = np.array([[0.0], [0.0], [1.0]])
+    star = pyn_abst.Star(predicate_matrix, predicate_bias, center=np.ones((3, 1)),
+                         basis_matrix=np.array([[1.0, 0.0], [0.0, 1.0], [1.0, -1.0]]))
+
+    samples = star.get_samples(50, num_chains=4)
+    assert samples.shape == (50, 3, 1)
+    assert all(star.check_point_inside(sample, 1e-9) for sample in samples)
+
+    assert star.get_samples(0).shape == (0, 3, 1)
+
+    # The child keeps the starting point of the parent when it strictly satisfies the new constraint.
+    child = star.derive(star.center, star.basis_matrix, np.array([[1.0, 0.0]]), np.array([[0.5]]))
+    samples = child.get_samples(10)
+    assert all(child.check_point_inside(sample, 1e-9) for sample in samples)
+    assert not child.set_start_point(np.array([[0.6], [0.1]]), np.array([[1.0, 0.0]]), np.array([[0.5]]))
+
+
+def build_test_verification(threshold: float = 0.0):
+
+    rng = np.random.default_rng(1)
+    network = pyn_networks.SequentialNetwork("net", "X")
+    network.add_node(pyn_nodes.FullyConnectedNode("fc0", (4,), 10, rng.normal(size=(10, 4)), rng.normal(size=10)))
+    network.add_node(pyn_nodes.ReLUNode("relu0", (10,)))
+    network.add_node(pyn_nodes.FullyConnectedNode("fc1", (10,), 2, rng.normal(size=(2, 10)), rng.normal(size=2)))
+
+    prop = pyn_ver.NeVerProperty(np.vstack((np.identity(4), -np.identity(4))), np.full((8, 1), 0.3),
+                                 [np.array([[1.0, -1.0]])], [np.array([[threshold]])])
+
+    return network, prop
+
+
+def test_verification_budgets():
+
+    network, prop = build_test_verification()
+
+    verifier = pyn_ver.NeverVerification("complete", None, processes=1)
+    verifier.verify(network, prop)
+    assert not verifier.partial
+    assert len(verifier.stars_dict["ABST_fc1"].stars) > 4
+
+    verifier = pyn_ver.NeverVerification("complete", None, processes=1, max_stars=4)
+    verifier.verify(network, prop)
+    assert verifier.partial
+    assert len(verifier.stars_dict["ABST_fc1"].stars) <= 4
+
+
+def test_verification_deadline(monkeypatch):
+
+    rng = np.random.default_rng(3)
+    network = pyn_networks.SequentialNetwork("net", "X")
+    dims = [4, 16, 16, 16, 2]
+    for k in range(len(dims) - 1):
+        network.add_node(pyn_nodes.FullyConnectedNode(f"fc{k}", (dims[k],), dims[k + 1],
+                                                      rng.normal(size=(dims[k + 1], dims[k])),
+                                                      rng.normal(size=dims[k + 1])))
+        if k < len(dims) - 2:
+            network.add_node(pyn_nodes.ReLUNode(f"relu{k}", (dims[k + 1],)))
+
+    _, prop = build_test_verification()
+
+    lp_calls = []
+    get_bounds = pyn_abst.Star.get_bounds
+
+    def counting_get_bounds(star, i):
+        lp_calls.append(i)
+        return get_bounds(star, i)
+
+    monkeypatch.setattr(pyn_abst.Star, 'get_bounds', counting_get_bounds)
+
+    # After the deadline neither the propagation nor the bounds of the layers solve LPs
+    verifier = pyn_ver.NeverVerification("complete", None, processes=1, time_limit=0)
+    verifier.verify(network, prop)
+    df = verifier.return_df_dict()
+    assert verifier.partial
+    assert len(lp_calls) == 0
+    assert np.allclose(df["ABST_fc0_lower"], verifier.layers_bounds["fc0"].get_lower())
+
+    # The time limit is exceeded at most by the layer being computed
+    time_limit = 1.0
+    start = time.time()
+    verifier = pyn_ver.NeverVerification("complete", None, processes=1, time_limit=time_limit)
+    verifier.verify(network, prop)
+    verifier.return_df_dict()
+    assert verifier.partial
+    assert time.time() - start < 3 * time_limit
+
+
+def test_counterexamples_order(monkeypatch):
+
+    network, prop = build_test_verification(1.0)
+
+    checks = []
+    is_empty = pyn_abst.halfspace_intersection_is_empty
+
+    def counting_is_empty(star, coef_mat, bias_mat):
+        checks.append((pyn_abst.star_order_key(star), is_empty(star, coef_mat, bias_mat)))
+        return checks[-1][1]
+
+    monkeypatch.setattr(pyn_abst, 'halfspace_intersection_is_empty', counting_is_empty)
+
+    # The complete heuristic collects all the counterexamples, in the same order in every run
+    keys = []
+    for _ in range(2):
+        checks.clear()
+        verifier = pyn_ver.NeverVerification("complete", None, processes=1)
+        assert not verifier.verify(network, prop)
+        keys.append([pyn_abst.star_order_key(star) for star in verifier.counterexample_stars])
+
+        n_stars = len(verifier.stars_dict["ABST_fc1"].stars)
+        assert len(checks) == n_stars
+        assert checks == sorted(checks)
+
+    assert keys[0] == keys[1]
+    assert 1 < len(keys[0]) < n_stars
+
+    # With the same refinement the other heuristics stop at the first unsafe star
+    complete_checks = list(checks)
+    checks.clear()
+    verifier = pyn_ver.NeverVerification("best_n_neurons", [[10]], processes=1)
+    assert not verifier.verify(network, prop)
+    assert verifier.counterexample_stars is None
+    assert len(checks) < n_stars
+    assert checks == complete_checks[:len(checks)]
+    assert not checks[-1][1] and all(empty for _, empty in checks[:-1])
+
+
+def test_layer_bounds_columns():
+
+    rng = np.random.default_rng(2)
+    network = pyn_networks.SequentialNetwork("net", "X")
+    network.add_node(pyn_nodes.FullyConnectedNode("fc0", (4,), 6, rng.normal(size=(6, 4)), rng.normal(size=6)))
+    network.add_node(pyn_nodes.FullyConnectedNode("fc1", (6,), 5, rng.normal(size=(5, 6)), rng.normal(size=5)))
+    network.add_node(pyn_nodes.ReLUNode("relu0", (5,)))
+    network.add_node(pyn_nodes.FullyConnectedNode("fc2", (5,), 2, rng.normal(size=(2, 5)), rng.normal(size=2)))
+
+    prop = pyn_ver.NeVerProperty(np.vstack((np.identity(4), -np.identity(4))), np.full((8, 1), 0.3),
+                                 [np.array([[1.0, -1.0]])], [np.array([[0.0]])])
+
+    # The per-layer bounds are computed on the layers of the given network
+    df = pyn_bm.BoundsManager(network, prop).return_df_dict()
+    assert list(df.columns) == ["fc0_lower", "fc0_upper", "fc1_lower", "fc1_upper"]
+
+    verifier = pyn_ver.NeverVerification("complete", None, processes=1)
+    verifier.verify(network, prop)
+    assert list(verifier.stars_dict.keys()) == ["ABST_fc0", "ABST_fc1", "ABST_fc2"]
+
+    # verify and get_output_starset propagate the stars on the same network
+    verifier = pyn_ver.NeverVerification("complete", None, processes=1, optimize=True)
+    verifier.get_output_starset(network, prop)
+    starset_keys = list(verifier.stars_dict.keys())
+    verifier.stars_dict = dict()
+    verifier.verify(network, prop)
+    assert list(verifier.stars_dict.keys()) == starset_keys == ["ABST_fc1", "ABST_fc2"]
+
+
+def test_search_frontier():
+
+    for threshold in [0.0, -3.0]:
+        network, prop = build_test_verification(threshold)
+        expected = pyn_ver.NeverVerification("complete", None, processes=1).verify(network, prop)
+
+        for frontier in ['dfs', 'depth', 'violation', 'volume']:
+            search = pyn_ver.SearchVerification({'frontier': frontier})
+            assert search.verify(network, prop)[0] == expected
+            assert search.stats['nodes'] == len(search.stats['node_times'])
+
+        search = pyn_ver.SearchVerification({'processes': 2})
+        assert search.verify(network, prop)[0] == expected
+
+    # The stars of the stable neurons repeat the propagation of their parents
+    network, prop = build_test_verification()
+    uncached = pyn_ver.SearchVerification({'cache_size': 0})
+    cached = pyn_ver.SearchVerification()
+    assert uncached.verify(network, prop) == cached.verify(network, prop)
+    assert cached.stats['nodes'] == uncached.stats['nodes']
+    assert 'cache_hits' not in uncached.stats
+    assert cached.stats['cache_hits'] > 0
+
+
+# File created by the worker which processes the slow star of test_search_slow_star
+SLOW_STAR_FLAG = None
+process_star_worker = pyn_search.process_star_worker
+
+
+def slow_process_star_worker(star, bounds, depth):
+
+    result = process_star_worker(star, bounds, depth)
+    if depth == 1:
+        try:
+            os.close(os.open(SLOW_STAR_FLAG, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return result
+        time.sleep(2.0)
+        result = result[:2] + (result[2] + 2.0,)
+
+    return result
+
+
+def test_search_slow_star(tmp_path, monkeypatch):
+
+    global SLOW_STAR_FLAG
+    SLOW_STAR_FLAG = str(tmp_path / 'slow_star')
+
+    rng = np.random.default_rng(2)
+    network = pyn_networks.SequentialNetwork("net", "X")
+    dims = [4, 10, 10, 2]
+    for k in range(len(dims) - 1):
+        network.add_node(pyn_nodes.FullyConnectedNode(f"fc{k}", (dims[k],), dims[k + 1],
+                                                      rng.normal(size=(dims[k + 1], dims[k])),
+                                                      rng.normal(size=dims[k + 1])))
+        if k < len(dims) - 2:
+            network.add_node(pyn_nodes.ReLUNode(f"relu{k}", (dims[k + 1],)))
+
+    prop = pyn_ver.NeVerProperty(np.vstack((np.identity(4), -np.identity(4))), np.full((8, 1), 0.5),
+                                 [np.array([[1.0, -1.0]])], [np.array([[-3.0]])])
+
+    # One of the two stars of the first split is slow: the other worker keeps processing the rest of the search
+    monkeypatch.setattr(pyn_search, 'process_star_worker', slow_process_star_worker)
+    search = pyn_ver.SearchVerification({'processes': 2, 'cache_size': 0})
+    assert search.verify(network, prop)[0]
+
+    node_times = search.stats['node_times']
+    slow_index = [i for i, node_time in enumerate(node_times) if node_time >= 2.0]
+    assert len(slow_index) == 1
+    assert slow_index[0] > 2
+
+
+def test_symbolic_intersection():
+
+    # The output bounds reach the property only for the higher threshold
+    for threshold, expected in [(0.0, True), (-3.0, False)]:
+        network, prop = build_test_verification(threshold)
+        nn_list = pyn_bm.net2list(network)
+        bounds = pyn_search.get_bounds(network, prop, 'symbolic')
+        in_star = prop.to_input_star()
+        in_star.ref_layer = 0
+
+        assert pyn_search.check_symbolic_intersection(bounds, nn_list, prop) == expected
+        assert pyn_search.intersect_symb_lp(in_star, nn_list, bounds, prop)[0] == \
+            pyn_search.intersect_star_lp(in_star, nn_list, bounds, prop)[0]
+
+
+def test_split_bounds():
+
+    network, prop = build_test_verification()
+    nn_list = pyn_bm.net2list(network)
+    bounds = pyn_search.get_bounds(network, prop, 'symbolic')
+
+    # Concrete outputs of the two layers for random inputs in the input box.
+    inputs = np.random.default_rng(0).uniform(-0.3, 0.3, size=(4, 1000))
+    hidden = np.matmul(nn_list[0].weight, inputs) + nn_list[0].bias[:, None]
+    outputs = np.matmul(nn_list[2].weight, np.maximum(hidden, 0)) + nn_list[2].bias[:, None]
+
+    neuron = int(np.argmax(np.sign(hidden).min(axis=1) != np.sign(hidden).max(axis=1)))
+    for phase, branch in [(-1, hidden[neuron] <= 0), (1, hidden[neuron] >= 0)]:
+        branch_bounds = pyn_search.update_bounds(bounds, nn_list, 1, neuron, phase)
+        out_bounds = branch_bounds['numeric_pre']['fc1']
+
+        assert np.all(out_bounds.get_lower() >= bounds['numeric_pre']['fc1'].get_lower())
+        assert np.all(out_bounds.get_upper() <= bounds['numeric_pre']['fc1'].get_upper())
+        assert np.all(outputs[:, branch] >= out_bounds.get_lower()[:, None] - 1e-9)
+        assert np.all(outputs[:, branch] <= out_bounds.get_upper()[:, None] + 1e-9)
+
+
 def test_abst_acy_net():
 
     first_predicate_matrix = np.array([[-1.0], [1.0]])
@@ -1,4 +1,9 @@
 import math
+import os
+import tempfile
+
+import numpy as np
+import onnx
 
 import InstabilityInspector.pynever.networks as network
 import InstabilityInspector.pynever.nodes as nodes
@@ -265,6 +270,106 @@ def dropout_node_test(converter: conversion.ConversionStrategy):
     assert start_node.identifier == end_node.identifier
 
 
+def external_data_test():
+    print("EXTERNAL DATA TEST")
+    start_network = network.SequentialNetwork("NET_TEST", "X")
+    start_network.add_node(nodes.FullyConnectedNode("FullyConnected_1", (5,), 4))
+    start_network.add_node(nodes.ReLUNode("ReLU_1", (4,)))
+    start_network.add_node(nodes.FullyConnectedNode("FullyConnected_2", (4,), 3))
+    onnx_model = conversion.ONNXConverter().from_neural_network(start_network).onnx_network
+
+    with tempfile.TemporaryDirectory() as folder:
+        model_path = os.path.join(folder, 'model.onnx')
+        onnx.save(onnx_model, model_path, save_as_external_data=True, all_tensors_to_one_file=True,
+                  location='model.data', size_threshold=0)
+
+        # The weights are read-only views of the mapped file
+        alt_network = conversion.load_network_path(model_path)
+        parameters = conversion.get_onnx_parameters(alt_network.onnx_network)
+        assert all(not value.flags.writeable for value in parameters.values())
+
+        end_network = conversion.ONNXConverter().to_neural_network(alt_network)
+        start_node = start_network.get_first_node()
+        end_node = end_network.get_first_node()
+        while start_node is not None:
+            if isinstance(start_node, nodes.FullyConnectedNode):
+                assert (start_node.weight == end_node.weight).all()
+                assert (start_node.bias == end_node.bias).all()
+            start_node = start_network.get_next_node(start_node)
+            end_node = end_network.get_next_node(end_node)
+
+        # The PyTorch parameters are writable copies
+        pytorch_network = conversion.PyTorchConverter().from_neural_network(end_network)
+        for parameter in pytorch_network.pytorch_network.parameters():
+            parameter.data.mul_(2)
+        assert all(not value.flags.writeable for value in parameters.values())
+        del alt_network, parameters, end_network, end_node, pytorch_network
+
+
+def conversion_cache_test():
+    print("CONVERSION CACHE TEST")
+    start_network = network.SequentialNetwork("NET_TEST", "X")
+    start_network.add_node(nodes.FullyConnectedNode("FullyConnected_1", (5,), 4))
+    start_network.add_node(nodes.ReLUNode("ReLU_1", (4,)))
+    start_network.add_node(nodes.FullyConnectedNode("FullyConnected_2", (4,), 3))
+    onnx_model = conversion.ONNXConverter().from_neural_network(start_network).onnx_network
+
+    with tempfile.TemporaryDirectory() as folder:
+        converter = conversion.ONNXConverter(cache_dir=folder)
+        first_network = converter.to_neural_network(conversion.ONNXNetwork("FIRST", onnx_model))
+        second_network = converter.to_neural_network(conversion.ONNXNetwork("SECOND", onnx_model))
+        assert len(os.listdir(folder)) == 1
+        cache_file = os.path.join(folder, os.listdir(folder)[0])
+        umask = os.umask(0o022)
+        os.umask(umask)
+        assert os.stat(cache_file).st_mode & 0o777 == 0o644 & ~umask
+
+        # The networks share the nodes but not the graph
+        assert first_network.identifier == "FIRST" and second_network.identifier == "SECOND"
+        assert first_network.get_first_node() is second_network.get_first_node()
+        second_network.delete_last_node()
+        assert len(first_network.nodes) == 3 and len(second_network.nodes) == 2
+
+        # The network of another process is read from the folder
+        conversion.NETWORK_CACHE.clear()
+        disk_network = converter.to_neural_network(conversion.ONNXNetwork("DISK", onnx_model))
+        uncached_network = conversion.ONNXConverter(use_cache=False).to_neural_network(
+            conversion.ONNXNetwork("UNCACHED", onnx_model))
+        disk_node = disk_network.get_first_node()
+        uncached_node = uncached_network.get_first_node()
+        while uncached_node is not None:
+            assert disk_node.identifier == uncached_node.identifier
+            if isinstance(uncached_node, nodes.FullyConnectedNode):
+                assert (disk_node.weight == uncached_node.weight).all()
+            disk_node = disk_network.get_next_node(disk_node)
+            uncached_node = uncached_network.get_next_node(uncached_node)
+
+    # The networks are stored as arrays and a description of their structure
+    conv_network = network.SequentialNetwork("NET_TEST", "X")
+    conv_network.add_node(nodes.ConvNode("Conv_1", (3, 8, 8), 2, (3, 3), (1, 1), (1, 1, 1, 1), (1, 1), 1, True))
+    conv_network.add_node(nodes.BatchNormNode("BN_1", conv_network.get_last_node().out_dim))
+    arrays = conversion.pack_network(conv_network)
+    assert all(isinstance(value, np.ndarray) and value.dtype != object for value in arrays.values())
+    unpacked_network = conversion.unpack_network(arrays)
+    for start_node, end_node in zip(conv_network.nodes.values(), unpacked_network.nodes.values()):
+        assert type(start_node) is type(end_node)
+        for name, value in vars(start_node).items():
+            if isinstance(value, np.ndarray):
+                assert np.array_equal(value, vars(end_node)[name])
+            else:
+                assert value == vars(end_node)[name] and type(value) is type(vars(end_node)[name])
+    assert unpacked_network.edges == conv_network.edges
+
+    # Only the classes of pynever are built
+    arrays['structure'] = np.array(str(arrays['structure']).replace('"ConvNode"', '"Popen"'))
+    rejected = False
+    try:
+        conversion.unpack_network(arrays)
+    except Exception as e:
+        rejected = 'Popen' in str(e)
+    assert rejected
+
+
 converters = [conversion.ONNXConverter(), conversion.PyTorchConverter()]
 
 for conv in converters:
@@ -284,3 +389,6 @@ for conv in converters:
     reshape_node_test(conv)
     flatten_node_test(conv)
     dropout_node_test(conv)
+
+external_data_test()
+conversion_cache_test()
@@ -1,6 +1,11 @@
+import numpy as np
+import torch
+
 import InstabilityInspector.pynever.networks as pyn_networks
 import InstabilityInspector.pynever.nodes as pyn_nodes
+import InstabilityInspector.pynever.strategies.conversion as pyn_conv
 import InstabilityInspector.pynever.strategies.verification as pyn_ver
+import InstabilityInspector.pynever.utilities as pyn_utils
 import networkx
 import matplotlib.pyplot as plt
 
@@ -153,14 +158,78 @@ def test_acyclic_network():
     plt.show()
 
 
+def test_optimize_network():
 
+    rng = np.random.default_rng(0)
+    network = pyn_networks.SequentialNetwork("Test Optimized Network", "X")
+    network.add_node(pyn_nodes.FullyConnectedNode("FC_1", (4,), 8, rng.normal(size=(8, 4)), rng.normal(size=8)))
+    network.add_node(pyn_nodes.DropoutNode("Dropout_1", (8,)))
+    network.add_node(pyn_nodes.FullyConnectedNode("FC_2", (8,), 6, rng.normal(size=(6, 8)), rng.normal(size=6)))
+    network.add_node(pyn_nodes.BatchNormNode("BN_1", (6,), rng.random(6) + 0.5, rng.normal(size=6),
+                                             rng.normal(size=6), rng.random(6) + 0.1))
+    network.add_node(pyn_nodes.ReLUNode("ReLU_1", (6,)))
+    network.add_node(pyn_nodes.FlattenNode("Flatten_1", (6,)))
+    network.add_node(pyn_nodes.FullyConnectedNode("FC_3", (6,), 2, rng.normal(size=(2, 6)), rng.normal(size=2)))
 
-if __name__ == "__main__":
-    # test_neural_network()
-    # test_sequential_network()
-    test_acyclic_network()
+    optimized = pyn_utils.optimize_network(network)
+
+    assert [node.identifier for node in optimized.nodes.values()] == ["BN_1", "ReLU_1", "FC_3"]
+    assert optimized.nodes["FC_3"] is network.nodes["FC_3"]
+    assert pyn_utils.optimize_network(optimized) is optimized
+
+    net_input = rng.normal(size=(4, 3))
+    assert np.allclose(pyn_utils.execute_network(network, net_input), pyn_utils.execute_network(optimized, net_input),
+                       atol=1e-4)
+
+
+def test_inference_module_cache():
+
+    network = pyn_networks.SequentialNetwork("Test Cached Network", "X")
+    network.add_node(pyn_nodes.FullyConnectedNode("FC_1", (2,), 2, np.array([[1.0, -1.0], [2.0, 0.5]]),
+                                                   np.array([0.5, -4.0])))
+
+    module = pyn_conv.get_inference_module(network)
+    assert pyn_conv.get_inference_module(network) is module
+    assert not module.training
+    assert all(param.dtype == torch.float32 and not param.requires_grad for param in module.parameters())
 
+    net_input = np.array([[1.0], [2.0]])
+    assert np.allclose(pyn_utils.execute_network(network, net_input), [[-0.5], [-1.0]])
 
+    # Adding a node discards the cached module
+    network.add_node(pyn_nodes.ReLUNode("ReLU_1", (2,)))
+    assert pyn_conv.get_inference_module(network) is not module
+    assert np.allclose(pyn_utils.execute_network(network, net_input), [[0.0], [0.0]])
 
 
+def test_search_cloud():
 
+    network = pyn_networks.SequentialNetwork("Test Search Network", "X")
+    network.add_node(pyn_nodes.FullyConnectedNode("FC_1", (2,), 2, np.array([[1.0, -1.0], [2.0, 0.5]]),
+                                                   np.array([0.5, -4.0])))
+    network.add_node(pyn_nodes.ReLUNode("ReLU_1", (2,)))
+
+    ref_output = np.array([[1.0], [2.0]])
+    start_input = np.zeros((2, 1))
+    start_dist = np.linalg.norm(pyn_utils.execute_network(network, start_input) - ref_output)
+
+    np.random.seed(0)
+    best_input, best_output, best_dist = pyn_utils.search_cloud(network, ref_output, start_input, 200,
+                                                                np.ones((2, 1)))
+
+    assert best_input.shape == start_input.shape and best_output.shape == ref_output.shape
+    assert best_dist < start_dist
+    assert np.allclose(pyn_utils.execute_network(network, best_input), best_output, atol=1e-5)
+    assert np.isclose(np.linalg.norm(best_output - ref_output), best_dist, atol=1e-5)
+
+    # Without samples the starting point is kept
+    assert pyn_utils.search_cloud(network, ref_output, start_input, 0, np.ones((2, 1)))[0] is start_input
+
+
+if __name__ == "__main__":
+    # test_neural_network()
+    # test_sequential_network()
+    test_acyclic_network()
+    test_optimize_network()
+    test_inference_module_cache()
+    test_search_cloud()
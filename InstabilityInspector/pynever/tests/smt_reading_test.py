@@ -0,0 +1,205 @@
+import os
+
+import numpy as np
+
+import InstabilityInspector.pynever.strategies.smt_reading as pyn_smt
+import InstabilityInspector.pynever.strategies.verification as pyn_ver
+from InstabilityInspector.pynever.strategies.bp.utils.property_converter import PropertyFormatConverter
+
+VNNCOMP_PATH = os.path.join(os.path.dirname(__file__), 'vnncomp24')
+
+
+def test_parse_box_property():
+
+    parser = pyn_smt.SmtPropertyParser(os.path.join(VNNCOMP_PATH, '2d_prop.vnnlib'), 'X', 'Y')
+    in_coef_mat, in_bias_mat, out_coef_mat, out_bias_mat = parser.parse_property()
+
+    assert parser.x == ['X_0', 'X_1']
+    assert parser.y == ['Y_0', 'Y_1']
+    assert np.allclose(in_coef_mat, [[1, 0], [-1, 0], [0, 1], [0, -1]])
+    assert np.allclose(in_bias_mat, np.ones((4, 1)))
+    assert len(out_coef_mat) == 1
+    assert np.allclose(out_coef_mat[0], [[-1, 0]])
+    assert np.allclose(out_bias_mat[0], [[-2.5]])
+
+    assert np.allclose(parser.in_bounds.get_lower(), [-1, -1])
+    assert np.allclose(parser.in_bounds.get_upper(), [1, 1])
+
+
+def test_box_property():
+
+    prop = pyn_ver.NeVerProperty()
+    prop.from_smt_file(os.path.join(VNNCOMP_PATH, '2d_prop.vnnlib'))
+    box = PropertyFormatConverter(prop).get_vectors()
+
+    assert box.get_lower().dtype == float
+    assert np.allclose(box.get_lower(), [-1, -1])
+    assert np.allclose(box.get_upper(), [1, 1])
+
+    # The matrices built from the box define the same input set
+    matrix_prop = pyn_ver.NeVerProperty(prop.in_coef_mat, prop.in_bias_mat, prop.out_coef_mat, prop.out_bias_mat)
+    matrix_box = PropertyFormatConverter(matrix_prop).get_vectors()
+
+    assert np.allclose(matrix_box.get_lower(), box.get_lower())
+    assert np.allclose(matrix_box.get_upper(), box.get_upper())
+
+
+def test_parse_disjunctive_property(tmp_path):
+
+    prop_path = tmp_path / 'prop.vnnlib'
+    prop_path.write_text('; Linear terms and a disjunction on the output\n'
+                         '(declare-const X_0 Real)\n(declare-const X_1 Real)\n'
+                         '(declare-const Y_0 Real)\n(declare-const Y_1 Real)\n(declare-const Y_2 Real)\n'
+                         '(assert (<= (+ X_0 (* -2.0 X_1)) 0.5))\n'
+                         '(assert (>= X_1 -0.25))\n'
+                         '(assert (or\n'
+                         '    (and (<= Y_0 Y_1) (<= Y_0 Y_2))\n'
+                         '    (and (>= (- Y_2 1.0) 3.5))\n'
+                         '))\n')
+
+    parser = pyn_smt.SmtPropertyParser(str(prop_path), 'X', 'Y')
+    in_coef_mat, in_bias_mat, out_coef_mat, out_bias_mat = parser.parse_property()
+
+    assert parser.in_bounds is None
+
+    assert np.allclose(in_coef_mat, [[1, -2], [0, -1]])
+    assert np.allclose(in_bias_mat, [[0.5], [0.25]])
+    assert len(out_coef_mat) == 2
+    assert np.allclose(out_coef_mat[0], [[1, -1, 0], [1, 0, -1]])
+    assert np.allclose(out_bias_mat[0], [[0], [0]])
+    assert np.allclose(out_coef_mat[1], [[0, 0, -1]])
+    assert np.allclose(out_bias_mat[1], [[-4.5]])
+
+
+def test_property_cache(tmp_path):
+
+    prop_path = tmp_path / 'prop.vnnlib'
+    with open(os.path.join(VNNCOMP_PATH, '2d_prop.vnnlib')) as f:
+        prop_path.write_text(f.read())
+
+    # Without a cache folder nothing is written
+    pyn_smt.SmtPropertyParser(str(prop_path), 'X', 'Y').parse_property()
+    assert os.listdir(tmp_path) == ['prop.vnnlib']
+
+    cache_dir = str(tmp_path / 'cache')
+    parser = pyn_smt.SmtPropertyParser(str(prop_path), 'X', 'Y', cache_dir)
+    expected = parser.parse_property()
+    assert os.path.isfile(parser.get_cache_path())
+    umask = os.umask(0o022)
+    os.umask(umask)
+    assert os.stat(parser.get_cache_path()).st_mode & 0o777 == 0o644 & ~umask
+
+    # The second parser reads the compiled property
+    cached_parser = pyn_smt.SmtPropertyParser(str(prop_path), 'X', 'Y', cache_dir)
+    cached = cached_parser.parse_property()
+
+    assert cached_parser.x == parser.x and cached_parser.y == parser.y
+    assert np.allclose(cached_parser.in_bounds.get_lower(), parser.in_bounds.get_lower())
+    for cached_mat, expected_mat in zip(cached[:2] + tuple(cached[2] + cached[3]),
+                                        expected[:2] + tuple(expected[2] + expected[3])):
+        assert np.allclose(cached_mat, expected_mat)
+
+    # A different content has a different compiled property
+    prop_path.write_text(prop_path.read_text().replace('2.5', '3.5'))
+    changed_parser = pyn_smt.SmtPropertyParser(str(prop_path), 'X', 'Y', cache_dir)
+    assert changed_parser.get_cache_path() != parser.get_cache_path()
+    assert np.allclose(changed_parser.parse_property()[3][0], [[-3.5]])
+
+
+def test_write_property(tmp_path):
+
+    in_coef_mat = np.array([[1, -2], [0, -1], [0, 0.5]])
+    in_bias_mat = np.array([[0.5], [1e-7], [3]])
+    out_coef_mat = [np.array([[1, -1, 0], [1, 0, -1]]), np.array([[0, 0, -1]])]
+    out_bias_mat = [np.zeros((2, 1)), np.array([[-4.5]])]
+
+    for prop_name in ['prop.vnnlib', 'prop.vnnlib.gz']:
+        prop_path = str(tmp_path / prop_name)
+        pyn_ver.NeVerProperty(in_coef_mat, in_bias_mat, out_coef_mat, out_bias_mat).to_smt_file(filepath=prop_path)
+
+        parser = pyn_smt.SmtPropertyParser(prop_path, 'X', 'Y')
+        read_in_coef_mat, read_in_bias_mat, read_out_coef_mat, read_out_bias_mat = parser.parse_property()
+
+        assert np.allclose(read_in_coef_mat, in_coef_mat)
+        assert np.allclose(read_in_bias_mat, in_bias_mat)
+        for read_mat, mat in zip(read_out_coef_mat + read_out_bias_mat, out_coef_mat + out_bias_mat):
+            assert np.allclose(read_mat, mat)
+
+    # The bounds are written exactly, without the exponential notation
+    lower = np.array([-1e-5, 0.1, 2.5e16])
+    assertions = pyn_smt.smt_box_assertions('X', lower, lower + 1)
+    assert 'e' not in assertions.replace('assert', '')
+
+    prop_path = tmp_path / 'box.vnnlib'
+    prop_path.write_text(pyn_smt.smt_declarations('X', 3) + pyn_smt.smt_declarations('Y', 1) + assertions +
+                         pyn_smt.smt_assertions(['(>= Y_0 0.0)']))
+    parser = pyn_smt.SmtPropertyParser(str(prop_path), 'X', 'Y')
+    parser.parse()
+    assert np.array_equal(parser.in_bounds.get_lower(), lower)
+    assert np.array_equal(parser.in_bounds.get_upper(), lower + 1)
+
+
+def test_write_constant_rows(tmp_path, monkeypatch):
+
+    def fail_script(self):
+        raise AssertionError('The property was read with pysmt')
+
+    monkeypatch.setattr(pyn_smt.SmtPropertyParser, '_SmtPropertyParser__parse_script', fail_script)
+
+    # The rows without coefficients are written as constant comparisons and read by the fast reader
+    in_coef_mat = np.array([[1, -2], [0, 0], [0, -1]])
+    in_bias_mat = np.array([[0.5], [2], [1]])
+    out_coef_mat = [np.array([[1, -1, 0], [0, 0, 0]]), np.array([[0, 0, -1]])]
+    out_bias_mat = [np.array([[0], [1]]), np.array([[-4.5]])]
+
+    prop_path = str(tmp_path / 'prop.vnnlib')
+    pyn_ver.NeVerProperty(in_coef_mat, in_bias_mat, out_coef_mat, out_bias_mat).to_smt_file(filepath=prop_path)
+    parser = pyn_smt.SmtPropertyParser(prop_path, 'X', 'Y')
+    read_in_coef_mat, read_in_bias_mat, read_out_coef_mat, read_out_bias_mat = parser.parse_property()
+
+    # The rows that always hold are dropped
+    assert np.allclose(read_in_coef_mat, in_coef_mat[[0, 2]])
+    assert np.allclose(read_in_bias_mat, in_bias_mat[[0, 2]])
+    assert np.allclose(read_out_coef_mat[0], out_coef_mat[0][:1])
+    assert np.allclose(read_out_bias_mat[0], out_bias_mat[0][:1])
+    assert np.allclose(read_out_coef_mat[1], out_coef_mat[1])
+    assert np.allclose(read_out_bias_mat[1], out_bias_mat[1])
+
+    # A row that never holds is kept
+    in_bias_mat[1, 0] = -2
+    pyn_ver.NeVerProperty(in_coef_mat, in_bias_mat, out_coef_mat, out_bias_mat).to_smt_file(filepath=prop_path)
+    read_in_coef_mat, read_in_bias_mat, _, _ = pyn_smt.SmtPropertyParser(prop_path, 'X', 'Y').parse_property()
+    assert np.allclose(read_in_coef_mat, in_coef_mat)
+    assert np.any(np.asarray(read_in_bias_mat)[1] < 0)
+
+    # The names that are not components of the vectors are not supported by the fast reader
+    assert pyn_smt.smt_variable_index('X_12', 'X') == 12
+    rejected = False
+    try:
+        pyn_smt.smt_variable_index('X_0_1', 'X')
+    except pyn_smt.UnsupportedSmtSyntax:
+        rejected = True
+    assert rejected
+
+
+def test_negated_post_condition():
+
+    prop = pyn_ver.NeVerProperty()
+    prop.from_smt_file(os.path.join(VNNCOMP_PATH, '2d_prop.vnnlib'))
+    negated = prop.negated_post_condition()
+
+    assert negated.in_bounds is prop.in_bounds
+    assert len(negated.out_coef_mat) == 1
+    assert np.allclose(negated.out_coef_mat[0], [[1, 0]])
+    assert np.allclose(negated.out_bias_mat[0], [[2.5]])
+
+    # The negation of (y0 - y1 <= 0 and y1 <= 2) or (-y0 <= 3) in disjunctive normal form
+    prop = pyn_ver.NeVerProperty(out_coef_mat=[np.array([[1, -1], [0, 1]]), np.array([[-1, 0]])],
+                                 out_bias_mat=[np.array([[0], [2]]), np.array([[3]])])
+    negated = prop.negated_post_condition()
+
+    assert len(negated.out_coef_mat) == 2
+    assert np.allclose(negated.out_coef_mat[0], [[-1, 1], [1, 0]])
+    assert np.allclose(negated.out_bias_mat[0], [[0], [-3]])
+    assert np.allclose(negated.out_coef_mat[1], [[0, -1], [1, 0]])
+    assert np.allclose(negated.out_bias_mat[1], [[-2], [-3]])
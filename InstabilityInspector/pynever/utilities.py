@@ -7,6 +7,7 @@ import torch
 import torch.nn.functional as funct
 
 import InstabilityInspector.pynever.networks as networks
+import InstabilityInspector.pynever.nodes as nodes
 import InstabilityInspector.pynever.pytorch_layers as ptl
 import InstabilityInspector.pynever.strategies.abstraction as abst
 import InstabilityInspector.pynever.strategies.conversion as cv
@@ -34,15 +35,14 @@ def execute_network(network: networks.NeuralNetwork, net_input: Tensor) -> Tenso
 
     """
 
-    input_t = torch.Tensor(net_input)
+    input_t = torch.as_tensor(net_input, dtype=torch.float32)
 
-    py_net = cv.PyTorchConverter().from_neural_network(network)
-    py_net.pytorch_network.eval()
-    py_net.pytorch_network.float()
+    py_net = cv.get_inference_module(network)
 
-    output = py_net.pytorch_network(input_t.float().T)
+    with torch.no_grad():
+        output = py_net(input_t.T)
 
-    return output.detach().numpy().T
+    return output.numpy().T
 
 
 def combine_batchnorm1d(linear: ptl.Linear, batchnorm: ptl.BatchNorm1d) -> ptl.Linear:
@@ -144,6 +144,135 @@ def combine_batchnorm1d_net(network: networks.SequentialNetwork) -> networks.Seq
     return combined_network
 
 
+def optimize_network(network: networks.NeuralNetwork) -> networks.NeuralNetwork:
+    """
+    Optimization pass on a SequentialNetwork computing the same function with fewer layers:
+    the Dropout nodes and the Reshape and Flatten nodes which do not change the shape are removed,
+    the BatchNorm nodes following a one dimensional FullyConnectedNode are folded in it and consecutive
+    FullyConnectedNodes are merged, unless the merged weight is larger than the two.
+    Each resulting node takes the identifier of the last node it replaces, so that the bounds of the
+    layers before the activation functions keep their keys. The nodes which are not modified are shared
+    with the original network.
+
+    Parameters
+    ----------
+    network : NeuralNetwork
+        The network to optimize.
+
+    Returns
+    ----------
+    NeuralNetwork
+        The optimized network, the network itself if there is nothing to optimize or if it is not sequential.
+
+    """
+
+    if not isinstance(network, networks.SequentialNetwork) or network.is_empty():
+        return network
+
+    optimized_nodes = []
+    changed = False
+
+    current_node = network.get_first_node()
+    while current_node is not None:
+        previous_node = optimized_nodes[-1] if len(optimized_nodes) > 0 else None
+        after_linear = isinstance(previous_node, nodes.FullyConnectedNode)
+
+        is_identity = isinstance(current_node, nodes.DropoutNode) or \
+            (isinstance(current_node, (nodes.ReshapeNode, nodes.FlattenNode)) and
+             tuple(current_node.in_dim) == tuple(current_node.out_dim))
+
+        if is_identity:
+            changed = True
+
+        elif isinstance(current_node, nodes.BatchNormNode) and after_linear and \
+                len(previous_node.in_dim) == 1 and current_node.track_running_stats:
+            optimized_nodes[-1] = fold_batchnorm(previous_node, current_node)
+            changed = True
+
+        # Consecutive linear layers are merged if the product is not larger than the two weights
+        elif isinstance(current_node, nodes.FullyConnectedNode) and after_linear and \
+                current_node.out_features * previous_node.in_features <= \
+                current_node.in_features * (previous_node.in_features + current_node.out_features):
+            optimized_nodes[-1] = merge_fully_connected(previous_node, current_node)
+            changed = True
+
+        else:
+            optimized_nodes.append(current_node)
+
+        current_node = network.get_next_node(current_node)
+
+    if not changed:
+        return network
+
+    optimized_network = networks.SequentialNetwork(network.identifier, network.input_id)
+    for node in optimized_nodes:
+        optimized_network.add_node(node)
+
+    return optimized_network
+
+
+def fold_batchnorm(linear: nodes.FullyConnectedNode, batchnorm: nodes.BatchNormNode) -> nodes.FullyConnectedNode:
+    """
+    Utility function to fold a BatchNormNode in the FullyConnectedNode preceding it, the resulting node
+    takes the identifier of the BatchNormNode.
+
+    Parameters
+    ----------
+    linear : FullyConnectedNode
+        FullyConnectedNode to combine.
+    batchnorm : BatchNormNode
+        BatchNormNode to combine.
+
+    Returns
+    ----------
+    FullyConnectedNode
+        The FullyConnectedNode computing the composition of the two nodes.
+
+    """
+
+    scale = batchnorm.weight / np.sqrt(batchnorm.running_var + batchnorm.eps)
+    bias = linear.bias if linear.has_bias else np.zeros(linear.out_features)
+
+    fused_weight = scale[:, None] * linear.weight
+    fused_bias = scale * (bias - batchnorm.running_mean) + batchnorm.bias
+
+    return nodes.FullyConnectedNode(batchnorm.identifier, linear.in_dim, linear.out_features,
+                                    fused_weight, fused_bias, True)
+
+
+def merge_fully_connected(first: nodes.FullyConnectedNode, second: nodes.FullyConnectedNode) \
+        -> nodes.FullyConnectedNode:
+    """
+    Utility function to merge two consecutive FullyConnectedNodes, the resulting node takes the
+    identifier of the second one.
+
+    Parameters
+    ----------
+    first : FullyConnectedNode
+        The first FullyConnectedNode.
+    second : FullyConnectedNode
+        The FullyConnectedNode following the first one.
+
+    Returns
+    ----------
+    FullyConnectedNode
+        The FullyConnectedNode computing the composition of the two nodes.
+
+    """
+
+    merged_weight = np.matmul(second.weight, first.weight)
+
+    if first.has_bias or second.has_bias:
+        merged_bias = second.bias if second.has_bias else np.zeros(second.out_features)
+        if first.has_bias:
+            merged_bias = np.matmul(second.weight, first.bias) + merged_bias
+        return nodes.FullyConnectedNode(second.identifier, first.in_dim, second.out_features,
+                                        merged_weight, merged_bias, True)
+
+    return nodes.FullyConnectedNode(second.identifier, first.in_dim, second.out_features,
+                                    merged_weight, None, False)
+
+
 def generate_linf_robustness_query(data: Tensor, adv_target: int, bounds: tuple,
                                    num_classes: int, epsilon: float, filepath: str, targeted: bool):
     """
@@ -448,9 +577,9 @@ def input_search(net: networks.NeuralNetwork, ref_output: Tensor, start_input: T
     if max_iter_no_change is None:
         max_iter_no_change = int(max_iter / 10)
 
-    py_net = cv.PyTorchConverter().from_neural_network(net).pytorch_network
-    py_ref_output = torch.from_numpy(ref_output)
-    py_start_input = torch.from_numpy(start_input)
+    py_net = cv.get_inference_module(net)
+    py_ref_output = torch.from_numpy(ref_output).float()
+    py_start_input = torch.from_numpy(start_input).float()
     current_input = py_start_input
     current_input.requires_grad = True
 
@@ -546,28 +675,33 @@ def input_search_cloud(net: networks.NeuralNetwork, ref_output: Tensor, start_in
 
 
 def search_cloud(net: networks.NeuralNetwork, ref_output: Tensor, start_input: Tensor, num_samples: int, scale: Tensor):
-    py_net = cv.PyTorchConverter().from_neural_network(net).pytorch_network
-    py_ref_output = torch.from_numpy(ref_output).squeeze()
-    py_current_input = torch.from_numpy(start_input).squeeze()
-    py_current_output = py_net(py_current_input)
-    best_dist = torch.dist(py_ref_output, py_current_output, p=2)
-    current_input = start_input
-    best_sample = start_input
-
-    for i in range(num_samples):
-
-        sample = np.random.normal(loc=current_input, scale=scale, size=current_input.shape)
-        py_sample = torch.from_numpy(sample).squeeze()
-        py_output = py_net(py_sample)
-        temp_dist = torch.dist(py_ref_output, py_output, p=2)
-        if temp_dist.item() < best_dist.item():
-            best_sample = sample
-            best_dist = temp_dist
+    py_net = cv.get_inference_module(net)
+    py_ref_output = torch.from_numpy(ref_output).squeeze().float()
+    py_current_input = torch.from_numpy(start_input).squeeze().float()
+
+    # The whole cloud of samples is evaluated in a single batch
+    samples = np.random.normal(loc=start_input, scale=scale, size=(num_samples,) + start_input.shape)
+    py_samples = torch.from_numpy(samples).float().reshape((num_samples,) + py_current_input.shape)
+
+    with torch.no_grad():
+        py_current_output = py_net(py_current_input)
+        best_dist = torch.dist(py_ref_output, py_current_output, p=2).item()
+        best_output = py_current_output
+        best_sample = start_input
+
+        py_outputs = py_net(py_samples)
+        dists = torch.linalg.vector_norm((py_outputs - py_ref_output).flatten(start_dim=1), ord=2, dim=1)
+
+    if num_samples > 0:
+        best_index = int(torch.argmin(dists))
+        if dists[best_index].item() < best_dist:
+            best_sample = samples[best_index]
+            best_output = py_outputs[best_index]
+            best_dist = dists[best_index].item()
 
     current_input = best_sample
-    current_output = py_net(torch.from_numpy(current_input).squeeze()).detach().numpy()
-    current_output = np.expand_dims(current_output, axis=1)
-    current_dist = best_dist.item()
+    current_output = np.expand_dims(best_output.numpy(), axis=1)
+    current_dist = best_dist
 
     return current_input, current_output, current_dist
 
@@ -614,9 +748,11 @@ def input_search_lbl(net: networks.SequentialNetwork, ref_output: Tensor, starse
 
         temp_ref_output = temp_current_input
 
-    py_net = cv.PyTorchConverter().from_neural_network(net).pytorch_network
-    py_current_input = torch.from_numpy(temp_current_input)
-    py_current_output = py_net(py_current_input)
+    py_net = cv.get_inference_module(net)
+    py_current_input = torch.from_numpy(temp_current_input).float()
+
+    with torch.no_grad():
+        py_current_output = py_net(py_current_input)
 
     return temp_correct, py_current_input.detach().numpy(), py_current_output.detach().numpy()
 
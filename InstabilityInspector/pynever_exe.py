@@ -1,28 +1,41 @@
-import onnx
 import random
+from typing import Union
+
 import InstabilityInspector.pynever.strategies.verification as pyn_ver
 import InstabilityInspector.pynever.strategies.conversion as pyn_con
-import InstabilityInspector.pynever.strategies.smt_reading as pyn_smt
 import InstabilityInspector.pynever.strategies.bp.bounds_manager as bp
+from InstabilityInspector.pynever.strategies.bp.bounds import HyperRectangleBounds
+
+
+def py_run(network_path: str, prop: Union[str, pyn_ver.NeVerProperty, HyperRectangleBounds], complete: bool,
+           time_limit: float = None, max_stars: int = None, max_memory: int = None):
+    """
+    Computes the bounds of the layers of a network for a property. In complete mode the bounds are computed from
+    the StarSets within the given budgets (seconds, number of stars and bytes of a layer): when a budget is hit
+    the remaining layers are over-approximated and the attribute 'partial' of the returned DataFrame is True.
+    The property is either the path of a VNNLIB file, a NeVerProperty or the input box, so that properties
+    built in memory are not written to disk.
 
+    """
 
-def py_run(network_path: str, prop_path: str, complete: bool):
     net_id = ''.join(str(random.randint(0, 9)) for _ in range(5))
 
-    onnx_network = pyn_con.ONNXNetwork(net_id, onnx.load(network_path))
+    # The conversion of the same file is cached, by path and modification time
+    onnx_model = pyn_con.load_onnx_model(network_path)
+    model_hash = pyn_con.onnx_file_hash(network_path, onnx_model)
+    onnx_network = pyn_con.ONNXNetwork(net_id, onnx_model, model_hash=model_hash)
     network = pyn_con.ONNXConverter().to_neural_network(onnx_network)
 
-    smt_parser = pyn_smt.SmtPropertyParser(prop_path, "X", "Y")
-    smt_parser.parse_property()
-    prop = pyn_ver.NeVerProperty(smt_parser.in_coef_mat, smt_parser.in_bias_mat, smt_parser.out_coef_mat,
-                                 smt_parser.out_bias_mat)
+    prop = to_never_property(prop)
 
     ver_param = [[1000] for _ in range(network.count_relu_layers())]
 
     if complete:
-        verifier = pyn_ver.NeverVerification("best_n_neurons", ver_param)
+        verifier = pyn_ver.NeverVerification("best_n_neurons", ver_param, time_limit=time_limit,
+                                             max_stars=max_stars, max_memory=max_memory)
         verifier.verify(network, prop)
         df_dict = verifier.return_df_dict()
+        df_dict.attrs['partial'] = verifier.partial
         to_ret = df_dict
     else:
         bounds_manager = bp.BoundsManager(network, prop)
@@ -30,3 +43,25 @@ def py_run(network_path: str, prop_path: str, complete: bool):
         to_ret = overapprox_df_dict
 
     return to_ret
+
+
+def to_never_property(prop: Union[str, pyn_ver.NeVerProperty, HyperRectangleBounds]) -> pyn_ver.NeVerProperty:
+    """
+    Builds the NeVerProperty of a VNNLIB file or of an input box, without output constraints.
+    A NeVerProperty is returned as it is.
+
+    """
+
+    if isinstance(prop, pyn_ver.NeVerProperty):
+        return prop
+
+    elif isinstance(prop, HyperRectangleBounds):
+        return pyn_ver.NeVerProperty(out_coef_mat=[], out_bias_mat=[], in_bounds=prop)
+
+    elif isinstance(prop, str):
+        never_prop = pyn_ver.NeVerProperty()
+        never_prop.from_smt_file(prop, "X", "Y")
+        return never_prop
+
+    else:
+        raise Exception(f"Unsupported property: {type(prop)}")
@@ -1,13 +1,13 @@
 
+import multiprocessing
 import os
 import numpy as np
 import re
 
 import onnxmltools
-from onnx import numpy_helper
 
 from InstabilityInspector.pynever import datasets, nodes, networks
-from InstabilityInspector.pynever.strategies import training, conversion
+from InstabilityInspector.pynever.strategies import training, conversion, smt_reading
 import torch
 import torch.optim as opt
 import os
@@ -50,44 +50,47 @@ def con2onnx(model, onnx_folder_path: str):
     return onnx_model
 
 
-def generate_lc_props(eps_noise: float, delta_tol: float, io_pairs: list, folder_path: str):
+def generate_lc_props(eps_noise: float, delta_tol: float, io_pairs: list, folder_path: str, processes: int = 1,
+                      compress: bool = False) -> list:
     # Property: x_i - eps_noise <= X_i <= x_i + eps_noise
     #           y_j - delta_tol <= Y_j <= y_j + delta_tol
+    # Each file is formatted in a single buffer, with processes > 1 the files are
+    # written in parallel and with compress = True they are compressed with gzip
 
     # generate folder for properties if it doesn't exist
     os.makedirs(folder_path, exist_ok=True)
 
-    i = 0
-    for pair in io_pairs:
-        if isinstance(pair[0], np.ndarray):
-            pair_0 = pair[0].tolist()
-        elif isinstance(pair[0], list):
-            pair_0 = pair[0]
-        else:
-            raise ValueError("Input sample must be either numpy array or list.")
+    tasks = [(f'{folder_path}/loc_rob_property_{i}.vnnlib' + ('.gz' if compress else ''), pair, eps_noise, delta_tol)
+             for i, pair in enumerate(io_pairs)]
+
+    if processes > 1 and len(tasks) > 1:
+        chunksize = max(1, len(tasks) // (4 * processes))
+        with multiprocessing.Pool(processes) as pool:
+            return pool.map(write_lc_prop, tasks, chunksize=chunksize)
+
+    return [write_lc_prop(task) for task in tasks]
+
+
+def write_lc_prop(task: tuple) -> str:
+    # Writes the local robustness property of a single pair, returns the path of the file
+    prop_path, pair, eps_noise, delta_tol = task
 
-        n_inputs = len(pair_0)
-        n_outputs = len(pair[1])
+    if not isinstance(pair[0], (np.ndarray, list)):
+        raise ValueError("Input sample must be either numpy array or list.")
 
-        with open(f'{folder_path}/loc_rob_property_{i}.vnnlib', 'w') as prop_file:
-            for n in range(n_inputs):
-                prop_file.write(f'(declare-const X_{n} Real)\n')
-            prop_file.write('\n')
+    x = np.asarray(pair[0], dtype=float).reshape(-1)
+    y = np.asarray(pair[1], dtype=float).reshape(-1)
 
-            for n in range(n_outputs):
-                prop_file.write(f'(declare-const Y_{n} Real)\n')
-            prop_file.write('\n')
+    text = ''.join([smt_reading.smt_declarations('X', len(x)), '\n',
+                    smt_reading.smt_declarations('Y', len(y)), '\n',
+                    smt_reading.smt_box_assertions('X', x - eps_noise, x + eps_noise), '\n',
+                    smt_reading.smt_box_assertions('Y', y - delta_tol, y + delta_tol)])
 
-            for n in range(n_inputs):
-                prop_file.write(f'(assert (>= X_{n} {pair[0][n] - eps_noise}))\n')
-                prop_file.write(f'(assert (<= X_{n} {pair[0][n] + eps_noise}))\n')
-            prop_file.write('\n')
+    with smt_reading.open_smt_file(prop_path, 'w') as prop_file:
+        prop_file.write(text)
 
-            for n in range(n_outputs):
-                prop_file.write(f'(assert (>= Y_{n} {pair[1][n] - delta_tol}))\n')
-                prop_file.write(f'(assert (<= Y_{n} {pair[1][n] + delta_tol}))\n')
+    return prop_path
 
-        i += 1
 
 def hyperect_properties(eps_noise: float, io_pairs: list):
     # Given the io_pair list, it necessary to generate the HyperRectangles object
@@ -114,15 +117,16 @@ def get_fc_weights_biases(model, verbose: bool = False):
     weights = []
     biases = []
 
-    initializer = model.graph.initializer
+    # Read-only views of the initializers, shared with the conversion of the model
+    parameters = conversion.get_onnx_parameters(model)
 
     weights_pattern = re.compile(r'weight$')
     biases_pattern = re.compile(r'bias$')
 
-    for i in initializer:
-        if biases_pattern.search(i.name):
-            biases.append(numpy_helper.to_array(i))
-        elif weights_pattern.search(i.name):
-            weights.append(numpy_helper.to_array(i))
+    for name, value in parameters.items():
+        if biases_pattern.search(name):
+            biases.append(value)
+        elif weights_pattern.search(name):
+            weights.append(value)
 
     return weights, biases
@@ -30,7 +30,10 @@ DATASET_DIR = "../dataset"
 
 class FrequencyAnalyzer():
     def __init__(self, model_path, dataset):
-        self.onnx_model = onnx.load(model_path)
+        # The model is parsed once: the key of the file is computed before its external data is loaded
+        self.onnx_model = pyn_con.load_onnx_model(model_path)
+        self.onnx_model_hash = pyn_con.onnx_file_hash(model_path, self.onnx_model)
+        onnx.load_external_data_for_model(self.onnx_model, os.path.dirname(os.path.abspath(model_path)))
 
         # Convert ONNX model to PyTorch
         self.model = ConvertModel(self.onnx_model)
@@ -148,7 +151,7 @@ class FrequencyAnalyzer():
         for rect in bounds_object_list:
             net_id = ''.join(str(random.randint(0, 9)) for _ in range(5))
 
-            onnx_network = pyn_con.ONNXNetwork(net_id, self.onnx_model)
+            onnx_network = pyn_con.ONNXNetwork(net_id, self.onnx_model, model_hash=self.onnx_model_hash)
             network = pyn_con.ONNXConverter().to_neural_network(onnx_network)
 
             bounds_manager = bp.BoundsManager(network, None)